@@ -0,0 +1,341 @@
+"""
+End-to-end benchmarks of the cluster.
+
+Starts a real `Cluster` and N headless shard processes that use a stub bot,
+drives load through `Client.request` and reports the throughput and the
+p50/p95/p99 latency of every hop as JSON, so the results of two commits can
+be compared with `--compare`.
+
+    python benchmarks/run.py --shards 4 --concurrency 64 --output results.json
+    python benchmarks/run.py --compare results.json
+    python benchmarks/run.py --transports tcp unix
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from discord.ext.cluster import Client, Cluster
+from discord.ext.cluster.errors import NotConnected
+from discord.ext.cluster.transport import MAX_SIZE, UNIX_SCHEME, open_websocket
+from stub import run_shard
+
+HOPS: Dict[str, str] = {
+    "client": "Client.request to reply, as seen by the web application",
+    "cluster": "Cluster forwarding the request to receiving the shard reply",
+    "handler": "Time spent in the route handler, as reported by the shard"
+}
+
+SERIES: Dict[str, str] = {
+    "cluster": "cluster_request_duration_seconds",
+    "handler": "cluster_handler_duration_seconds"
+}
+
+BUCKET = re.compile(r'^(\w+)_bucket\{(.*)\} (\S+)$')
+
+Request = Tuple[str, Dict[str, Any]]
+
+def run_cluster(host: str, port: int, secret_key: Optional[str], unix_path: Optional[str], max_size: int) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(Cluster(host, port, secret_key, unix_path=unix_path, max_size=max_size).start())
+
+def quantile(buckets: List[Tuple[float, float]], q: float) -> Optional[float]:
+    # estimated by linear interpolation inside the bucket, the same way Prometheus does
+    if not buckets or not (total := buckets[-1][1]):
+        return None
+
+    rank, lower, seen = q * total, 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / ((count - seen) or 1)
+        lower, seen = bound, count
+    return lower
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def summarize(samples: List[float]) -> Dict[str, Optional[float]]:
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else None,
+        "p50": percentile(samples, 0.5),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99)
+    }
+
+def parse_buckets(text: str) -> Dict[str, Dict[float, float]]:
+    # the buckets of every shard and endpoint are summed, so each hop has a single histogram
+    histograms: Dict[str, Dict[float, float]] = {}
+    for line in text.splitlines():
+        if not (match := BUCKET.match(line)):
+            continue
+
+        name, labels, value = match.groups()
+        bound = re.search(r'le="([^"]+)"', labels).group(1)
+        series = histograms.setdefault(name, {})
+        series[float(bound)] = series.get(float(bound), 0.0) + float(value)
+    return histograms
+
+async def scrape(args: argparse.Namespace) -> Dict[str, Dict[float, float]]:
+    async with open_websocket(args.target, args.port, "/metrics", extra_headers={"Secret-Key": str(args.secret_key)}) as websocket:
+        await websocket.send("")
+        return parse_buckets(await websocket.recv())
+
+def hop_latency(before: Dict[str, Dict[float, float]], after: Dict[str, Dict[float, float]], name: str) -> Dict[str, Optional[float]]:
+    series, previous = after.get(name, {}), before.get(name, {})
+    buckets = [(bound, count - previous.get(bound, 0.0)) for bound, count in sorted(series.items())]
+    return {
+        "count": int(buckets[-1][1]) if buckets else 0,
+        "mean": None,
+        "p50": quantile(buckets, 0.5),
+        "p95": quantile(buckets, 0.95),
+        "p99": quantile(buckets, 0.99)
+    }
+
+def parse_mix(value: str) -> List[Tuple[str, int]]:
+    mix = []
+    for item in value.split(","):
+        endpoint, _, weight = item.partition("=")
+        mix.append((endpoint.strip(), int(weight or 1)))
+    return mix
+
+def make_request(endpoint: str, args: argparse.Namespace) -> Request:
+    if endpoint == "blob":
+        return endpoint, {"size": args.large_size}
+    if endpoint == "slow":
+        return endpoint, {"delay": args.handler_delay / 1000}
+    return "echo", {"blob": "x" * args.payload_size}
+
+SCENARIOS: Dict[str, Callable[[argparse.Namespace], List[Tuple[str, int]]]] = {
+    "baseline": lambda args: [("echo", 1)],
+    "large": lambda args: [("blob", 1)],
+    "slow": lambda args: [("slow", 1)],
+    "mix": lambda args: parse_mix(args.mix),
+    "churn": lambda args: [("echo", 1)]
+}
+
+async def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    mix = SCENARIOS[name](args)
+    endpoints, weights = [x for x, _ in mix], [y for _, y in mix]
+    requests = [make_request(x, args) for x in random.choices(endpoints, weights, k=args.requests)]
+
+    samples: List[float] = []
+    errors: Dict[str, int] = {}
+    queue = iter(enumerate(requests))
+
+    async def call(client: Client, index: int, request: Request) -> None:
+        started = time.perf_counter()
+        try:
+            response = await client.request(request[0], index % args.shards + 1, deadline=args.timeout, **request[1])
+        except NotConnected:
+            response = {"code": "disconnected"}
+        samples.append(time.perf_counter() - started)
+
+        if (code := response.get("code")) != 200:
+            errors[str(code)] = errors.get(str(code), 0) + 1
+
+    async def worker(client: Client) -> None:
+        for index, request in queue:
+            if name != "churn":
+                await call(client, index, request)
+                continue
+
+            # every request pays for the handshake of a fresh connection
+            async with Client(args.target, args.port, args.secret_key, pool_size=1, codec=args.codec, shared_memory=args.shared_memory, framed=args.framed, max_size=args.max_size) as fresh:
+                await call(fresh, index, request)
+
+    async with Client(args.target, args.port, args.secret_key, pool_size=args.pool_size, codec=args.codec, shared_memory=args.shared_memory, framed=args.framed, max_size=args.max_size) as client:
+        before = await scrape(args)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        after = await scrape(args)
+
+    latency = {"client": summarize(samples)}
+    for hop, series in SERIES.items():
+        latency[hop] = hop_latency(before, after, series)
+
+    return {
+        "mix": dict(mix),
+        "requests": len(samples),
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(samples) / elapsed,
+        "latency": latency
+    }
+
+async def wait_until_ready(args: argparse.Namespace) -> None:
+    deadline = time.monotonic() + 30
+    async with Client(args.target, args.port, args.secret_key, pool_size=1, codec=args.codec, shared_memory=args.shared_memory, framed=args.framed, max_size=args.max_size) as client:
+        for shard_id in range(1, args.shards + 1):
+            while (await client.request("ping", shard_id, deadline=1)).get("code") != 200:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Shard {shard_id} didn't connect to the cluster in time")
+                await asyncio.sleep(0.1)
+
+async def connect_when_ready(args: argparse.Namespace) -> None:
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            return await wait_until_ready(args)
+        except NotConnected:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+async def benchmark(args: argparse.Namespace, suffix: str = "") -> Dict[str, Any]:
+    await connect_when_ready(args)
+
+    results: Dict[str, Any] = {}
+    for name in args.scenarios:
+        print(f"Running {name + suffix!r}...", file=sys.stderr)
+        # a short warmup, so the first scenario doesn't pay for the connections and caches
+        await run_scenario(name, argparse.Namespace(**{**vars(args), "requests": min(args.requests, 100)}))
+        results[name + suffix] = await run_scenario(name, args)
+    return results
+
+def run_transport(args: argparse.Namespace, transport: str, suffix: str) -> Dict[str, Any]:
+    # the cluster always listens on TCP as well, so readiness can be checked the same way
+    args = argparse.Namespace(**{**vars(args), "target": UNIX_SCHEME + args.unix_path if transport == "unix" else args.host})
+    processes = [multiprocessing.Process(
+        target=run_cluster,
+        args=(args.host, args.port, args.secret_key, args.unix_path if transport == "unix" else None, args.max_size),
+        daemon=True
+    )]
+    processes[0].start()
+
+    try:
+        # the shards are started once the cluster listens, so their first connect succeeds
+        wait_for_port(args.host, args.port)
+
+        for shard_id in range(1, args.shards + 1):
+            processes.append(multiprocessing.Process(
+                target=run_shard,
+                args=(shard_id, args.target, args.port, args.secret_key, args.codec, args.shared_memory, args.max_size),
+                daemon=True
+            ))
+            processes[-1].start()
+
+        return asyncio.run(benchmark(args, suffix))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+def wait_for_port(host: str, port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection((host, port), timeout=1).close()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.2f}"
+
+def report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"{'scenario':<14} {'hop':<8} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}", file=sys.stderr)
+
+    for name, result in results["scenarios"].items():
+        for hop, latency in result["latency"].items():
+            throughput = f"{result['throughput']:.0f}" if hop == "client" else ""
+            errors = str(sum(result["errors"].values())) if hop == "client" else ""
+            print(
+                f"{name:<14} {hop:<8} {throughput:>10} {format_ms(latency['p50']):>9} "
+                f"{format_ms(latency['p95']):>9} {format_ms(latency['p99']):>9} {errors:>7}",
+                file=sys.stderr
+            )
+
+        if baseline and (previous := baseline["scenarios"].get(name)):
+            change = (result["throughput"] - previous["throughput"]) / previous["throughput"] * 100
+            p99, old = result["latency"]["client"]["p99"], previous["latency"]["client"]["p99"]
+            print(
+                f"{'':<14} {'vs ' + str(baseline['meta']['revision']):<8} {change:>+9.1f}% "
+                f"p99 {format_ms(old)} -> {format_ms(p99)} ms",
+                file=sys.stderr
+            )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks of the cluster")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=20500)
+    parser.add_argument("--secret-key", default=None)
+    parser.add_argument("--codec", default="json", help="The wire format of the client and the shards")
+    parser.add_argument("--shared-memory", action="store_true", help="Send the large responses through shared memory")
+    parser.add_argument("--framed", action="store_true", help="Send framed requests that the cluster relays without decoding")
+    parser.add_argument("--shards", type=int, default=2, help="How many shard processes to start")
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="How many requests are in-flight at the same time")
+    parser.add_argument("--pool-size", type=int, default=4, help="The connection pool size of the client")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--payload-size", type=int, default=64, help="Bytes of the request payload of `echo`")
+    parser.add_argument("--large-size", type=int, default=512 * 1024, help="Bytes of the response of `blob`, must stay below `--max-size`")
+    parser.add_argument("--max-size", type=int, default=MAX_SIZE, help="The message size limit of the cluster, the shards and the client")
+    parser.add_argument("--handler-delay", type=float, default=50.0, help="Milliseconds the `slow` handler sleeps")
+    parser.add_argument("--mix", default="echo=8,slow=1,blob=1", help="Weighted endpoints of the `mix` scenario")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--transports", nargs="+", default=["tcp"], choices=["tcp", "unix"], help="Run the scenarios over each transport")
+    parser.add_argument("--unix-path", default="/tmp/better-cluster-benchmark.sock")
+    parser.add_argument("--output", help="Write the JSON results to the file instead of stdout")
+    parser.add_argument("--compare", help="A previous JSON result to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    scenarios: Dict[str, Any] = {}
+    for transport in args.transports:
+        # the TCP results keep the plain scenario names, so they compare with older runs
+        scenarios.update(run_transport(args, transport, "" if transport == "tcp" else f"@{transport}"))
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "hops": HOPS,
+            "options": {x: y for x, y in vars(args).items() if x not in ("output", "compare", "secret_key")}
+        },
+        "scenarios": scenarios
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
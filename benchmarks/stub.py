@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+from types import SimpleNamespace
+from typing import Any, Dict, Optional, Tuple
+from discord.ext.cluster import Shard, ClientPayload, SharedMemoryPolicy
+from discord.ext.cluster.transport import MAX_SIZE
+
+class StubBot:
+    """|class|
+
+    Stands in for `discord.ext.commands.Bot`, it has only what `Shard` needs
+    so the benchmarks can run without a Discord connection.
+
+    Parameters:
+    ----------
+    client_id: `int`
+        The ID reported to the cluster as `client_id`
+    """
+
+    __slots__: Tuple[str] = ("user", "cogs")
+
+    def __init__(self, client_id: int) -> None:
+        self.user = SimpleNamespace(id=client_id)
+        self.cogs: Dict[str, Any] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} id={self.user.id}>"
+
+    def dispatch(self, event: str, *args: Any) -> None:
+        pass
+
+@Shard.route()
+async def ping(self, data: ClientPayload) -> Dict:
+    return {}
+
+@Shard.route()
+async def echo(self, data: ClientPayload) -> Dict:
+    return {"echo": data.data.get("blob")}
+
+@Shard.route()
+async def blob(self, data: ClientPayload) -> Dict:
+    return {"blob": "x" * data.data.get("size", 0)}
+
+@Shard.route()
+async def slow(self, data: ClientPayload) -> Dict:
+    await asyncio.sleep(data.data.get("delay", 0))
+    return {}
+
+def run_shard(
+    shard_id: int,
+    host: str,
+    port: int,
+    secret_key: Optional[str],
+    codec: str,
+    shared_memory: bool = False,
+    max_size: Optional[int] = MAX_SIZE
+) -> None:
+    """|method|
+
+    The entry point of a headless shard process
+
+    """
+
+    logging.basicConfig(level=logging.WARNING)
+
+    async def main() -> None:
+        shard = Shard(
+            StubBot(shard_id),
+            shard_id=shard_id,
+            host=host,
+            port=port,
+            secret_key=secret_key,
+            codec=codec,
+            shared_memory=SharedMemoryPolicy(threshold=64 * 1024) if shared_memory else None,
+            max_size=max_size
+        )
+        # the shard keeps reconnecting on its own, so the process only has to stay alive
+        await shard.connect()
+        await asyncio.Future()
+
+    asyncio.run(main())
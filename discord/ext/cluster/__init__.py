@@ -18,3 +18,7 @@ from .cluster import Cluster
 from .client import Client
 from .shard import Shard
 from .objects import ClientPayload
+from .cache import CachePolicy
+from .compression import Compression
+from .sharedmemory import SharedMemoryPolicy
+from .offload import Offload
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+class CachePolicy:
+    """|class|
+
+    Describes how the cluster should cache the responses of an endpoint.
+    The policy is sent to the cluster when the shard connects and cached
+    responses are served without reaching the shard.
+
+    Parameters:
+    ----------
+    ttl: `float`
+        For how many seconds a response is valid
+    max_entries: `int`
+        How many responses can be cached, the least recently used are evicted first
+    keys: `List[str]`
+        Which kwargs form the cache key. If not provided all kwargs are used
+    """
+
+    __slots__: Tuple[str] = ("ttl", "max_entries", "keys")
+
+    def __init__(self, ttl: float, max_entries: int = 1024, keys: Optional[List[str]] = None) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.keys = keys
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} ttl={self.ttl} max_entries={self.max_entries} keys={self.keys!r}>"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "keys": self.keys
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> CachePolicy:
+        return cls(data["ttl"], data.get("max_entries", 1024), data.get("keys"))
+
+    def make_key(self, kwargs: Optional[Dict[str, Any]]) -> str:
+        kwargs = kwargs or {}
+        if self.keys is not None:
+            kwargs = {x: kwargs.get(x) for x in self.keys}
+        return json.dumps(kwargs, sort_keys=True, separators=(",", ":"), default=str)
+
+class ResponseCache:
+    """|class|
+
+    A bounded LRU of the responses for a single endpoint of a shard
+
+    Parameters:
+    ----------
+    policy: `CachePolicy`
+        The policy advertised by the shard
+    """
+
+    __slots__: Tuple[str] = ("policy", "entries", "hits", "misses")
+
+    def __init__(self, policy: CachePolicy) -> None:
+        self.policy = policy
+        self.entries: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} size={len(self.entries)} hits={self.hits} misses={self.misses}>"
+
+    def get(self, kwargs: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        key = self.policy.make_key(kwargs)
+
+        if (entry := self.entries.get(key)) is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+
+        self.misses += 1
+        return None
+
+    def set(self, kwargs: Optional[Dict[str, Any]], response: Dict[str, Any]) -> None:
+        key = self.policy.make_key(kwargs)
+
+        self.entries[key] = (time.monotonic() + self.policy.ttl, response)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.policy.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, kwargs: Optional[Dict[str, Any]] = None) -> None:
+        if kwargs:
+            self.entries.pop(self.policy.make_key(kwargs), None)
+        else:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries)
+        }
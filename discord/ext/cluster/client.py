@@ -1,47 +1,367 @@
 from __future__ import annotations
 
-import json
-import logging
+import asyncio
+import contextlib
 import logging
 from types import TracebackType
 
-from typing import Any, Dict, Optional, Union, Type, Tuple
-from websockets.client import connect
+from uuid import uuid4
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Union, Type, Tuple
+from websockets.client import WebSocketClientProtocol
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from discord.ext.cluster.codec import Codec, get_codec
+from discord.ext.cluster.compression import CompressedCodec, Compression, accepted, advertise
+from discord.ext.cluster.envelope import is_frame, pack_frame, unpack_frame
+from discord.ext.cluster.errors import MessageTooLarge, NotConnected, StreamError, UnknownCompression
+from discord.ext.cluster.offload import Offload
+from discord.ext.cluster.sharedmemory import SharedMemoryReply, read_segment
+from discord.ext.cluster.store import StoreView
+from discord.ext.cluster.transport import MAX_SIZE, backoff, exceeds, is_unix, open_websocket, send_request, too_large
+
+def put_latest(queue: asyncio.Queue, item: Any) -> None:
+    # the subscription queues are bounded, the oldest item makes room for the new one
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+def with_guild(kwargs: Dict[str, Any], guild_id: Optional[int]) -> Dict[str, Any]:
+    # the guild routes the request, but the endpoints that take a guild ID still get it
+    return {**kwargs} if guild_id is None else {**kwargs, "guild_id": guild_id}
+
+class Connection:
+    """|class|
+
+    A single persistent websocket to the cluster. Multiple requests
+    can be in-flight at the same time, each one is tagged with a nonce
+    and the replies are routed back to the waiting coroutine by it.
+
+    Parameters:
+    ----------
+    websocket: `websockets.client.WebSocketClientProtocol`
+        The already opened websocket
+    compression: `Compression`
+        Compresses the large requests
+    max_size: `int`
+        The message size limit of the cluster, larger requests are rejected before they are sent
+    """
+
+    __slots__: Tuple[str] = ("websocket", "codec", "max_size", "waiters", "streams", "task", "logger")
+
+    def __init__(self, websocket: WebSocketClientProtocol, compression: Optional[Compression] = None, max_size: Optional[int] = MAX_SIZE) -> None:
+        self.websocket = websocket
+        self.codec: Codec = CompressedCodec(get_codec(websocket.subprotocol), compression, max_size, accepted(websocket.response_headers))
+        self.max_size = max_size
+        self.waiters: Dict[str, asyncio.Future] = {}
+        self.streams: Dict[str, asyncio.Queue] = {}
+        self.logger = logging.getLogger("discord.ext.cluster")
+        self.task: asyncio.Task = asyncio.create_task(self.wait_for_responses())
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} closed={self.closed} pending={self.pending}>"
+
+    @property
+    def closed(self) -> bool:
+        return self.websocket.closed
+
+    @property
+    def pending(self) -> int:
+        return len(self.waiters) + len(self.streams)
+
+    async def wait_for_responses(self) -> None:
+        try:
+            async for raw in self.websocket:
+                if is_frame(raw):
+                    # the body is the response as the shard encoded it, it isn't decoded if nobody waits for it
+                    header, body = unpack_frame(self.codec.codec, raw)
+                    if (waiter := self.waiters.pop(header.get("nonce"), None)) and not waiter.done():
+                        response = self.codec.decode(body)
+                        waiter.set_result(SharedMemoryReply(response) if header.get("shared_memory") else response)
+                    continue
+
+                data: Dict[str, Any] = self.codec.decode(raw)
+
+                if "nonce" not in data and "error" in data:
+                    # an error about the connection itself, like an invalid secret key
+                    self.fail(data)
+                elif (queue := self.streams.get(data.get("nonce"))) is not None:
+                    put_latest(queue, data)
+                elif "chunk" in data or "event" in data:
+                    continue
+                elif (waiter := self.waiters.pop(data.get("nonce"), None)) and not waiter.done():
+                    response = data.get("response")
+                    waiter.set_result(SharedMemoryReply(response) if data.get("shared_memory") else response)
+        except ConnectionClosed:
+            pass
+        except (MessageTooLarge, UnknownCompression) as error:
+            self.logger.warning(f"Closing the connection to the cluster: {error}")
+            await self.websocket.close(error.close_code, str(error))
+        finally:
+            for waiter in self.waiters.values():
+                if not waiter.done():
+                    waiter.set_exception(NotConnected("The connection to the cluster was closed!"))
+            self.waiters.clear()
+
+            for queue in self.streams.values():
+                put_latest(queue, None)
+
+    def fail(self, response: Dict[str, Any]) -> None:
+        # every request in flight gets the error, the cluster doesn't know their nonces
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.set_result(response)
+        self.waiters.clear()
+
+        for queue in self.streams.values():
+            put_latest(queue, {"response": response})
+
+    async def request(self, payload: Dict[str, Any], timeout: float, framed: bool = False) -> Dict:
+        """|coro|
+
+        Sends the payload and waits for the reply with the same nonce.
+
+        Parameters:
+        ----------
+        payload: `Dict`
+            The request to be sent to the cluster
+        timeout: `float`
+            The deadline of the request in seconds, it is enforced by the cluster and the shard as well
+        framed: `bool`
+            Sends the `kwargs` of the payload apart from the routing fields,
+            so the cluster can pass them to the shard without decoding them
+        """
+
+        def encode(nonce: str) -> bytes:
+            message = {"nonce": nonce, "timeout": timeout, **payload}
+            if framed:
+                return pack_frame(self.codec.codec, message, self.codec.encode(message.pop("kwargs")))
+            return self.codec.encode(message)
+
+        return await send_request(self.waiters, encode, self.websocket.send, self.cancel, timeout, self.max_size)
+
+    async def stream(self, payload: Dict[str, Any], timeout: float, window: int) -> AsyncIterator[Any]:
+        """|asynciterator|
+
+        Sends the payload and yields the chunks with the same nonce until the stream ends.
+
+        Parameters:
+        ----------
+        payload: `Dict`
+            The request to be sent to the cluster
+        timeout: `float`
+            How long to wait for the next chunk in seconds
+        window: `int`
+            How many chunks can be sent before the client has read them
+        """
+
+        nonce = uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self.streams[nonce] = queue
+
+        finished, consumed = False, 0
+        try:
+            encoded = self.codec.encode({
+                "nonce": nonce,
+                "timeout": timeout,
+                "stream": True,
+                "window": window,
+                **payload
+            })
+
+            if exceeds(encoded, self.max_size):
+                finished = True
+                raise StreamError(too_large(len(encoded), self.max_size)["error"], 413)
+
+            try:
+                await self.websocket.send(encoded)
+            except ConnectionClosed:
+                finished = True
+                raise NotConnected("The connection to the cluster was closed!")
+
+            while True:
+                try:
+                    data: Optional[Dict[str, Any]] = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise StreamError("The stream timed out!", 504) from None
+
+                if data is None:
+                    finished = True
+                    raise NotConnected("The connection to the cluster was closed!")
+
+                if "chunk" not in data:
+                    finished = True
+                    if (response := data.get("response") or {}).get("code") != 200:
+                        raise StreamError(response.get("error"), response.get("code"))
+                    return
+
+                yield data["chunk"]
+
+                # the credits are returned in batches, so the reader doesn't send a frame per chunk
+                if (consumed := consumed + 1) >= max(1, window // 2):
+                    await self.websocket.send(self.codec.encode({"nonce": nonce, "credit": consumed}))
+                    consumed = 0
+        finally:
+            self.streams.pop(nonce, None)
+            if not finished:
+                asyncio.create_task(self.cancel(nonce))
+
+    async def subscribe(self, topics: List[str], buffer: int) -> AsyncIterator[Dict[str, Any]]:
+        """|asynciterator|
+
+        Subscribes to the topics and yields the events until the iterator is closed.
+
+        Parameters:
+        ----------
+        topics: `List[str]`
+            The topics to subscribe to
+        buffer: `int`
+            How many events can wait to be read, the oldest ones are dropped above it
+        """
+
+        nonce = uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue(buffer)
+        self.streams[nonce] = queue
+
+        finished = False
+        try:
+            try:
+                await self.websocket.send(self.codec.encode({"nonce": nonce, "subscribe": topics}))
+            except ConnectionClosed:
+                finished = True
+                raise NotConnected("The connection to the cluster was closed!")
+
+            while True:
+                if (data := await queue.get()) is None:
+                    finished = True
+                    raise NotConnected("The connection to the cluster was closed!")
+
+                if "event" not in data:
+                    # the cluster rejected the subscription
+                    finished = True
+                    response = data.get("response") or {}
+                    raise StreamError(response.get("error"), response.get("code"))
+
+                yield data["event"]
+        finally:
+            self.streams.pop(nonce, None)
+            if not finished:
+                asyncio.create_task(self.cancel(nonce))
+
+    async def cancel(self, nonce: str) -> None:
+        # lets the cluster drop the request instead of waiting for the shard
+        with contextlib.suppress(ConnectionClosed):
+            await self.websocket.send(self.codec.encode({"nonce": nonce, "cancel": True}))
+
+    async def close(self) -> None:
+        await self.websocket.close()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.task
 
 class Client:
     """|class|
-    
-    Handles the web application side requests to the bot process 
+
+    Handles the web application side requests to the bot process.
+    Requests are multiplexed over a pool of persistent connections.
 
     Parameters:
     ----------
     host: `str`
-        The host of the cluster
+        The host of the cluster, or `unix://` followed by the socket path
+        if the cluster listens on a Unix domain socket
     port: `int`
         The port of the cluster
     secret_key: `str`
         The authentication that is used when communicating with the cluster
+    pool_size: `int`
+        How many connections should be kept open to the cluster
+    codec: `str`
+        The wire format, can be `json`, `orjson` or `msgpack`.
+        Falls back to `json` if the cluster doesn't support it
+    timeout: `float`
+        The default deadline of the requests in seconds
+    compression: `Compression`
+        Compresses the requests above its threshold instead of using per-message deflate for all of them
+    shared_memory: `bool`
+        Lets the shards send large responses through shared memory. Only enable it
+        when the client runs on the same host as the shards
+    framed: `bool`
+        Sends the requests as framed messages, the cluster reads only the routing header
+        and passes the kwargs and the responses through without decoding them
+    max_size: `int`
+        The largest message in bytes, must match the cluster. Larger requests are rejected
+        with a 413 error before they are sent. `None` disables the limit
+    offload: `Offload`
+        Reads the large responses from shared memory in an executor, so they don't block the event loop
+
+    Attributes:
+    ----------
+    store: `StoreView`
+        The key-value store of the cluster
     """
 
-    __slots__: Tuple[str] = ("host", "port", "secret_key", "logger")
+    __slots__: Tuple[str] = (
+        "host",
+        "port",
+        "secret_key",
+        "pool_size",
+        "codec",
+        "timeout",
+        "compression",
+        "shared_memory",
+        "framed",
+        "max_size",
+        "offload",
+        "store",
+        "logger",
+        "connections",
+        "lock",
+        "refill"
+    )
 
     def __init__(
         self,
         host: str = "127.0.0.1",
         port: int = 20000,
-        secret_key: str = None
+        secret_key: str = None,
+        pool_size: int = 4,
+        codec: str = "json",
+        timeout: float = 30.0,
+        compression: Optional[Compression] = None,
+        shared_memory: bool = False,
+        framed: bool = False,
+        max_size: Optional[int] = MAX_SIZE,
+        offload: Optional[Offload] = None
     ) -> None:
         self.host = host
         self.port = port
         self.secret_key = secret_key
+        self.pool_size = pool_size
+        self.codec: Codec = get_codec(codec)
+        self.timeout = timeout
+        self.compression = compression
+        self.shared_memory = shared_memory
+        self.framed = framed
+        self.max_size = max_size
+        self.offload = offload
+        self.store = StoreView(self.request_store)
         self.logger = logging.getLogger("discord.ext.cluster")
+        self.connections: List[Connection] = []
+        self.lock: asyncio.Lock = None
+        self.refill: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} connected={self.connected} pool_size={self.pool_size}>"
 
     @property
-    def base_url(self) -> Client:
-        return f"ws://{self.host}:{self.port}"
+    def base_url(self) -> str:
+        return self.host if is_unix(self.host) else f"ws://{self.host}:{self.port}"
+
+    @property
+    def connected(self) -> bool:
+        return any(not x.closed for x in self.connections)
 
     async def __aenter__(self) -> Client:
-        return await self
+        await self.connect()
+        return self
 
     async def __aexit__(
         self,
@@ -49,11 +369,96 @@ class Client:
         exc_value: Optional[BaseException],
         traceback: Optional[TracebackType],
     ) -> None:
-        return None
+        await self.close()
 
-    async def request(self, endpoint: str, shard_id: Union[str, int], **kwargs: Any) -> Dict:
+    async def connect(self) -> None:
         """|coro|
-        
+
+        Opens the connection pool. Closed connections are replaced with new ones.
+
+        """
+
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            self.connections = [x for x in self.connections if not x.closed]
+
+            while len(self.connections) < self.pool_size:
+                try:
+                    websocket = await open_websocket(
+                        self.host,
+                        self.port,
+                        "/create_request",
+                        extra_headers={
+                            "Secret-Key": str(self.secret_key),
+                            **advertise(self.compression)
+                        },
+                        subprotocols=[self.codec.name],
+                        compression=None if self.compression else "deflate",
+                        max_size=self.max_size
+                    )
+                except (OSError, InvalidHandshake) as exception:
+                    if not self.connections:
+                        raise NotConnected("Failed to connect to the cluster!") from exception
+                    self.logger.warning("Failed to open a pooled connection to the cluster", exc_info=exception)
+                    break
+                else:
+                    self.connections.append(Connection(websocket, self.compression, self.max_size))
+
+    async def close(self) -> None:
+        """|coro|
+
+        Closes all connections in the pool.
+
+        """
+
+        if self.refill is not None:
+            self.refill.cancel()
+
+        connections, self.connections = self.connections, []
+        await asyncio.gather(*(x.close() for x in connections))
+
+    async def refill_pool(self) -> None:
+        # runs next to the requests, so they don't wait for the handshakes of the missing connections
+        attempt = 0
+        while len([x for x in self.connections if not x.closed]) < self.pool_size:
+            with contextlib.suppress(NotConnected):
+                await self.connect()
+
+            if len([x for x in self.connections if not x.closed]) >= self.pool_size:
+                return
+            await asyncio.sleep(backoff(attempt))
+            attempt += 1
+
+    async def get_connection(self) -> Connection:
+        if not (connections := [x for x in self.connections if not x.closed]):
+            # nothing to serve the request from, so it has to wait for a connection
+            await self.connect()
+            connections = [x for x in self.connections if not x.closed]
+
+        if len(connections) < self.pool_size and (self.refill is None or self.refill.done()):
+            self.refill = asyncio.create_task(self.refill_pool())
+
+        if not connections:
+            raise NotConnected("Failed to connect to the cluster!")
+        return min(connections, key=lambda x: x.pending)
+
+    async def request_store(self, payload: Dict[str, Any]) -> Dict:
+        connection = await self.get_connection()
+        return await connection.request(payload, self.timeout)
+
+    async def request(
+        self,
+        endpoint: str,
+        shard_id: Optional[Union[str, int]] = None,
+        *,
+        guild_id: Optional[int] = None,
+        deadline: Optional[float] = None,
+        **kwargs: Any
+    ) -> Dict:
+        """|coro|
+
         Make a request to the server process.
 
         ----------
@@ -61,21 +466,175 @@ class Client:
             The endpoint to be requestes at the cluster
         shard_id: `str | int`
             Whitch shard should be handling the request
+        guild_id: `int`
+            Can be used instead of `shard_id`, the cluster picks the shard
+            that handles the guild from the Discord shards reported by the shards.
+            It's passed to the endpoint as well, like the other kwargs
+        deadline: `float`
+            The deadline of the request in seconds. If not provided the default of the client is used
         **kwargs: `Any`
             The data for the endpoint
         """
 
-        async with connect(
-            self.base_url + "/create_request", 
-            extra_headers={
-                "Secret-Key": str(self.secret_key),
-                "Shard-ID": shard_id,
-            }
-        ) as ws:
-            await ws.send(json.dumps({
-                "endpoint": endpoint,
-                "kwargs": {**kwargs}
-            }))
-            
-            return json.loads(await ws.recv())
+        if shard_id is None and guild_id is None:
+            raise TypeError("Either shard_id or guild_id is required!")
+
+        connection = await self.get_connection()
+        response = await connection.request({
+            "endpoint": endpoint,
+            **({"guild_id": guild_id} if shard_id is None else {"shard_id": str(shard_id)}),
+            **({"shared_memory": True} if self.shared_memory else {}),
+            "kwargs": with_guild(kwargs, guild_id)
+        }, deadline or self.timeout, self.framed)
+
+        # the flag is set by the cluster next to the response, so a route can't return a descriptor by accident
+        if self.shared_memory and isinstance(response, SharedMemoryReply):
+            if self.offload is None:
+                return read_segment(response["shared_memory"])
+            return await self.offload.read_segment(response["shared_memory"])
+        return response
+
+    async def stream(
+        self,
+        endpoint: str,
+        shard_id: Optional[Union[str, int]] = None,
+        *,
+        guild_id: Optional[int] = None,
+        window: int = 16,
+        deadline: Optional[float] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        """|asynciterator|
+
+        Make a request to an endpoint that is an async generator and iterate over its chunks
+        as they arrive. Raises :class:`StreamError` if the stream ends with an error.
+
+        ----------
+        endpoint: `str`
+            The endpoint to be requested at the cluster
+        shard_id: `str | int`
+            Which shard should be handling the request
+        guild_id: `int`
+            Can be used instead of `shard_id`, it's passed to the endpoint as well
+        window: `int`
+            How many chunks can be in-flight before the shard waits for the client to read them
+        deadline: `float`
+            How long to wait for the next chunk. If not provided the default of the client is used.
+            Streams have no deadline as a whole, one that is idle for longer is cancelled on the shard too
+        **kwargs: `Any`
+            The data for the endpoint
+        """
+
+        if shard_id is None and guild_id is None:
+            raise TypeError("Either shard_id or guild_id is required!")
+
+        connection = await self.get_connection()
+        stream = connection.stream({
+            "endpoint": endpoint,
+            **({"guild_id": guild_id} if shard_id is None else {"shard_id": str(shard_id)}),
+            "kwargs": with_guild(kwargs, guild_id)
+        }, deadline or self.timeout, window)
+
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def subscribe(self, *topics: str, buffer: int = 256) -> AsyncIterator[Dict[str, Any]]:
+        """|asynciterator|
+
+        Subscribe to events published by the shards with :meth:`Shard.publish`.
+        Every event is a dict with the `topic`, the `data` and the `shard` that published it.
+        Raises :class:`NotConnected` if the connection to the cluster is lost.
+
+        ----------
+        *topics: `str`
+            The topics to subscribe to
+        buffer: `int`
+            How many events can wait to be read, when a reader falls behind the oldest ones are dropped
+        """
+
+        connection = await self.get_connection()
+        subscription = connection.subscribe(list(topics), buffer)
+
+        try:
+            async for event in subscription:
+                yield event
+        finally:
+            await subscription.aclose()
+
+    async def broadcast(
+        self,
+        endpoint: str,
+        *,
+        reducer: Optional[str] = None,
+        key: Optional[str] = None,
+        deadline: Optional[float] = None,
+        **kwargs: Any
+    ) -> Dict:
+        """|coro|
+
+        Make a request to every shard that has registered the endpoint.
+        The cluster sends the requests in parallel and collects the replies
+        until the deadline runs out.
+
+        The response contains `responses` which maps every shard ID to its reply
+        and `failed` which lists the shards that errored or didn't respond in time.
+
+        ----------
+        endpoint: `str`
+            The endpoint to be requested at the cluster
+        reducer: `str`
+            Combines the `key` field of every successful reply on the cluster side.
+            Can be `sum`, `concat` or `first_non_null`. The combined value is returned as `result`
+        key: `str`
+            The field of the replies that is passed to the reducer
+        deadline: `float`
+            How long should the cluster wait for the replies. If not provided the default of the client is used
+        **kwargs: `Any`
+            The data for the endpoint
+        """
+
+        connection = await self.get_connection()
+        return await connection.request({
+            "endpoint": endpoint,
+            "broadcast": True,
+            "reducer": reducer,
+            "key": key,
+            "kwargs": {**kwargs}
+        }, deadline or self.timeout)
+
+    async def request_many(
+        self,
+        requests: Iterable[Tuple[str, Union[str, int], Dict[str, Any]]],
+        *,
+        deadline: Optional[float] = None
+    ) -> List[Dict]:
+        """|coro|
+
+        Make multiple requests in a single frame. The cluster splits the batch by shard
+        and every shard receives its part as one frame and runs the endpoints concurrently.
+
+        Returns the responses in the same order as the requests, every response
+        carries its own `code` and `error`.
+
+        ----------
+        requests: `Iterable[Tuple[str, str | int, Dict]]`
+            The `(endpoint, shard_id, kwargs)` of every request
+        deadline: `float`
+            The deadline of the whole batch. If not provided the default of the client is used
+        """
+
+        batch = [
+            {"endpoint": endpoint, "shard_id": str(shard_id), "kwargs": {**kwargs}}
+            for endpoint, shard_id, kwargs in requests
+        ]
+
+        connection = await self.get_connection()
+        response = await connection.request({"batch": batch}, deadline or self.timeout)
 
+        if (responses := response.get("responses")) is None:
+            # the whole batch was rejected, so every request gets the same error
+            return [response for _ in batch]
+        return responses
@@ -3,12 +3,60 @@ from __future__ import annotations
 import asyncio
 import contextlib
 import logging
-import json
+import os
+import random
+import stat
+import time
 
-from uuid import UUID, uuid4
-from typing import Callable, List, Dict, Any, Optional, Tuple, Union
+from http import HTTPStatus
+from uuid import uuid4
+from typing import Awaitable, Callable, Iterable, List, Dict, Any, Optional, Set, Tuple, Union
 from websockets.exceptions import ConnectionClosed, ConnectionClosedError
-from websockets.server import serve, WebSocketServerProtocol
+from websockets.datastructures import Headers
+from websockets.server import serve, unix_serve, WebSocketServerProtocol
+from discord.ext.cluster.cache import CachePolicy, ResponseCache
+from discord.ext.cluster.codec import CODECS, Codec, get_codec
+from discord.ext.cluster.compression import CompressedCodec, Compression, accepted, advertise, algorithm_of
+from discord.ext.cluster.envelope import Envelope, is_frame, pack_frame, unpack_frame
+from discord.ext.cluster.errors import MessageTooLarge, NotConnected, StreamError, UnknownCompression
+from discord.ext.cluster.federation import HashRing, Peer
+from discord.ext.cluster.metrics import Metrics, watch_event_loop
+from discord.ext.cluster.offload import Offload
+from discord.ext.cluster.objects import Outage, Replica, Subscriber
+from discord.ext.cluster.sharedmemory import SharedMemoryReply
+from discord.ext.cluster.store import MISSING, Store
+from discord.ext.cluster.transport import MAX_SIZE, exceeds, is_unix, too_large
+
+def first_non_null(values: Iterable[Any]) -> Any:
+    return next((x for x in values if x is not None), None)
+
+REDUCERS: Dict[str, Callable[[Iterable[Any]], Any]] = {
+    "sum": lambda values: sum(x for x in values if x is not None),
+    "concat": lambda values: [y for x in values if x is not None for y in x],
+    "first_non_null": first_non_null
+}
+
+def parse_snowflake(value: Any) -> Optional[int]:
+    # IDs arrive as integers or as strings, since JavaScript can't represent them as numbers
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value >= 0 else None
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+def least_in_flight(replicas: List[Replica]) -> Replica:
+    return min(replicas, key=lambda x: x.load)
+
+def power_of_two(replicas: List[Replica]) -> Replica:
+    # comparing two random replicas avoids sending every request to the same idle one
+    return min(random.sample(replicas, 2), key=lambda x: x.load)
+
+BALANCERS: Dict[str, Callable[[List[Replica]], Replica]] = {
+    "least_in_flight": least_in_flight,
+    "power_of_two": power_of_two
+}
 
 class Cluster:
     """|class|
@@ -24,206 +72,1221 @@ class Cluster:
         The port for the cluster
     secret_key: `str`
         Used for authentication when handling requests.
+    timeout: `float`
+        The deadline in seconds for requests that don't carry their own
+    max_waiters: `int`
+        How many requests can wait for a shard at the same time
+    peers: `List[str]`
+        The `host:port` addresses of the other clusters in the group.
+        Shard IDs are assigned to the connected nodes by consistent hashing
+        and requests for shards of another node are forwarded to it
+    address: `str`
+        How the other nodes reach this cluster, must match the address in their `peers`.
+        Defaults to `host:port`
+    balancer: `str`
+        How a request picks one of the replicas of a shard ID,
+        can be `least_in_flight` or `power_of_two`
+    compression: `Compression`
+        Compresses the messages above its threshold instead of using per-message deflate for all of them
+    unix_path: `str`
+        Also listens on a Unix domain socket at the path. Shards and clients
+        on the same host can connect to it with `unix://<path>` as the host
+    tcp: `bool`
+        Whether to listen on `host:port`, can be disabled if `unix_path` is given
+    grace_period: `float`
+        How many seconds the requests for a shard that lost its connection wait for it to reconnect.
+        They are sent once it registers again, `0` rejects them right away
+    max_buffered: `int`
+        How many requests can wait for a reconnecting shard, the rest are rejected with a retryable error
+    event_buffer: `int`
+        How many published events can wait for a subscriber, the oldest ones are dropped above it
+    store_max_bytes: `int`
+        The memory cap of the key-value store, the least recently used keys are evicted above it.
+        With peers every key is kept by the node that owns it on the ring
+    offload: `Offload`
+        Encodes and decodes the large messages in an executor, so they don't hold up the other connections
+    max_size: `int`
+        The largest message in bytes the cluster accepts, a larger one closes the connection it was sent on.
+        Replies above it are replaced with a 413 error. `None` disables the limit
+
+    Attributes:
+    ----------
+    metrics: `Metrics`
+        Request counts, latency histograms and connection gauges.
+        Also served in the Prometheus text format on the `/metrics` path
     """
 
-    __slots__: Tuple[str] = ("host", "port", "secret_key", "logger", "shards", "waiters", "handlers")
+    __slots__: Tuple[str] = (
+        "host",
+        "port",
+        "secret_key",
+        "timeout",
+        "max_waiters",
+        "address",
+        "peers",
+        "ring",
+        "balancer",
+        "compression",
+        "unix_path",
+        "tcp",
+        "grace_period",
+        "max_buffered",
+        "event_buffer",
+        "logger",
+        "shards",
+        "discord_shards",
+        "guild_table",
+        "outages",
+        "topics",
+        "store",
+        "offload",
+        "max_size",
+        "caches",
+        "waiters",
+        "streams",
+        "credits",
+        "requests",
+        "handlers",
+        "operations",
+        "metrics"
+    )
 
     def __init__(
         self,
         host: str = "127.0.0.1",
         port: int = 20000,
-        secret_key: str = None
+        secret_key: str = None,
+        timeout: float = 60.0,
+        max_waiters: int = 10000,
+        peers: Optional[List[str]] = None,
+        address: Optional[str] = None,
+        balancer: str = "least_in_flight",
+        compression: Optional[Compression] = None,
+        unix_path: Optional[str] = None,
+        tcp: bool = True,
+        grace_period: float = 10.0,
+        max_buffered: int = 1000,
+        event_buffer: int = 256,
+        store_max_bytes: int = 64 * 1024 * 1024,
+        offload: Optional[Offload] = None,
+        max_size: Optional[int] = MAX_SIZE
     ) -> None:
         self.host = host
         self.port = port
         self.secret_key = secret_key
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.address = address or f"{host}:{port}"
+        self.compression = compression
+        self.unix_path = unix_path
+        self.tcp = tcp
+        self.grace_period = grace_period
+        self.max_buffered = max_buffered
+        self.event_buffer = event_buffer
+        self.peers: Dict[str, Peer] = {
+            x: Peer(x, secret_key, self.update_ring, compression, max_size) for x in peers or [] if x != self.address
+        }
+        self.ring = HashRing([self.address])
+        self.balancer = BALANCERS[balancer]
         self.logger = logging.getLogger("discord.ext.cluster")
         
-        self.shards: Dict[str, Tuple[WebSocketServerProtocol, List, int]] = {}
-        self.waiters: Dict[UUID, WebSocketServerProtocol] = {}
+        self.shards: Dict[str, List[Replica]] = {}
+        self.discord_shards: Dict[str, Tuple[List[int], int]] = {}
+        self.guild_table: List[Optional[str]] = []
+        self.outages: Dict[str, Outage] = {}
+        self.topics: Dict[str, Set[Subscriber]] = {}
+        self.store = Store(store_max_bytes)
+        self.offload = offload
+        self.max_size = max_size
+        self.caches: Dict[Tuple[str, str], ResponseCache] = {}
+        self.waiters: Dict[str, Tuple[asyncio.Future, WebSocketServerProtocol]] = {}
+        self.streams: Dict[str, Tuple[WebSocketServerProtocol, Optional[str]]] = {}
+        self.credits: Dict[Tuple[WebSocketServerProtocol, Optional[str]], Callable[[int], Awaitable[None]]] = {}
+        self.requests: Dict[WebSocketServerProtocol, Dict[str, asyncio.Task]] = {}
         self.handlers: Dict[str, Callable] = {
             "/initialize_shard": self.initialize_shard,
-            "/disconnect_shard": self.disconnect_shard,
             "/create_request": self.create_request,
-            "/return_response": self.return_response
+            "/metrics": self.send_metrics
         }
+        self.operations: Dict[str, Callable] = {
+            "invalidate": self.invalidate_cache,
+            "update_endpoints": self.update_endpoints,
+            "disconnect": self.disconnect_replica,
+            "publish": self.publish_event,
+            "request": self.shard_request
+        }
+
+        self.metrics = Metrics()
+        self.metrics.describe("cluster_requests_total", "counter", "Requests forwarded to the shards")
+        self.metrics.describe("cluster_errors_total", "counter", "Forwarded requests that didn't return code 200")
+        self.metrics.describe("cluster_in_flight", "gauge", "Requests waiting for a shard")
+        self.metrics.describe("cluster_request_duration_seconds", "histogram", "Time from forwarding a request to receiving the shard response")
+        self.metrics.describe("cluster_handler_duration_seconds", "histogram", "Time spent in the route handler as reported by the shard")
+        self.metrics.describe("cluster_connections", "gauge", "Open websocket connections by path, unknown paths are counted as other")
+        self.metrics.describe("cluster_waiters", "gauge", "Size of the waiter table")
+        self.metrics.describe("cluster_cache_hits_total", "counter", "Responses served from the cluster cache")
+        self.metrics.describe("cluster_cache_misses_total", "counter", "Cache lookups that had to reach the shard")
+        self.metrics.describe("cluster_forwarded_total", "counter", "Requests forwarded to the peer that owns the shard")
+        self.metrics.describe("cluster_peers", "gauge", "Connected peers")
+        self.metrics.describe("cluster_replicas", "gauge", "Connections registered under a shard ID")
+        self.metrics.describe("cluster_buffered_requests", "gauge", "Requests waiting for a shard to reconnect")
+        self.metrics.describe("cluster_events_total", "counter", "Events published by the shards")
+        self.metrics.describe("cluster_events_dropped_total", "counter", "Events dropped because the buffer of a subscriber was full")
+        self.metrics.describe("cluster_subscribers", "gauge", "Subscriptions by topic")
+        self.metrics.describe("cluster_store_keys", "gauge", "Keys in the key-value store")
+        self.metrics.describe("cluster_store_bytes", "gauge", "Bytes taken by the keys and values of the store")
+        self.metrics.describe("cluster_store_evictions_total", "counter", "Keys evicted because of the memory cap of the store")
+
+        if compression is not None:
+            compression.describe(self.metrics, "cluster")
+        if offload is not None:
+            offload.describe(self.metrics, "cluster")
+
+        self.metrics.collector("cluster_waiters", lambda: [({}, len(self.waiters))])
+        self.metrics.collector("cluster_replicas", lambda: [({"shard": id}, len(replicas)) for id, replicas in self.shards.items()])
+        self.metrics.collector("cluster_buffered_requests", lambda: [({"shard": id}, x.waiting) for id, x in self.outages.items()])
+        self.metrics.collector("cluster_store_keys", lambda: [({}, len(self.store.entries))])
+        self.metrics.collector("cluster_store_bytes", lambda: [({}, self.store.size)])
+        self.metrics.collector("cluster_store_evictions_total", lambda: [({}, self.store.evictions)])
+        self.metrics.collector("cluster_subscribers", lambda: [({"topic": x}, len(y)) for x, y in self.topics.items()])
+        self.metrics.collector("cluster_peers", lambda: [({}, sum(x.connected for x in self.peers.values()))])
+        self.metrics.collector("cluster_cache_hits_total", lambda: [
+            ({"shard": id, "endpoint": endpoint}, cache.hits) for (id, endpoint), cache in self.caches.items()
+        ])
+        self.metrics.collector("cluster_cache_misses_total", lambda: [
+            ({"shard": id, "endpoint": endpoint}, cache.misses) for (id, endpoint), cache in self.caches.items()
+        ])
+
+    def codec(self, websocket: WebSocketServerProtocol) -> Codec:
+        return CompressedCodec(get_codec(websocket.subprotocol), self.compression, self.max_size, accepted(websocket.request_headers))
+
+    async def send(self, websocket: WebSocketServerProtocol, data: Dict[str, Any], key: Optional[Tuple[str, str]] = None) -> None:
+        if self.offload is None:
+            message = self.codec(websocket).encode(data)
+        else:
+            message = await self.offload.encode(self.codec(websocket), data, key)
+
+        if exceeds(message, self.max_size) and "response" in data:
+            # the other side would close the connection and fail every request multiplexed on it
+            message = self.codec(websocket).encode({**data, "response": too_large(len(message), self.max_size)})
+        await websocket.send(message)
+
+    async def decode(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> Dict[str, Any]:
+        if self.offload is None:
+            return self.codec(websocket).decode(message)
+        return await self.offload.decode(self.codec(websocket), message)
 
     def is_secure(self, websocket: WebSocketServerProtocol) -> bool:
-        if (key := websocket.request_headers.get("Secret-Key")):
+        return self.is_valid_key(websocket.request_headers)
+
+    def is_valid_key(self, headers: Headers) -> bool:
+        if (key := headers.get("Secret-Key")):
             return str(key) == str(self.secret_key)
         return bool(self.secret_key is None)
 
+    def register_shard(self, id: str, websocket: WebSocketServerProtocol, data: Dict[str, Any]) -> Replica:
+        replica = Replica(websocket, data.get("endpoints"), data.get("client_id"), bool(data.get("replica")), data.get("codecs"))
+
+        if not (replicas := self.shards.setdefault(id, [])):
+            # a new shard process starts with empty caches
+            self.clear_caches(id)
+        replicas.append(replica)
+
+        if (shards := data.get("discord_shards")) is not None:
+            # re-inserted, so the most recent registration decides the shard count
+            self.discord_shards.pop(id, None)
+            self.discord_shards[id] = shards["ids"], shards["count"]
+            self.update_guild_table()
+
+        self.sync_caches(id, data.get("cache"))
+        return replica
+
+    def drop_shard(self, id: str, keep_guilds: bool = False) -> List[Replica]:
+        replicas = self.shards.pop(id, [])
+        self.clear_caches(id)
+
+        if not keep_guilds and self.discord_shards.pop(id, None) is not None:
+            self.update_guild_table()
+        return replicas
+
+    def start_outage(self, id: str) -> None:
+        if id in self.outages:
+            return
+
+        loop = asyncio.get_running_loop()
+        self.outages[id] = Outage(loop.create_future(), loop.call_later(self.grace_period, self.end_outage, id, False))
+
+    def end_outage(self, id: str, recovered: bool) -> None:
+        if (outage := self.outages.pop(id, None)) is None:
+            return
+
+        outage.handle.cancel()
+        outage.future.set_result(recovered)
+
+        if not recovered:
+            # the guilds were kept for the buffered requests, the shard isn't coming back for them
+            if self.discord_shards.pop(id, None) is not None:
+                self.update_guild_table()
+            self.logger.warning(f"Shard {id!r} didn't reconnect within {self.grace_period}s, {outage.waiting} buffered requests have failed")
+
+    async def wait_for_shard(self, id: str, timeout: float) -> Optional[float]:
+        """|coro|
+
+        Waits for a reconnecting shard and returns the time left from the timeout,
+        or `None` if the shard isn't reconnecting, the buffer is full or it didn't come back in time
+
+        """
+
+        if (outage := self.outages.get(id)) is None or outage.waiting >= self.max_buffered:
+            return None
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        outage.waiting += 1
+
+        try:
+            # shielded, so a request that times out doesn't resolve the future for the others
+            recovered = await asyncio.wait_for(asyncio.shield(outage.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            outage.waiting -= 1
+        return timeout - (loop.time() - started) if recovered else None
+
+    def update_guild_table(self) -> None:
+        if not self.discord_shards:
+            self.guild_table = []
+            return
+
+        # processes that still report an older shard count are left out until they reconnect
+        count = self.discord_shards[next(reversed(self.discord_shards))][1]
+        table: List[Optional[str]] = [None] * count
+
+        for id, (ids, total) in self.discord_shards.items():
+            if total == count:
+                for index in ids:
+                    table[index % count] = id
+        self.guild_table = table
+
+    def resolve_guild(self, guild_id: int) -> Optional[str]:
+        """|method|
+
+        Returns the shard ID of the process that handles the guild,
+        the same way Discord assigns guilds to shards
+
+        """
+
+        if not self.guild_table:
+            return None
+        return self.guild_table[(guild_id >> 22) % len(self.guild_table)]
+
+    def find_replica(self, id: Optional[str], websocket: WebSocketServerProtocol) -> Optional[Replica]:
+        return next((x for x in self.shards.get(id, ()) if x.websocket is websocket), None)
+
+    def remove_replica(self, websocket: WebSocketServerProtocol, intentional: bool = False) -> None:
+        if not (replica := self.find_replica(id := websocket.request_headers.get("Shard-ID"), websocket)):
+            return
+
+        self.shards[id].remove(replica)
+        if self.shards[id]:
+            return self.logger.warning(f"A replica of shard {id!r} (ID: {replica.client_id}) has been disconnected, {len(self.shards[id])} left")
+
+        # a shard that disconnected on purpose, or closed the connection normally, isn't coming back
+        lost = not intentional and websocket.close_code != 1000 and self.grace_period > 0
+        self.drop_shard(id, keep_guilds=lost)
+
+        if not lost:
+            return self.logger.warning(f"Shard {id!r} (ID: {replica.client_id}) has been disconnected manually")
+
+        self.logger.warning(f"Shard {id!r} (ID: {replica.client_id}) has lost its connection")
+        self.start_outage(id)
+
+    def select(self, id: str, *endpoints: str) -> Optional[Replica]:
+        """|method|
+
+        Picks the replica of the shard ID that should handle the endpoints
+
+        """
+
+        candidates = [
+            x for x in self.shards.get(id, ())
+            if not x.websocket.closed and all(y in x.endpoints for y in endpoints)
+        ]
+
+        if len(candidates) > 1:
+            return self.balancer(candidates)
+        return candidates[0] if candidates else None
+
+    def serves(self, id: str, endpoint: Optional[str]) -> bool:
+        return any(endpoint in x.endpoints for x in self.shards.get(id, ()))
+
+    def sync_caches(self, id: str, policies: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        for endpoint, policy in (policies or {}).items():
+            if (id, endpoint) not in self.caches:
+                self.caches[id, endpoint] = ResponseCache(CachePolicy.from_dict(policy))
+
+        for key in [x for x in self.caches if x[0] == id and not self.serves(id, x[1])]:
+            del self.caches[key]
+
+    def clear_caches(self, id: str) -> None:
+        for key in [x for x in self.caches if x[0] == id]:
+            del self.caches[key]
+
+    def cache_stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """|method|
+
+        Returns the hit and miss counters and the size of every response cache,
+        grouped by shard ID and endpoint.
+
+        """
+
+        stats: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for (id, endpoint), cache in self.caches.items():
+            stats.setdefault(id, {})[endpoint] = cache.stats()
+        return stats
+
+    def owner(self, id: str) -> Optional[Peer]:
+        """|method|
+
+        Returns the peer that owns the shard ID or `None` if it's owned by this node
+
+        """
+
+        if (node := self.ring.owner(id)) != self.address:
+            return self.peers.get(node)
+        return None
+
+    def update_ring(self) -> None:
+        nodes = [self.address, *(x for x, y in self.peers.items() if y.connected)]
+        if nodes == self.ring.nodes:
+            return
+
+        self.ring = HashRing(nodes)
+        self.logger.info(f"The nodes of the group have changed: {self.ring.nodes!r}")
+        asyncio.create_task(self.rebalance())
+
+    async def rebalance(self) -> None:
+        # shards that now belong to another node reconnect to it, the close reason tells them where
+        for id, replicas in list(self.shards.items()):
+            if (peer := self.owner(id)) is not None:
+                self.drop_shard(id)
+
+                self.logger.info(f"Shard {id!r} has been moved to {peer.address}")
+                await asyncio.gather(*(x.websocket.close(4001, peer.address) for x in replicas))
+
+    async def forward_to_peer(self, peer: Peer, data: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        # the forwarded flag stops the peer from forwarding it again while the nodes disagree about the ring,
+        # shared memory is only kept for peers on the same host
+        self.metrics.inc("cluster_forwarded_total", peer=peer.address)
+        skipped = ("nonce", "timeout") if is_unix(peer.address) else ("nonce", "timeout", "shared_memory")
+        return await peer.request({
+            **{x: y for x, y in data.items() if x not in skipped},
+            "forwarded": True
+        }, timeout)
+
     async def initialize_shard(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> None:
+        if (replica := self.find_replica(id := websocket.request_headers.get("Shard-ID"), websocket)):
+            # the shard is already registered, so every other message is a response or an operation
+            return await self.process_shard_message(id, replica, message)
+
         if not self.is_secure(websocket):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Invalid secret key!",
-                    "code": 403
-                }, separators=(", ", ": "))
-            )
+            return await self.send(websocket, {
+                "error": "Invalid secret key!",
+                "code": 403
+            })
 
         if not (id := websocket.request_headers.get("Shard-ID")):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Missing shard ID!",
-                    "code": 500
-                }, separators=(", ", ": "))
-            )
+            return await self.send(websocket, {
+                "error": "Missing shard ID!",
+                "code": 500
+            })
+
+        if (peer := self.owner(id)) is not None:
+            return await self.send(websocket, {
+                "error": f"Shard with ID {id!r} is owned by {peer.address}!",
+                "code": 307,
+                "owner": peer.address
+            })
         
-        if (data := self.shards.get(id)):
+        data: Dict[str, Any] = self.codec(websocket).decode(message)
+
+        if (replicas := self.shards.get(id)) and data.get("replica") and all(x.replicated for x in replicas):
+            self.register_shard(id, websocket, data)
+
+            await self.send(websocket, {
+                "message": "Successfuly connected to the cluster!",
+                "code": 200
+            })
+
+            self.logger.info(f"Shard {id!r} has a new replica, {len(replicas)} in rotation")
+
+        elif replicas:
             try:
-                await (await data[0].ping())
+                for replica in replicas:
+                    await (await replica.websocket.ping())
             except ConnectionClosed:
-                del self.shards[id]
-                self.logger.warning(f"Shard {id!r} (ID: {data[2]}) has been replaced by {websocket.id}. The reason is PING timeout")
+                self.drop_shard(id)
+                self.logger.warning(f"Shard {id!r} (ID: {replica.client_id}) has been replaced by {websocket.id}. The reason is PING timeout")
             
-                data: Dict[str, Any] = json.loads(message)
-
-                self.shards[id] = websocket, data.get("endpoints"), data.get("client_id")
-                return await websocket.send(
-                    json.dumps({
-                        "message": "Successfuly connected to the cluster!",
-                        "code": 200
-                    }, separators=(", ", ": "))
-                )
+                self.register_shard(id, websocket, data)
+                return await self.send(websocket, {
+                    "message": "Successfuly connected to the cluster!",
+                    "code": 200
+                })
             else:
-                return await websocket.send(
-                    json.dumps({
-                        "error": f"Shard with ID {id!r} already exists!",
-                        "code": 500
-                    }, separators=(", ", ": "))
-                )
+                return await self.send(websocket, {
+                    "error": f"Shard with ID {id!r} already exists!",
+                    "code": 500
+                })
         
         else:
-            data: Dict[str, Any] = json.loads(message)
-            
-            self.shards[id] = websocket, data.get("endpoints"), data.get("client_id")
-            
-            await websocket.send(
-                json.dumps({
-                    "message": "Successfuly connected to the cluster!",
-                    "code": 200
-                }, separators=(", ", ": "))
-            )
+            self.register_shard(id, websocket, data)
+
+            await self.send(websocket, {
+                "message": "Successfuly connected to the cluster!",
+                "code": 200
+            })
 
             self.logger.info(f"Shard {id!r} has been connected!")
 
-    async def disconnect_shard(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> None:
+            # released only after the reply, the shard expects it before any request
+            self.end_outage(id, True)
+
+    async def create_request(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> None:
         if not self.is_secure(websocket):
-            return await websocket.send(
-                json.dumps({
+            # checked before the message is decoded, so unauthenticated clients can't make the cluster do any work
+            with contextlib.suppress(ConnectionClosed):
+                await self.send(websocket, {
                     "error": "Invalid secret key!",
-                    "code": 403
-                }, separators=(", ", ": "))
-            )
+                    "code": 401
+                })
+            return
 
-        if not (id := websocket.request_headers.get("Shard-ID")):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Missing shard ID!",
-                    "code": 500
-                }, separators=(", ", ": "))
-            )
+        if is_frame(message):
+            # only the header is decoded, the kwargs stay encoded unless the cluster has to look into them
+            return await self.accept_request(websocket, *unpack_frame(get_codec(websocket.subprotocol), message))
+        await self.accept_request(websocket, await self.decode(websocket, message))
 
-        if not self.shards.get(id):
-            return await websocket.send(
-                json.dumps({
-                    "error": f"Shard with ID {id!r} doesn't exists!",
-                    "code": 404
-                }, separators=(", ", ": "))
-            )
-        
-        else:
-            ws = self.shards.pop(id)[0]
+    async def accept_request(self, websocket: WebSocketServerProtocol, data: Dict[str, Any], body: Optional[bytes] = None) -> None:
+        nonce: Optional[str] = data.get("nonce")
+        requests = self.requests.setdefault(websocket, {})
+
+        if "credit" in data:
+            if (grant := self.credits.get((websocket, nonce))):
+                await grant(data["credit"])
+            return
+
+        if data.get("cancel"):
+            if (task := requests.get(nonce)):
+                task.cancel()
+            return
+
+        # the connection is multiplexed, so the reply must not block the next request
+        requests[nonce] = task = asyncio.create_task(
+            self.process_request(websocket, data) if body is None else self.process_frame(websocket, data, body)
+        )
+        task.add_done_callback(lambda _: requests.pop(nonce, None))
+
+    async def process_request(self, websocket: WebSocketServerProtocol, data: Dict[str, Any]) -> None:
+        nonce: Optional[str] = data.get("nonce")
+
+        if not self.is_secure(websocket):
+            return await self.reply(websocket, nonce, {
+                "error": "Invalid secret key!",
+                "code": 401
+            })
+
+        timeout: float = data.get("timeout") or self.timeout
+
+        if data.get("broadcast"):
+            return await self.reply(websocket, nonce, await self.process_broadcast(data, timeout))
+
+        if data.get("batch") is not None:
+            return await self.reply(websocket, nonce, await self.process_batch(data, timeout))
+
+        if data.get("store") is not None:
+            return await self.reply(websocket, nonce, await self.process_store(websocket, data, timeout))
+
+        if data.get("subscribe") is not None:
+            return await self.process_subscription(websocket, nonce, data["subscribe"])
+
+        if (event := data.get("publish")) is not None:
+            # published on a peer, which has already sent it to the rest of the group
+            return self.fan_out(event)
+
+        if not (id := data.get("shard_id")) and (guild_id := data.get("guild_id")) is not None:
+            if parse_snowflake(guild_id) is None:
+                return await self.reply(websocket, nonce, {
+                    "error": f"Invalid guild ID {guild_id!r}!",
+                    "code": 400
+                })
+
+            if (id := self.resolve_guild(parse_snowflake(guild_id))) is None:
+                if data.get("stream"):
+                    return await self.reply(websocket, nonce, {
+                        "error": f"No shard handles the guild {guild_id}!",
+                        "code": 404
+                    })
+                return await self.reply(websocket, nonce, await self.forward_guild(data, timeout))
+
+        if not id:
+            return await self.reply(websocket, nonce, {
+                "error": "Missing shard ID!",
+                "code": 500
+            })
+
+        if not self.shards.get(str(id)) and (remaining := await self.wait_for_shard(str(id), timeout)) is not None:
+            timeout = remaining
+
+        if not self.shards.get(str(id)):
+            if str(id) in self.outages:
+                return await self.reply(websocket, nonce, {
+                    "error": f"Shard with ID {id!r} is reconnecting, try again later!",
+                    "code": 503,
+                    "retryable": True
+                })
+
+            if not data.get("forwarded") and (peer := self.owner(str(id))) is not None:
+                if data.get("stream"):
+                    return await self.forward_stream(peer, websocket, nonce, data, timeout)
+                return await self.reply(websocket, nonce, await self.forward_to_peer(peer, data, timeout))
+
+            return await self.reply(websocket, nonce, {
+                "error": f"Shard with ID {id!r} doesn't exists!",
+                "code": 404
+            })
+
+        endpoint: Optional[str] = data.get("endpoint")
+        kwargs: Dict[str, Any] = data.get("kwargs")
+
+        if not self.serves(str(id), endpoint):
+            return await self.reply(websocket, nonce, {
+                "error": "Unknown endpoint!",
+                "code": 404
+            })
+
+        if data.get("stream"):
+            return await self.process_stream(websocket, nonce, str(id), endpoint, kwargs, data.get("window") or 1, timeout)
+
+        response = await self.fetch(str(id), endpoint, kwargs, timeout, data.get("shared_memory", False))
+        await self.reply(websocket, nonce, response, (str(id), endpoint))
+
+    async def process_frame(self, websocket: WebSocketServerProtocol, header: Dict[str, Any], body: bytes) -> None:
+        if not self.is_secure(websocket):
+            return await self.process_request(websocket, header)
+
+        codec = get_codec(websocket.subprotocol)
+        endpoint: Optional[str] = header.get("endpoint")
 
-            await ws.send(
-                json.dumps({
-                    "message": "Successfuly disconnected from the cluster!",
+        if (id := header.get("shard_id")) is None and (guild_id := parse_snowflake(header.get("guild_id"))) is not None:
+            id = self.resolve_guild(guild_id)
+
+        if (
+            id is None
+            or (str(id), endpoint) in self.caches
+            or (replica := self.select(str(id), endpoint)) is None
+            or codec.name not in replica.codecs
+            or not self.can_relay(body, replica.websocket)
+        ):
+            # cached endpoints, errors, reconnecting shards and the shards of the peers take the regular path
+            return await self.process_request(websocket, {**header, "kwargs": await self.decode(websocket, body)})
+
+        response = await self.forward_request(str(id), replica, {
+            "endpoint": endpoint,
+            "codec": codec.name,
+            **({"shared_memory": True} if header.get("shared_memory") else {})
+        }, header.get("timeout") or self.timeout, body)
+
+        if not isinstance(response, Envelope):
+            return await self.reply(websocket, header.get("nonce"), response)
+
+        if exceeds(response.body, self.max_size):
+            return await self.reply(websocket, header.get("nonce"), too_large(len(response.body), self.max_size))
+
+        if not self.can_relay(response.body, websocket):
+            # the client can't decompress what the shard sent, so it gets the decoded response
+            return await self.reply(websocket, header.get("nonce"), await self.decode(websocket, response.body))
+
+        with contextlib.suppress(ConnectionClosed):
+            await websocket.send(pack_frame(codec, {
+                "nonce": header.get("nonce"),
+                "code": response.get("code"),
+                **({"shared_memory": True} if response.get("shared_memory") else {})
+            }, response.body))
+
+    def can_relay(self, body: bytes, receiver: WebSocketServerProtocol) -> bool:
+        # the body is compressed by the sender for the cluster, the receiver might not accept the algorithm
+        return (algorithm := algorithm_of(body)) is None or algorithm in accepted(receiver.request_headers)
+
+    async def process_store(self, websocket: WebSocketServerProtocol, data: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        op: str = data["store"]
+        key = str(data.get("key"))
+
+        if not data.get("forwarded") and (peer := self.owner(key)) is not None:
+            return await self.forward_to_peer(peer, data, timeout)
+
+        try:
+            if op == "get":
+                value, ttl = self.store.get(key)
+                # the watchers of a forwarded read would be the peer, so only local readers are told about changes
+                if (watched := data.get("watch", False) and value is not MISSING and not data.get("forwarded")):
+                    self.store.watch(key, websocket)
+
+                await self.notify_watchers()
+                return {
+                    "found": value is not MISSING,
+                    "value": None if value is MISSING else value,
+                    "ttl": ttl,
+                    "watched": watched,
                     "code": 200
                 }
-            ), separators=(", ", ": "))
+            elif op == "set":
+                self.store.set(key, data.get("value"), data.get("ttl"))
+                response = {"code": 200}
+            elif op == "incr":
+                response = {"value": self.store.incr(key, data.get("amount", 1), data.get("ttl")), "code": 200}
+            elif op == "delete":
+                response = {"deleted": self.store.delete(key), "code": 200}
+            else:
+                return {
+                    "error": f"Unknown store operation {op!r}!",
+                    "code": 400
+                }
+        except TypeError as exception:
+            return {
+                "error": str(exception),
+                "code": 400
+            }
+        except ValueError as exception:
+            return {
+                "error": str(exception),
+                "code": 413
+            }
 
-        self.logger.warning(f"Shard {id!r} has been disconnected manually")
+        await self.notify_watchers()
+        return response
 
-    async def create_request(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> None:
-        if not self.is_secure(websocket):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Invalid secret key!",
-                    "code": 401
-                }, separators=(", ", ": "))
-            )
+    async def notify_watchers(self) -> None:
+        # a write can also evict other keys and a read can expire the key, their watchers are told too
+        await asyncio.gather(*(
+            self.send(x, {"invalidate_key": key})
+            for key, watchers in self.store.changes().items() for x in watchers if not x.closed
+        ), return_exceptions=True)
 
-        if not (id := websocket.request_headers.get("Shard-ID")):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Missing shard ID!",
-                    "code": 500
-                }, separators=(", ", ": "))
-            )
+    async def process_subscription(self, websocket: WebSocketServerProtocol, nonce: Optional[str], topics: List[str]) -> None:
+        subscriber = Subscriber(websocket, nonce, topics, self.event_buffer)
+        for topic in topics:
+            self.topics.setdefault(topic, set()).add(subscriber)
 
-        if not (shard := self.shards.get(id)):
-            return await websocket.send(
-                json.dumps({
-                    "error": f"Shard with ID {id!r} doesn't exists!",
-                    "code": 404
-                }, separators=(", ", ": "))
-            )
-        
-        data: Dict[str, Any] = json.loads(message)
+        try:
+            # runs until the client cancels the subscription or disconnects
+            while True:
+                await subscriber.ready.wait()
+                subscriber.ready.clear()
+
+                while subscriber.buffer:
+                    await self.send(websocket, {"nonce": nonce, "event": subscriber.buffer.popleft()})
+        except ConnectionClosed:
+            pass
+        finally:
+            for topic in topics:
+                if (subscribers := self.topics.get(topic)) is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.topics[topic]
+
+    def fan_out(self, event: Dict[str, Any]) -> None:
+        topic = event.get("topic")
+        self.metrics.inc("cluster_events_total", topic=topic)
+
+        # only buffered here, the subscription tasks send them, so the shard never waits for a client
+        for subscriber in self.topics.get(topic, ()):
+            if subscriber.push(event):
+                self.metrics.inc("cluster_events_dropped_total", topic=topic)
+
+    async def publish_event(self, id: str, replica: Replica, data: Dict[str, Any]) -> None:
+        event = {
+            "topic": data.get("topic"),
+            "data": data.get("data"),
+            "shard": id
+        }
+        self.fan_out(event)
+
+        for peer in self.peers.values():
+            asyncio.create_task(peer.notify({"publish": event, "forwarded": True}))
+
+    async def process_stream(
+        self,
+        websocket: WebSocketServerProtocol,
+        nonce: Optional[str],
+        id: str,
+        endpoint: str,
+        kwargs: Dict[str, Any],
+        window: int,
+        timeout: float
+    ) -> None:
+        if (replica := self.select(id, endpoint)) is None or len(self.waiters) >= self.max_waiters:
+            return await self.reply(websocket, nonce, {
+                "error": "Too many pending requests!" if replica else f"Shard with ID {id!r} has been disconnected!",
+                "code": 503
+            })
+
+        ID = str(uuid4())
+        waiter = asyncio.get_running_loop().create_future()
+        durations: Optional[float] = None
+
+        # the chunks are relayed as they arrive and the credits of the client are passed to the shard,
+        # so neither side buffers more than the window
+        self.waiters[ID] = waiter, replica.websocket
+        self.streams[ID] = websocket, nonce
+        self.credits[websocket, nonce] = lambda credit: self.send(replica.websocket, {"uuid": ID, "credit": credit})
+
+        self.metrics.add("cluster_in_flight", 1, shard=id, endpoint=endpoint)
+        replica.in_flight += 1
+        started = time.perf_counter()
+
+        try:
+            await self.send(replica.websocket, {
+                "endpoint": endpoint,
+                "data": kwargs,
+                "uuid": ID,
+                "timeout": timeout,
+                "stream": True,
+                "window": window
+            })
+            frame: Dict[str, Any] = await waiter
+        except ConnectionClosed:
+            response = {
+                "error": f"Shard with ID {id!r} has been disconnected!",
+                "code": 503
+            }
+        except asyncio.CancelledError:
+            # the client has stopped reading, so the shard can stop generating
+            with contextlib.suppress(ConnectionClosed):
+                await self.send(replica.websocket, {"uuid": ID, "cancel": True})
+            raise
+        else:
+            response, durations = frame.get("response"), frame.get("duration")
+        finally:
+            self.waiters.pop(ID, None)
+            self.streams.pop(ID, None)
+            self.credits.pop((websocket, nonce), None)
+
+            self.metrics.add("cluster_in_flight", -1, shard=id, endpoint=endpoint)
+            replica.in_flight -= 1
+
+        self.record(id, [endpoint], response, time.perf_counter() - started, durations)
+        await self.reply(websocket, nonce, response)
+
+    async def forward_stream(
+        self,
+        peer: Peer,
+        websocket: WebSocketServerProtocol,
+        nonce: Optional[str],
+        data: Dict[str, Any],
+        timeout: float
+    ) -> None:
+        window: int = data.get("window") or 1
+        credits = asyncio.Semaphore(window)
+
+        async def grant(credit: int) -> None:
+            for _ in range(credit):
+                credits.release()
+
+        self.credits[websocket, nonce] = grant
+        self.metrics.inc("cluster_forwarded_total", peer=peer.address)
+
+        if not peer.connected:
+            self.credits.pop((websocket, nonce), None)
+            return await self.reply(websocket, nonce, {
+                "error": f"The peer {peer.address} is not connected!",
+                "code": 503
+            })
+
+        stream = peer.connection.stream({
+            **{x: y for x, y in data.items() if x not in ("nonce", "timeout", "stream", "window")},
+            "forwarded": True
+        }, timeout, window)
+
+        try:
+            async for chunk in stream:
+                await credits.acquire()
+                await self.send(websocket, {"nonce": nonce, "chunk": chunk})
+        except StreamError as error:
+            response = {
+                "error": str(error),
+                "code": error.code
+            }
+        except NotConnected:
+            response = {
+                "error": f"The peer {peer.address} has been disconnected!",
+                "code": 503
+            }
+        except ConnectionClosed:
+            return
+        else:
+            response = {"code": 200}
+        finally:
+            self.credits.pop((websocket, nonce), None)
+            await stream.aclose()
+
+        await self.reply(websocket, nonce, response)
+
+    async def forward_guild(self, data: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        # the guild table only knows the shards of this node, so the peers are asked one by one
+        if not data.get("forwarded"):
+            for peer in self.peers.values():
+                if peer.connected and (response := await self.forward_to_peer(peer, data, timeout)).get("code") != 404:
+                    return response
+
+        return {
+            "error": f"No shard handles the guild {data.get('guild_id')}!",
+            "code": 404
+        }
+
+    async def process_broadcast(self, data: Dict[str, Any], timeout: float) -> Dict[str, Any]:
         endpoint: Optional[str] = data.get("endpoint")
         kwargs: Dict[str, Any] = data.get("kwargs")
+        reducer: Optional[str] = data.get("reducer")
+        key: Optional[str] = data.get("key")
+
+        if reducer is not None and reducer not in REDUCERS:
+            return {
+                "error": f"Unknown reducer {reducer!r}!",
+                "code": 400
+            }
+
+        if reducer is not None and key is None:
+            return {
+                "error": "Missing key for the reducer!",
+                "code": 400
+            }
+
+        shards = [id for id in self.shards if self.serves(id, endpoint)]
+        peers = [] if data.get("forwarded") else [x for x in self.peers.values() if x.connected]
+
+        # every shard gets the same deadline, so all replies are collected by then
+        local, remote = await asyncio.gather(
+            asyncio.gather(*(self.fetch(id, endpoint, kwargs, timeout) for id in shards)),
+            asyncio.gather(*(self.forward_to_peer(x, {**data, "reducer": None, "key": None}, timeout) for x in peers))
+        )
+
+        responses: Dict[str, Dict[str, Any]] = dict(zip(shards, local))
+        unreachable: List[str] = []
+
+        for peer, response in zip(peers, remote):
+            if "responses" in response:
+                responses.update(response["responses"])
+            elif response.get("code") != 404:
+                unreachable.append(peer.address)
+
+        if not responses and not unreachable:
+            return {
+                "error": "Unknown endpoint!",
+                "code": 404
+            }
+
+        failed = [id for id, response in responses.items() if response.get("code") != 200]
+        result = {
+            "responses": responses,
+            "failed": failed,
+            "code": 207 if failed or unreachable else 200
+        }
+
+        if unreachable:
+            result["unreachable"] = unreachable
+
+        if reducer is not None:
+            try:
+                result["result"] = REDUCERS[reducer](
+                    response.get(key) for id, response in responses.items() if id not in failed
+                )
+            except Exception as exception:
+                # the replies are still returned, only the combined value is missing
+                self.logger.warning(f"The reducer {reducer!r} failed on {key!r} of {endpoint!r}", exc_info=exception)
+                result["error"] = f"The reducer {reducer!r} can't combine the values of {key!r}: {exception}"
+                result["code"] = 400
+        return result
+
+    async def process_batch(self, data: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        items: List[Dict[str, Any]] = data.get("batch")
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        groups: Dict[str, List[int]] = {}
+        remote: Dict[Peer, List[int]] = {}
 
-        if not endpoint in shard[1]:
-            return await websocket.send(
-                json.dumps({
+        for index, item in enumerate(items):
+            id = str(item.get("shard_id"))
+
+            if not (replicas := self.shards.get(id)) and not data.get("forwarded") and (peer := self.owner(id)) is not None:
+                remote.setdefault(peer, []).append(index)
+            elif not replicas:
+                responses[index] = {
+                    "error": f"Shard with ID {id!r} doesn't exists!",
+                    "code": 404
+                }
+            elif not self.serves(id, item.get("endpoint")):
+                responses[index] = {
                     "error": "Unknown endpoint!",
                     "code": 404
-                }, separators=(", ", ": "))
-            )
+                }
+            elif (cache := self.caches.get((id, item.get("endpoint")))) and (response := cache.get(item.get("kwargs"))) is not None:
+                responses[index] = response
+            else:
+                groups.setdefault(id, []).append(index)
+
+        async def forward(id: str, indexes: List[int]) -> None:
+            # every shard receives its part of the batch as a single frame
+            if (replica := self.select(id, *{items[x].get("endpoint") for x in indexes})) is None:
+                response = {
+                    "error": f"No replica of shard with ID {id!r} serves all endpoints of the batch!",
+                    "code": 503
+                }
+            else:
+                response = await self.forward_request(id, replica, {
+                    "batch": [{"endpoint": items[x].get("endpoint"), "data": items[x].get("kwargs")} for x in indexes]
+                }, timeout)
+
+            for position, index in enumerate(indexes):
+                responses[index] = response[position] if isinstance(response, list) else response
+
+                if (cache := self.caches.get((id, items[index].get("endpoint")))) and responses[index].get("code") == 200:
+                    cache.set(items[index].get("kwargs"), responses[index])
+
+        async def forward_remote(peer: Peer, indexes: List[int]) -> None:
+            # the peer gets the items of its shards as a single batch
+            response = await self.forward_to_peer(peer, {"batch": [items[x] for x in indexes]}, timeout)
+            for position, index in enumerate(indexes):
+                responses[index] = response["responses"][position] if "responses" in response else response
+
+        await asyncio.gather(
+            *(forward(id, indexes) for id, indexes in groups.items()),
+            *(forward_remote(peer, indexes) for peer, indexes in remote.items())
+        )
+        return {
+            "responses": responses,
+            "code": 200
+        }
 
+    async def fetch(
+        self,
+        id: str,
+        endpoint: str,
+        kwargs: Dict[str, Any],
+        timeout: float,
+        shared_memory: bool = False
+    ) -> Dict[str, Any]:
+        if (cache := self.caches.get((id, endpoint))) and (response := cache.get(kwargs)) is not None:
+            return response
+
+        if (replica := self.select(id, endpoint)) is None:
+            return {
+                "error": f"Shard with ID {id!r} has been disconnected!",
+                "code": 503
+            }
+
+        # cached responses are kept in the cluster, so they must not point to shared memory
+        response = await self.forward_request(id, replica, {
+            "endpoint": endpoint,
+            "data": kwargs,
+            **({"shared_memory": True} if shared_memory and cache is None else {})
+        }, timeout)
+
+        if cache and response.get("code") == 200:
+            cache.set(kwargs, response)
+        return response
+
+    async def forward_request(
+        self,
+        id: str,
+        replica: Replica,
+        payload: Dict[str, Any],
+        timeout: float,
+        body: Optional[bytes] = None
+    ) -> Any:
+        if len(self.waiters) >= self.max_waiters:
+            return {
+                "error": "Too many pending requests!",
+                "code": 503
+            }
+
+        ID = str(uuid4())
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[ID] = waiter, replica.websocket
+
+        endpoints = [x.get("endpoint") for x in payload["batch"]] if "batch" in payload else [payload.get("endpoint")]
+        durations: Optional[Union[float, List[float]]] = None
+
+        for endpoint in endpoints:
+            self.metrics.add("cluster_in_flight", 1, shard=id, endpoint=endpoint)
+        replica.in_flight += 1
+        started = time.perf_counter()
+
+        try:
+            # the deadline is sent along, so the shard can drop the work once nobody waits for it
+            if body is None:
+                await self.send(replica.websocket, {**payload, "uuid": ID, "timeout": timeout})
+            else:
+                await replica.websocket.send(pack_frame(get_codec(replica.websocket.subprotocol), {**payload, "uuid": ID, "timeout": timeout}, body))
+            frame: Dict[str, Any] = await asyncio.wait_for(waiter, timeout)
+        except ConnectionClosed:
+            response = {
+                "error": f"Shard with ID {id!r} has been disconnected!",
+                "code": 503
+            }
+        except asyncio.TimeoutError:
+            response = {
+                "error": f"Shard with ID {id!r} didn't respond in time!",
+                "code": 504
+            }
         else:
-            ID = str(uuid4())
+            response, durations = frame.get("response"), frame.get("duration")
+            if frame.get("shared_memory") and isinstance(response, dict):
+                response = SharedMemoryReply(response)
+            replica.observe(time.perf_counter() - started)
+        finally:
+            self.waiters.pop(ID, None)
+            replica.in_flight -= 1
 
-            await shard[0].send(json.dumps({
-                "endpoint": endpoint,
-                "data": kwargs,
-                "uuid": ID
-            }, separators=(", ", ": ")))
+            for endpoint in endpoints:
+                self.metrics.add("cluster_in_flight", -1, shard=id, endpoint=endpoint)
+
+        self.record(id, endpoints, response, time.perf_counter() - started, durations)
+        return response
 
-            self.waiters[ID] = websocket
+    def record(
+        self,
+        id: str,
+        endpoints: List[str],
+        response: Union[Dict[str, Any], List[Dict[str, Any]]],
+        elapsed: float,
+        durations: Optional[Union[float, List[float]]]
+    ) -> None:
+        responses = response if isinstance(response, list) else [response] * len(endpoints)
+        durations = durations if isinstance(durations, list) else [durations] * len(endpoints)
 
-    async def return_response(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> None:
+        for endpoint, response, duration in zip(endpoints, responses, durations):
+            self.metrics.inc("cluster_requests_total", shard=id, endpoint=endpoint)
+            self.metrics.observe("cluster_request_duration_seconds", elapsed, shard=id, endpoint=endpoint)
+
+            if response.get("code") != 200:
+                self.metrics.inc("cluster_errors_total", shard=id, endpoint=endpoint)
+
+            if duration is not None:
+                self.metrics.observe("cluster_handler_duration_seconds", duration, shard=id, endpoint=endpoint)
+
+    async def reply(
+        self,
+        websocket: WebSocketServerProtocol,
+        nonce: Optional[str],
+        response: Dict[str, Any],
+        key: Optional[Tuple[str, str]] = None
+    ) -> None:
+        with contextlib.suppress(ConnectionClosed):
+            await self.send(websocket, {
+                "nonce": nonce,
+                "response": response,
+                **({"shared_memory": True} if isinstance(response, SharedMemoryReply) else {})
+            }, key)
+
+    async def process_shard_message(self, id: str, replica: Replica, message: Union[str, bytes]) -> None:
+        if is_frame(message):
+            # the response to a framed request, relayed to the client as it is
+            header, body = unpack_frame(get_codec(replica.websocket.subprotocol), message)
+            return self.return_response({"uuid": header.get("uuid"), "response": Envelope(header, body), "duration": header.get("duration")})
+
+        data: Dict[str, Any] = await self.decode(replica.websocket, message)
+
+        if (op := data.get("op")) is None:
+            if "chunk" in data:
+                return await self.relay_chunk(data)
+            return self.return_response(data)
+
+        if not (operation := self.operations.get(op)):
+            return self.logger.warning(f"Shard {id!r} sent an unknown operation {op!r}")
+        await operation(id, replica, data)
+
+    async def relay_chunk(self, data: Dict[str, Any]) -> None:
+        if (stream := self.streams.get(data.get("uuid"))):
+            with contextlib.suppress(ConnectionClosed):
+                await self.send(stream[0], {"nonce": stream[1], "chunk": data["chunk"]})
+
+    def return_response(self, data: Dict[str, Any]) -> None:
+        if (waiter := self.waiters.get(data.get("uuid"))) and not waiter[0].done():
+            waiter[0].set_result(data)
+
+    async def shard_request(self, id: str, replica: Replica, data: Dict[str, Any]) -> None:
+        # handled like the requests of a client, the reply goes back over the connection of the shard
+        await self.accept_request(replica.websocket, data)
+
+    async def invalidate_cache(self, id: str, replica: Replica, data: Dict[str, Any]) -> None:
+        if (cache := self.caches.get((id, data.get("endpoint")))):
+            cache.invalidate(data.get("kwargs"))
+
+    async def disconnect_replica(self, id: str, replica: Replica, data: Dict[str, Any]) -> None:
+        # sent by `Shard.disconnect` on the connection of the replica, so only that replica is removed
+        self.remove_replica(replica.websocket, intentional=True)
+
+    async def update_endpoints(self, id: str, replica: Replica, data: Dict[str, Any]) -> None:
+        replica.endpoints = data.get("endpoints")
+        self.sync_caches(id, data.get("cache"))
+        self.logger.info(f"Shard {id!r} has updated its endpoints")
+
+    def clear_waiters(self, websocket: WebSocketServerProtocol) -> None:
+        # the client is gone, nobody is going to read the replies
+        for task in self.requests.pop(websocket, {}).values():
+            task.cancel()
+
+        # the shard is gone, nobody is going to answer the requests
+        for waiter, ws in list(self.waiters.values()):
+            if ws is websocket and not waiter.done():
+                waiter.set_result({
+                    "response": {
+                        "error": "The shard has been disconnected!",
+                        "code": 503
+                    }
+                })
+
+    async def send_metrics(self, websocket: WebSocketServerProtocol, message: Union[str, bytes]) -> None:
         if not self.is_secure(websocket):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Invalid secret key!",
-                    "code": 401
-                }, separators=(", ", ": "))
-            )
-    
-        if not (id := websocket.request_headers.get("UUID", None)):
-            return await websocket.send(
-                json.dumps({
-                    "error": "Missing UUID!",
-                    "code": 500
-                }, separators=(", ", ": "))
-            )
+            return await self.send(websocket, {
+                "error": "Invalid secret key!",
+                "code": 403
+            })
+        await websocket.send(self.metrics.render())
 
-        else:
-            await self.waiters[id].send(message)
+    async def process_http_request(self, path: str, request_headers: Headers) -> Optional[Tuple[HTTPStatus, List[Tuple[str, str]], bytes]]:
+        # plain HTTP requests to /metrics are answered without a websocket, so Prometheus can scrape it
+        if path != "/metrics" or request_headers.get("Upgrade", "").lower() == "websocket":
+            return None
+
+        if not self.is_valid_key(request_headers):
+            return HTTPStatus.FORBIDDEN, [], b"Invalid secret key!\n"
+        return HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4")], self.metrics.render().encode("UTF-8")
 
     async def handle_requests(self, websocket: WebSocketServerProtocol) -> None:
-        with contextlib.suppress(ConnectionClosedError):
-            async for message in websocket:
-                if not (handler := self.handlers.get(websocket.path)):
-                    await websocket.send(
-                        json.dumps({
+        handler = self.handlers.get(websocket.path)
+        # the path is chosen by the other side, so only the known ones get their own series
+        path = websocket.path if handler is not None else "other"
+        self.metrics.add("cluster_connections", 1, path=path)
+        try:
+            with contextlib.suppress(ConnectionClosedError):
+                async for message in websocket:
+                    if handler is None:
+                        await self.send(websocket, {
                             "error": "Unknown path",
                             "code": 404
-                        }, separators=(", ", ": "))
-                    )
-                await handler(websocket, message)
+                        })
+                        continue
+                    try:
+                        await handler(websocket, message)
+                    except (MessageTooLarge, UnknownCompression) as error:
+                        # closed like a message above the size limit of websockets
+                        await websocket.close(error.close_code, str(error))
+        finally:
+            self.remove_replica(websocket)
+            self.clear_waiters(websocket)
+            self.store.unwatch(websocket)
+            self.metrics.add("cluster_connections", -1, path=path)
 
     async def start(self) -> None:
         """|coro
@@ -231,6 +1294,38 @@ class Cluster:
         Starts a servewr that handles connection between shards and clients.
 
         """
-        async with serve(self.handle_requests, self.host, self.port):
-            await asyncio.Future() # run forever
+        options: Dict[str, Any] = {
+            "subprotocols": list(CODECS),
+            "process_request": self.process_http_request,
+            "compression": None if self.compression else "deflate",
+            "extra_headers": advertise(self.compression),
+            "max_size": self.max_size
+        }
+
+        async with contextlib.AsyncExitStack() as stack:
+            if self.tcp:
+                await stack.enter_async_context(serve(self.handle_requests, self.host, self.port, **options))
+
+            if self.unix_path:
+                # a socket file left behind by a crashed cluster would fail the bind
+                if os.path.exists(self.unix_path) and stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                    os.unlink(self.unix_path)
+
+                await stack.enter_async_context(unix_serve(self.handle_requests, self.unix_path, **options))
+
+                @stack.callback
+                def remove_socket() -> None:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(self.unix_path)
+
+            tasks = [asyncio.create_task(x.run()) for x in self.peers.values()]
+            tasks.append(asyncio.create_task(watch_event_loop(self.metrics, "cluster")))
+            try:
+                await asyncio.Future() # run forever
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+                for outage in self.outages.values():
+                    outage.handle.cancel()
 
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+
+from typing import Any, Dict, Optional, Tuple, Union
+from discord.ext.cluster.errors import UnknownCodec
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class Codec:
+    """|class|
+
+    The base class for the wire formats. The codec of a connection is negotiated
+    with the `Sec-WebSocket-Protocol` handshake header, if the cluster doesn't
+    support the requested codec both sides fall back to stdlib JSON.
+    """
+
+    __slots__: Tuple[str] = ()
+
+    name: str = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} name={self.name!r}>"
+
+    def encode(self, data: Any) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+class JSONCodec(Codec):
+    """|class|
+
+    Stdlib JSON, always available and used as the fallback
+    """
+
+    __slots__: Tuple[str] = ()
+
+    name: str = "json"
+
+    def encode(self, data: Any) -> str:
+        return json.dumps(data, separators=(",", ":"))
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+class ORJSONCodec(Codec):
+    """|class|
+
+    JSON encoded with `orjson`, requires the `orjson` package
+    """
+
+    __slots__: Tuple[str] = ()
+
+    name: str = "orjson"
+
+    def encode(self, data: Any) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+class MsgPackCodec(Codec):
+    """|class|
+
+    Compact binary encoding, requires the `msgpack` package
+    """
+
+    __slots__: Tuple[str] = ()
+
+    name: str = "msgpack"
+
+    def encode(self, data: Any) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+CODECS: Dict[str, Codec] = {"json": JSONCodec()}
+
+if orjson is not None:
+    CODECS["orjson"] = ORJSONCodec()
+
+if msgpack is not None:
+    CODECS["msgpack"] = MsgPackCodec()
+
+def get_codec(name: Optional[str]) -> Codec:
+    """|method|
+
+    Returns the codec registered under the name.
+    If no name is given the stdlib JSON codec is returned.
+
+    Parameters
+    ----------
+    name: :class:`str`
+        The name of the codec
+    """
+
+    if name is None:
+        return CODECS["json"]
+
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise UnknownCodec(f"Codec {name!r} is not available, make sure its package is installed!") from None
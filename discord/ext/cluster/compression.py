@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import struct
+import threading
+import time
+import zlib
+
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Tuple, Union
+from discord.ext.cluster.codec import Codec
+from discord.ext.cluster.errors import MessageTooLarge, UnknownCompression
+
+if TYPE_CHECKING:
+    from discord.ext.cluster.metrics import Metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# no codec starts a message with a null byte, so it marks the compressed frames
+MARKER = b"\x00"
+HEADER = struct.Struct(">cI")
+
+ALGORITHMS: Dict[str, bytes] = {"zlib": b"z"}
+
+if zstandard is not None:
+    ALGORITHMS["zstd"] = b"s"
+
+# sent in the handshake by the sides with compression set, it lists the algorithms they can decompress
+COMPRESSION_HEADER = "Compression"
+
+def dictionary_id(dictionary: Optional[bytes]) -> int:
+    return zlib.crc32(dictionary) if dictionary else 0
+
+def advertise(compression: Optional[Compression]) -> Dict[str, str]:
+    return {} if compression is None else {COMPRESSION_HEADER: ",".join(ALGORITHMS)}
+
+def accepted(headers: Mapping[str, str]) -> Tuple[str, ...]:
+    return tuple(x for x in headers.get(COMPRESSION_HEADER, "").split(",") if x)
+
+def algorithm_of(data: Union[str, bytes]) -> Optional[str]:
+    # the algorithm of a compressed message, `None` if it isn't compressed
+    if not isinstance(data, bytes) or data[:1] != MARKER:
+        return None
+    kind = data[1:2]
+    return next((x for x, y in ALGORITHMS.items() if y == kind), "unknown")
+
+class Compression:
+    """|class|
+
+    Compresses the messages that are larger than the threshold. Smaller ones are sent as they are,
+    since compressing them costs more time than it saves on the wire.
+
+    Parameters:
+    ----------
+    algorithm: `str`
+        Can be `zlib` or `zstd`, `zstd` requires the `zstandard` package
+    level: `int`
+        The compression level of the algorithm
+    threshold: `int`
+        Messages of at least this many bytes are compressed. `None` disables the compression,
+        but compressed messages from the other side are still accepted
+    dictionaries: `List[bytes]`
+        Shared dictionaries with samples of the typical payloads. The first one is used for compressing,
+        the rest are accepted when decompressing. Both sides must have the dictionary
+
+    Attributes:
+    ----------
+    original: `int`
+        Bytes before compression
+    compressed: `int`
+        Bytes after compression
+    compress_time: `float`
+        Seconds spent compressing
+    decompress_time: `float`
+        Seconds spent decompressing
+    """
+
+    __slots__: Tuple[str] = (
+        "algorithm",
+        "level",
+        "threshold",
+        "dictionaries",
+        "compressors",
+        "original",
+        "compressed",
+        "compress_time",
+        "decompress_time"
+    )
+
+    def __init__(
+        self,
+        algorithm: str = "zlib",
+        level: int = 6,
+        threshold: Optional[int] = 1024,
+        dictionaries: Optional[List[bytes]] = None
+    ) -> None:
+        if algorithm not in ALGORITHMS:
+            raise UnknownCompression(f"Compression {algorithm!r} is not available, make sure its package is installed!")
+
+        self.algorithm = algorithm
+        self.level = level
+        self.threshold = threshold
+        self.dictionaries: Dict[int, bytes] = {dictionary_id(x): x for x in dictionaries or []}
+        self.compressors: Dict[Tuple[bytes, int, int], Any] = {}
+
+        self.original: int = 0
+        self.compressed: int = 0
+        self.compress_time: float = 0.0
+        self.decompress_time: float = 0.0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} algorithm={self.algorithm!r} level={self.level} threshold={self.threshold}>"
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # sent to process pools by the settings, the zstandard contexts can't be pickled
+        return self.__class__, (self.algorithm, self.level, self.threshold, list(self.dictionaries.values()))
+
+    @property
+    def dictionary(self) -> Optional[bytes]:
+        return next(iter(self.dictionaries.values()), None)
+
+    @property
+    def ratio(self) -> float:
+        return self.original / self.compressed if self.compressed else 1.0
+
+    def zstd(self, kind: bytes, id: int) -> Any:
+        # the zstandard contexts are reusable but not thread-safe, so they are created once per dictionary and thread
+        if (context := self.compressors.get(key := (kind, id, threading.get_ident()))) is None:
+            options = {"dict_data": zstandard.ZstdCompressionDict(self.dictionaries[id])} if id else {}
+            context = self.compressors[key] = (
+                zstandard.ZstdCompressor(level=self.level, **options) if kind == b"c" else zstandard.ZstdDecompressor(**options)
+            )
+        return context
+
+    def compress(self, data: bytes) -> bytes:
+        started = time.perf_counter()
+        id = dictionary_id(dictionary := self.dictionary)
+
+        if self.algorithm == "zstd":
+            body = self.zstd(b"c", id).compress(data)
+        elif dictionary:
+            compressor = zlib.compressobj(self.level, zdict=dictionary)
+            body = compressor.compress(data) + compressor.flush()
+        else:
+            body = zlib.compress(data, self.level)
+
+        self.compress_time += time.perf_counter() - started
+        self.original += len(data)
+        self.compressed += len(body) + HEADER.size + 1
+        return MARKER + HEADER.pack(ALGORITHMS[self.algorithm], id) + body
+
+    def decompress(self, data: bytes, max_size: Optional[int] = None) -> bytes:
+        started = time.perf_counter()
+        algorithm, id = HEADER.unpack_from(data, 1)
+        body = memoryview(data)[HEADER.size + 1:]
+
+        if id and id not in self.dictionaries:
+            raise UnknownCompression("The message was compressed with a dictionary that isn't configured!")
+
+        # the output is capped like an uncompressed message, so a small message can't inflate without a limit
+        if algorithm == ALGORITHMS.get("zstd"):
+            # read in chunks, the content size in the frame header is set by the sender
+            chunks, size = [], 0
+            with self.zstd(b"d", id).stream_reader(body) as reader:
+                while chunk := reader.read(64 * 1024):
+                    if max_size is not None and (size := size + len(chunk)) > max_size:
+                        raise MessageTooLarge(f"The message is larger than the limit of {max_size} bytes once decompressed!")
+                    chunks.append(chunk)
+            result = b"".join(chunks)
+        elif algorithm == ALGORITHMS["zlib"]:
+            decompressor = zlib.decompressobj(zdict=self.dictionaries[id]) if id else zlib.decompressobj()
+            result = decompressor.decompress(body, max_size or 0)
+            # the input left in `unconsumed_tail` or the internal buffer would have gone past the limit
+            if not decompressor.eof:
+                if max_size is not None and len(result) >= max_size:
+                    raise MessageTooLarge(f"The message is larger than the limit of {max_size} bytes once decompressed!")
+                raise zlib.error("The compressed message is incomplete!")
+        else:
+            raise UnknownCompression(f"The message was compressed with an unknown algorithm {algorithm!r}!")
+
+        self.decompress_time += time.perf_counter() - started
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "original": self.original,
+            "compressed": self.compressed,
+            "ratio": self.ratio,
+            "compress_time": self.compress_time,
+            "decompress_time": self.decompress_time
+        }
+
+    def describe(self, metrics: Metrics, prefix: str) -> None:
+        """|method|
+
+        Registers the compression metrics under the prefix
+
+        Parameters
+        ----------
+        metrics: :class:`Metrics`
+            The registry of the cluster or the shard
+        prefix: :class:`str`
+            `cluster` or `shard`
+        """
+
+        metrics.describe(f"{prefix}_compression_bytes_total", "counter", "Bytes of the compressed messages before and after compression")
+        metrics.describe(f"{prefix}_compression_ratio", "gauge", "Original size divided by the compressed size")
+        metrics.describe(f"{prefix}_compression_seconds_total", "counter", "Time spent compressing and decompressing")
+
+        metrics.collector(f"{prefix}_compression_bytes_total", lambda: [
+            ({"stage": "original"}, self.original),
+            ({"stage": "compressed"}, self.compressed)
+        ])
+        metrics.collector(f"{prefix}_compression_ratio", lambda: [({}, self.ratio)])
+        metrics.collector(f"{prefix}_compression_seconds_total", lambda: [
+            ({"op": "compress"}, self.compress_time),
+            ({"op": "decompress"}, self.decompress_time)
+        ])
+
+class CompressedCodec(Codec):
+    """|class|
+
+    Wraps the negotiated codec, so the messages above the threshold are compressed
+
+    Parameters:
+    ----------
+    codec: `Codec`
+        The wire format
+    compression: `Compression`
+        The compression settings, if not provided compressed messages are rejected
+    max_size: `int`
+        The message size limit of the connection, decompressed messages can't be larger
+    accepted: `Tuple[str]`
+        The algorithms the other side can decompress, messages are only compressed if it accepts
+        the algorithm of the settings. If not provided every algorithm is accepted
+    """
+
+    __slots__: Tuple[str] = ("codec", "compression", "max_size", "accepted")
+
+    def __init__(
+        self,
+        codec: Codec,
+        compression: Optional[Compression] = None,
+        max_size: Optional[int] = None,
+        accepted: Optional[Tuple[str, ...]] = None
+    ) -> None:
+        self.codec = codec
+        self.compression = compression
+        self.max_size = max_size
+        self.accepted = accepted
+
+    @property
+    def name(self) -> str:
+        return self.codec.name
+
+    @property
+    def compressing(self) -> bool:
+        return (
+            self.compression is not None
+            and self.compression.threshold is not None
+            and (self.accepted is None or self.compression.algorithm in self.accepted)
+        )
+
+    def pack(self, encoded: Union[str, bytes]) -> Union[str, bytes]:
+        if not self.compressing or len(encoded) < self.compression.threshold:
+            return encoded
+        return self.compression.compress(encoded.encode("UTF-8") if isinstance(encoded, str) else encoded)
+
+    def unpack(self, data: Union[str, bytes]) -> Union[str, bytes]:
+        if isinstance(data, bytes) and data[:1] == MARKER:
+            if self.compression is None:
+                raise UnknownCompression("Received a compressed message, but compression isn't enabled!")
+            return self.compression.decompress(data, self.max_size)
+        return data
+
+    def encode(self, data: Any) -> Union[str, bytes]:
+        return self.pack(self.codec.encode(data))
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return self.codec.decode(self.unpack(data))
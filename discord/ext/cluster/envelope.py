@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import struct
+
+from typing import Any, Dict, Tuple, Union
+from discord.ext.cluster.codec import Codec
+
+# the compressed messages start with a null byte and no codec starts a message with 0x01,
+# so it marks the framed messages
+FRAME = b"\x01"
+PREFIX = struct.Struct(">cI")
+
+def is_frame(message: Union[str, bytes]) -> bool:
+    return isinstance(message, bytes) and message[:1] == FRAME
+
+def pack_frame(codec: Codec, header: Dict[str, Any], body: Union[str, bytes]) -> bytes:
+    """|method|
+
+    Builds a framed message out of the routing header and the already encoded body
+
+    Parameters
+    ----------
+    codec: :class:`Codec`
+        The codec of the connection, the header is encoded with it
+    header: :class:`Dict`
+        The fields the cluster routes the message by
+    body: :class:`str | bytes`
+        The encoded and possibly compressed kwargs or response
+    """
+
+    encoded = codec.encode(header)
+    if isinstance(encoded, str):
+        encoded = encoded.encode("UTF-8")
+    if isinstance(body, str):
+        body = body.encode("UTF-8")
+    return b"".join((PREFIX.pack(FRAME, len(encoded)), encoded, body))
+
+def unpack_frame(codec: Codec, message: bytes) -> Tuple[Dict[str, Any], bytes]:
+    """|method|
+
+    Returns the decoded header and the body of a framed message, the body is left as it is
+
+    Parameters
+    ----------
+    codec: :class:`Codec`
+        The codec of the connection
+    message: :class:`bytes`
+        The framed message
+    """
+
+    _, size = PREFIX.unpack_from(message)
+    return codec.decode(message[PREFIX.size:PREFIX.size + size]), message[PREFIX.size + size:]
+
+class Envelope:
+    """|class|
+
+    A response that the cluster relays to the client without decoding it
+
+    Parameters:
+    ----------
+    header: `Dict`
+        The `code` and the `duration` reported by the shard
+    body: `bytes`
+        The response, encoded with the codec of the client
+    """
+
+    __slots__: Tuple[str] = ("header", "body")
+
+    def __init__(self, header: Dict[str, Any], body: bytes) -> None:
+        self.header = header
+        self.body = body
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} code={self.header.get('code')} size={len(self.body)}>"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.header.get(key, default)
@@ -9,3 +9,35 @@ class NotConnected(ClusterBaseError):
     """Raised upon websocket not being connected"""
     pass
 
+
+
+class UnknownCodec(ClusterBaseError):
+    """Raised upon requesting a codec that is not available"""
+    pass
+
+class UnknownCompression(ClusterBaseError):
+    """Raised upon requesting a compression algorithm or dictionary that is not available"""
+    # the websocket close code of a message that can't be decompressed
+    close_code: int = 1003
+
+class MessageTooLarge(ClusterBaseError):
+    """Raised upon a compressed message being larger than the size limit once decompressed"""
+    close_code: int = 1009
+
+class StreamError(ClusterBaseError):
+    """Raised upon a stream ending with an error"""
+
+    def __init__(self, message: str, code: int) -> None:
+        super().__init__(message)
+        self.code = code
+
+class InvalidPayload(ClusterBaseError):
+    """Raised upon a request not matching the payload type of the route"""
+    pass
+
+class StoreError(ClusterBaseError):
+    """Raised upon the key-value store of the cluster rejecting an operation"""
+
+    def __init__(self, message: str, code: int) -> None:
+        super().__init__(message)
+        self.code = code
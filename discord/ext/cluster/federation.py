@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import logging
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from discord.ext.cluster.client import Connection
+from discord.ext.cluster.codec import CODECS
+from discord.ext.cluster.compression import Compression, advertise
+from discord.ext.cluster.errors import NotConnected
+from discord.ext.cluster.transport import MAX_SIZE, backoff, open_websocket, split_address
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("UTF-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """|class|
+
+    Assigns shard IDs to nodes by consistent hashing. Every node is placed on the ring
+    multiple times, so adding or removing a node moves only the shards next to it.
+
+    Parameters:
+    ----------
+    nodes: `Iterable[str]`
+        The addresses of the nodes
+    replicas: `int`
+        How many points every node has on the ring
+    """
+
+    __slots__: Tuple[str] = ("replicas", "nodes", "points", "owners")
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 64) -> None:
+        self.replicas = replicas
+        self.nodes: List[str] = sorted(set(nodes))
+        self.points: List[int] = []
+        self.owners: List[str] = []
+
+        for point, node in sorted((hash_key(f"{x}#{y}"), x) for x in self.nodes for y in range(replicas)):
+            self.points.append(point)
+            self.owners.append(node)
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} nodes={self.nodes!r}>"
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.points:
+            return None
+        return self.owners[bisect.bisect(self.points, hash_key(key)) % len(self.points)]
+
+class Peer:
+    """|class|
+
+    A persistent link to another cluster node. Requests for the shards
+    that the peer owns are forwarded over it and the link is reopened
+    in the background if it closes.
+
+    Parameters:
+    ----------
+    address: `str`
+        The `host:port` or `unix://<path>` of the peer
+    secret_key: `str`
+        The secret key of the peer, all nodes of a group must share it
+    on_change: `Callable[[], None]`
+        Called when the link is opened or closed
+    compression: `Compression`
+        The compression of the cluster
+    max_size: `int`
+        The message size limit of the cluster
+    """
+
+    __slots__: Tuple[str] = ("address", "secret_key", "on_change", "compression", "max_size", "connection", "logger")
+
+    def __init__(
+        self,
+        address: str,
+        secret_key: Optional[str],
+        on_change: Callable[[], None],
+        compression: Optional[Compression] = None,
+        max_size: Optional[int] = MAX_SIZE
+    ) -> None:
+        self.address = address
+        self.secret_key = secret_key
+        self.on_change = on_change
+        self.compression = compression
+        self.max_size = max_size
+        self.connection: Optional[Connection] = None
+        self.logger = logging.getLogger("discord.ext.cluster")
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} address={self.address!r} connected={self.connected}>"
+
+    @property
+    def connected(self) -> bool:
+        return self.connection is not None and not self.connection.closed
+
+    async def run(self) -> None:
+        """|coro|
+
+        Keeps the link open until cancelled
+
+        """
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    websocket = await open_websocket(
+                        *split_address(self.address),
+                        "/create_request",
+                        extra_headers={
+                            "Secret-Key": str(self.secret_key),
+                            **advertise(self.compression)
+                        },
+                        subprotocols=list(CODECS),
+                        compression=None if self.compression else "deflate",
+                        max_size=self.max_size
+                    )
+                except (OSError, InvalidHandshake):
+                    await asyncio.sleep(backoff(attempt, cap=10.0))
+                    attempt += 1
+                    continue
+
+                attempt = 0
+                self.connection = Connection(websocket, self.compression, self.max_size)
+                self.logger.info(f"Connected to the peer {self.address}")
+                self.on_change()
+
+                await self.connection.task
+
+                self.connection = None
+                self.logger.warning(f"Lost the connection to the peer {self.address}")
+                self.on_change()
+        finally:
+            if self.connection is not None:
+                await self.connection.close()
+
+    async def notify(self, payload: Dict[str, Any]) -> None:
+        # fire and forget, the peer doesn't reply to it
+        if self.connected:
+            with contextlib.suppress(ConnectionClosed):
+                await self.connection.websocket.send(self.connection.codec.encode(payload))
+
+    async def request(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        if not self.connected:
+            return {
+                "error": f"The peer {self.address} is not connected!",
+                "code": 503
+            }
+
+        try:
+            return await self.connection.request(payload, timeout)
+        except NotConnected:
+            return {
+                "error": f"The peer {self.address} has been disconnected!",
+                "code": 503
+            }
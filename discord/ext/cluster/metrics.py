@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, Any], ...]
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def to_labels(labels: Dict[str, Any]) -> Labels:
+    # the call sites pass the labels in a fixed order, so sorting and formatting is left for rendering
+    return tuple(labels.items())
+
+def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = sorted(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        for _, value in items
+    )
+    return "{" + ",".join(f"{key}=\"{value}\"" for (key, _), value in zip(items, escaped)) + "}"
+
+async def watch_event_loop(metrics: Metrics, prefix: str, interval: float = 0.25) -> None:
+    """|coro|
+
+    Records how much later than scheduled the event loop wakes up a timer, which is
+    how long it was blocked by something else. Runs until cancelled
+
+    Parameters
+    ----------
+    metrics: :class:`Metrics`
+        The registry of the cluster or the shard
+    prefix: :class:`str`
+        `cluster` or `shard`
+    interval: :class:`float`
+        Seconds between the measurements
+    """
+
+    name = f"{prefix}_event_loop_lag_seconds"
+    metrics.describe(name, "histogram", "How much later than scheduled the event loop ran a timer")
+
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        metrics.observe(name, max(0.0, loop.time() - started - interval))
+
+class Histogram:
+    """|class|
+
+    Counts observations in cumulative buckets, the same way Prometheus does
+
+    Parameters:
+    ----------
+    buckets: `Tuple[float, ...]`
+        The upper bounds of the buckets in seconds
+    """
+
+    __slots__: Tuple[str] = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} count={self.count} sum={self.sum}>"
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """|method|
+
+        Estimates the quantile as the upper bound of the bucket that contains it
+
+        """
+
+        if not self.count:
+            return None
+
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99)
+        }
+
+class Metrics:
+    """|class|
+
+    A registry of counters, gauges and histograms that can be rendered
+    in the Prometheus text format or read programmatically.
+    """
+
+    __slots__: Tuple[str] = ("descriptions", "counters", "gauges", "histograms", "collectors")
+
+    def __init__(self) -> None:
+        self.descriptions: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.collectors: Dict[str, Callable[[], Iterable[Tuple[Dict[str, Any], float]]]] = {}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} metrics={len(self.descriptions)}>"
+
+    def describe(self, name: str, kind: str, description: str) -> None:
+        self.descriptions[name] = (kind, description)
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        series = self.counters.setdefault(name, {})
+        key = to_labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def add(self, name: str, value: float, **labels: Any) -> None:
+        series = self.gauges.setdefault(name, {})
+        key = to_labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = to_labels(labels)
+
+        if (histogram := series.get(key)) is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def collector(self, name: str, func: Callable[[], Iterable[Tuple[Dict[str, Any], float]]]) -> None:
+        """|method|
+
+        Registers a gauge whose values are read when the metrics are collected
+
+        Parameters
+        ----------
+        name: :class:`str`
+            The name of the gauge
+        func: :class:`Callable`
+            Returns `(labels, value)` pairs
+        """
+        self.collectors[name] = func
+
+    def collect(self) -> Dict[str, Dict[Labels, Any]]:
+        """|method|
+
+        Returns every metric by name and labels. Histograms are returned as :class:`Histogram`
+
+        """
+
+        data: Dict[str, Dict[Labels, Any]] = {}
+        for series in (self.counters, self.gauges, self.histograms):
+            for name, values in series.items():
+                data[name] = dict(values)
+
+        for name, func in self.collectors.items():
+            data[name] = {to_labels(labels): value for labels, value in func()}
+        return data
+
+    def render(self) -> str:
+        """|method|
+
+        Renders the metrics in the Prometheus text exposition format
+
+        """
+
+        lines: List[str] = []
+        for name, values in self.collect().items():
+            kind, description = self.descriptions.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for labels, value in values.items():
+                if not isinstance(value, Histogram):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels, ('le', '+Inf'))} {value.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
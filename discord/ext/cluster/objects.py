@@ -1,4 +1,26 @@
-from typing import Dict, Any, Optional, Union, Tuple
+from __future__ import annotations
+
+import asyncio
+import collections
+import copy
+import inspect
+import typing
+
+from typing import TYPE_CHECKING, Dict, Any, Callable, List, Literal, Optional, Union, Tuple, Type
+from types import MemberDescriptorType, SimpleNamespace
+from discord.ext.cluster.errors import InvalidPayload
+
+try:
+    from types import UnionType
+except ImportError:
+    UnionType = None
+
+if TYPE_CHECKING:
+    from websockets.server import WebSocketServerProtocol
+    from discord.ext.cluster.cache import CachePolicy
+    from discord.ext.cluster.shard import RouteFunc
+
+MISSING: Any = object()
 
 class ClientPayload:
     """|class|
@@ -8,6 +30,10 @@ class ClientPayload:
     can be used. If you do not Typehint the function with the custom
     payload then it will automatically use this base payload,
     but keys and values can be accessed like a dictionary or using `X.y`.
+
+    The annotated attributes of a subclass are the fields of the route, the class attributes
+    are their defaults. The fields are checked before the route is called and requests
+    with a missing field or a value of the wrong type are rejected with code 400.
     
     Parameters:
     ----------
@@ -29,11 +55,12 @@ class ClientPayload:
     def __contains__(self, __o: object) -> bool:
         return __o in self.data or __o in self.data.values()
 
-    def __getattribute__(self, name: str) -> Any:
+    def __getattr__(self, name: str) -> Any:
+        # only called when the attribute isn't found, so the fields of typed payloads are read directly
         try:
-            return object.__getattribute__(self, name)
-        except AttributeError:
             return self.data[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} lenght={self.lenght} endpoint={self.endpoint!r}>"
@@ -48,4 +75,350 @@ class ClientPayload:
         Returns the payload in the form of dictionary items.
 
         """
-        return self.payload.items()
\ No newline at end of file
+        return self.payload.items()
+
+class Field:
+    """|class|
+
+    A field of a typed payload
+
+    Parameters:
+    ----------
+    name: `str`
+        The key of the field in the kwargs of the request
+    annotation: `Any`
+        The type hint of the field
+    default: `Any`
+        The value of the field when the request doesn't have it, `MISSING` makes it required
+    """
+
+    __slots__: Tuple[str] = ("name", "annotation", "default", "mutable", "check")
+
+    def __init__(self, name: str, annotation: Any, default: Any) -> None:
+        self.name = name
+        self.annotation = annotation
+        self.default = default
+        self.mutable: bool = isinstance(default, (list, dict, set))
+        self.check: Callable[[Any], bool] = type_check(annotation)
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} name={self.name!r} annotation={self.annotation!r}>"
+
+    def resolve(self, data: Dict[str, Any]) -> Any:
+        if (value := data.get(self.name, MISSING)) is MISSING:
+            if self.default is MISSING:
+                raise InvalidPayload(f"Missing field {self.name!r}!")
+            # copied, so a mutable default isn't shared between the requests
+            return copy.copy(self.default) if self.mutable else self.default
+
+        if not self.check(value):
+            raise InvalidPayload(f"Field {self.name!r} expected {type_name(self.annotation)}, got {type(value).__name__!r}!")
+        return value
+
+def type_name(annotation: Any) -> str:
+    return annotation.__name__ if isinstance(annotation, type) else repr(annotation).replace("typing.", "")
+
+def type_check(annotation: Any) -> Callable[[Any], bool]:
+    # decoded messages only hold JSON-like values, so containers are checked by their type and not by their items
+    origin = typing.get_origin(annotation)
+
+    if annotation is Any or isinstance(annotation, (str, typing.TypeVar)):
+        return lambda value: True
+
+    if origin is Union or (UnionType is not None and origin is UnionType):
+        checks = [type_check(x) for x in typing.get_args(annotation)]
+        return lambda value: any(check(value) for check in checks)
+
+    if origin is Literal:
+        values = typing.get_args(annotation)
+        return lambda value: value in values
+
+    if annotation is None or annotation is type(None):
+        return lambda value: value is None
+
+    if (annotation := origin or annotation) is float:
+        return lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    if annotation is int:
+        return lambda value: isinstance(value, int) and not isinstance(value, bool)
+
+    if annotation is tuple:
+        # arrays are decoded as lists
+        return lambda value: isinstance(value, (list, tuple))
+
+    if isinstance(annotation, type):
+        return lambda value: isinstance(value, annotation)
+    return lambda value: True
+
+PAYLOADS: Dict[Type[ClientPayload], Type[ClientPayload]] = {}
+
+def compile_payload(cls: Type[ClientPayload]) -> Type[ClientPayload]:
+    """|method|
+
+    Builds a slotted subclass of the payload that reads its fields from the request once.
+    Every payload class is built once and shared by the routes that use it
+
+    Parameters
+    ----------
+    cls: `Type[ClientPayload]`
+        The subclass with the annotated fields
+    """
+
+    if (compiled := PAYLOADS.get(cls)) is not None:
+        return compiled
+
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        # forward references that can't be resolved are accepted as they come
+        hints = {x: Any for klass in cls.__mro__ for x in getattr(klass, "__annotations__", {})}
+
+    reserved = {x for klass in ClientPayload.__mro__ for x in vars(klass)} | set(ClientPayload.__slots__)
+    fields: List[Field] = []
+
+    for name, annotation in hints.items():
+        if name.startswith("_") or typing.get_origin(annotation) is typing.ClassVar:
+            continue
+
+        if name in reserved:
+            raise TypeError(f"The field {name!r} of {cls.__name__} is reserved by ClientPayload!")
+        # the slots of the subclass aren't defaults
+        if isinstance(default := getattr(cls, name, MISSING), MemberDescriptorType):
+            default = MISSING
+        fields.append(Field(name, annotation, default))
+
+    def __init__(self: ClientPayload, payload: Dict[str, Any]) -> None:
+        ClientPayload.__init__(self, payload)
+        data = self.data
+        for field in fields:
+            setattr(self, field.name, field.resolve(data))
+
+    PAYLOADS[cls] = compiled = type(cls.__name__, (cls,), {
+        "__slots__": tuple(x.name for x in fields),
+        "__init__": __init__,
+        "__qualname__": cls.__qualname__,
+        "__module__": cls.__module__
+    })
+    return compiled
+
+def payload_class(func: Callable) -> Type[ClientPayload]:
+    """|method|
+
+    Returns the payload class of the route from the type hint of its payload argument,
+    :class:`ClientPayload` if it isn't a subclass with fields.
+    Raises :class:`NameError` if the type hint can't be resolved
+
+    Parameters
+    ----------
+    func: `Callable`
+        The route
+    """
+
+    parameters = list(inspect.signature(func).parameters.values())
+    if len(parameters) < 2 or (annotation := parameters[1].annotation) is inspect.Parameter.empty:
+        return ClientPayload
+
+    # only the payload argument is resolved, the other hints can refer to anything
+    if isinstance(annotation, str):
+        hints = SimpleNamespace(__annotations__={parameters[1].name: annotation})
+        annotation = typing.get_type_hints(hints, getattr(inspect.unwrap(func), "__globals__", {}))[parameters[1].name]
+
+    if not isinstance(annotation, type) or not issubclass(annotation, ClientPayload) or annotation is ClientPayload:
+        return ClientPayload
+    return compile_payload(annotation)
+
+class Route:
+    """|class|
+
+    An endpoint registered with :meth:`Shard.route`
+
+    Parameters:
+    ----------
+    name: `str`
+        The endpoint name
+    shard_id: `str | int`
+        The shard that serves the endpoint, `None` means every shard
+    func: `Callable`
+        The coroutine that handles the requests, or an async generator
+        whose items are streamed to the client
+    cache: `CachePolicy`
+        How the cluster should cache the responses
+    max_concurrency: `int`
+        How many requests can be handled at the same time
+    queue_size: `int`
+        How many requests can wait for a free slot before new ones are rejected
+    """
+
+    __slots__: Tuple[str] = ("name", "shard_id", "func", "cache", "max_concurrency", "queue_size", "streaming", "payload")
+
+    def __init__(
+        self,
+        name: str,
+        shard_id: Optional[Union[int, str]],
+        func: RouteFunc,
+        cache: Optional[CachePolicy] = None,
+        max_concurrency: Optional[int] = None,
+        queue_size: Optional[int] = None
+    ) -> None:
+        self.name = name
+        self.shard_id = shard_id
+        self.func = func
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.streaming: bool = inspect.isasyncgenfunction(func)
+        # resolved when the routes are built, so the payload class can be defined after the route
+        self.payload: Optional[Type[ClientPayload]] = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} name={self.name!r} shard_id={self.shard_id!r} streaming={self.streaming}>"
+
+    @property
+    def limited(self) -> bool:
+        return self.max_concurrency is not None or self.queue_size is not None
+
+class Limiter:
+    """|class|
+
+    Tracks the admitted requests of a route and limits how many of them run at the same time
+
+    Parameters:
+    ----------
+    max_concurrency: `int`
+        How many requests can run at the same time, `None` means no limit
+    queue_size: `int`
+        How many requests can wait for a free slot, `None` means no limit
+    """
+
+    __slots__: Tuple[str] = ("max_concurrency", "queue_size", "semaphore", "pending")
+
+    def __init__(self, max_concurrency: Optional[int], queue_size: Optional[int]) -> None:
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.semaphore: Optional[asyncio.Semaphore] = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.pending: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} pending={self.pending} max_concurrency={self.max_concurrency} queue_size={self.queue_size}>"
+
+    @property
+    def full(self) -> bool:
+        if self.queue_size is None:
+            return False
+        return self.pending >= (self.max_concurrency or 0) + self.queue_size
+
+class Replica:
+    """|class|
+
+    A connection registered under a shard ID in the cluster. Multiple replicas
+    can serve the same shard ID and the requests are balanced between them.
+
+    Parameters:
+    ----------
+    websocket: `websockets.server.WebSocketServerProtocol`
+        The connection of the shard process
+    endpoints: `List[str]`
+        The endpoints served by the replica
+    client_id: `int`
+        The ID of the bot user
+    replicated: `bool`
+        Whether the process allows other replicas under the same shard ID
+    codecs: `List[str]`
+        The codecs the process can decode framed requests with, empty if it only accepts regular messages
+    """
+
+    __slots__: Tuple[str] = ("websocket", "endpoints", "client_id", "replicated", "codecs", "in_flight", "rtt")
+
+    def __init__(
+        self,
+        websocket: WebSocketServerProtocol,
+        endpoints: List[str],
+        client_id: Optional[int],
+        replicated: bool = False,
+        codecs: Optional[List[str]] = None
+    ) -> None:
+        self.websocket = websocket
+        self.endpoints = endpoints
+        self.client_id = client_id
+        self.replicated = replicated
+        self.codecs = codecs or []
+        self.in_flight: int = 0
+        self.rtt: float = 0.0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} client_id={self.client_id} in_flight={self.in_flight} rtt={self.rtt:.4f}>"
+
+    @property
+    def load(self) -> Tuple[int, float]:
+        return self.in_flight, self.rtt
+
+    def observe(self, elapsed: float) -> None:
+        # a moving average, so a single slow response doesn't take the replica out of rotation
+        self.rtt = elapsed if not self.rtt else self.rtt * 0.8 + elapsed * 0.2
+
+class Outage:
+    """|class|
+
+    A shard ID whose last replica has disconnected. Requests for it wait in the cluster
+    until the shard registers again or the grace period ends.
+
+    Parameters:
+    ----------
+    future: `asyncio.Future`
+        Resolved with `True` when the shard is back and `False` when the grace period ends
+    handle: `asyncio.TimerHandle`
+        Ends the grace period
+    """
+
+    __slots__: Tuple[str] = ("future", "handle", "waiting")
+
+    def __init__(self, future: asyncio.Future, handle: asyncio.TimerHandle) -> None:
+        self.future = future
+        self.handle = handle
+        self.waiting: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} waiting={self.waiting}>"
+
+class Subscriber:
+    """|class|
+
+    A client subscribed to topics in the cluster. The events wait in a bounded buffer
+    until they are sent, when it's full the oldest one is dropped, so a slow client
+    can't hold up the shards or the other subscribers.
+
+    Parameters:
+    ----------
+    websocket: `websockets.server.WebSocketServerProtocol`
+        The connection of the client
+    nonce: `str`
+        The nonce of the subscription, the events are sent with it
+    topics: `List[str]`
+        The subscribed topics
+    size: `int`
+        How many events can wait in the buffer
+    """
+
+    __slots__: Tuple[str] = ("websocket", "nonce", "topics", "buffer", "ready")
+
+    def __init__(self, websocket: WebSocketServerProtocol, nonce: Optional[str], topics: List[str], size: int) -> None:
+        self.websocket = websocket
+        self.nonce = nonce
+        self.topics = topics
+        self.buffer: collections.deque = collections.deque(maxlen=size)
+        self.ready = asyncio.Event()
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} topics={self.topics!r} buffered={len(self.buffer)}>"
+
+    def push(self, event: Dict[str, Any]) -> bool:
+        """|method|
+
+        Adds the event to the buffer and returns whether the oldest one was dropped for it
+
+        """
+
+        dropped = len(self.buffer) == self.buffer.maxlen
+        self.buffer.append(event)
+        self.ready.set()
+        return dropped
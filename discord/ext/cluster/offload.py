@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Optional, Tuple, Union
+from discord.ext.cluster.codec import Codec
+from discord.ext.cluster.compression import CompressedCodec
+from discord.ext.cluster.sharedmemory import read_segment
+
+if TYPE_CHECKING:
+    from discord.ext.cluster.metrics import Metrics
+
+def encode_message(codec: Codec, data: Any) -> Tuple[int, Union[str, bytes]]:
+    # the size before compression is returned, it tells how long the next message will take
+    if isinstance(codec, CompressedCodec):
+        encoded = codec.codec.encode(data)
+        return len(encoded), codec.pack(encoded)
+    return len(encoded := codec.encode(data)), encoded
+
+class Offload:
+    """|class|
+
+    Moves the encoding and decoding of large messages off the event loop, small ones are handled inline
+    since handing them to an executor costs more than it saves. Decoding is offloaded by the size of the message.
+    The size of an encoded message is only known afterwards, so it's offloaded when the previous message
+    with the same key, like the endpoint of a response, was above the threshold.
+
+    Parameters:
+    ----------
+    threshold: `int`
+        Messages of at least this many bytes are encoded and decoded in the executor
+    executor: `str`
+        Can be `thread` or `process`. Threads share the memory of the process and release the event loop
+        while compressing, processes avoid the GIL but the messages are pickled to them
+        and the compression stats don't include the work done there
+    workers: `int`
+        The size of the pool, defaults to the default of the executor
+
+    Attributes:
+    ----------
+    inline_time: `Dict[str, float]`
+        Seconds spent encoding and decoding on the event loop
+    offloaded: `Dict[str, int]`
+        Messages encoded and decoded in the executor
+    """
+
+    __slots__: Tuple[str] = ("threshold", "executor", "sizes", "inline_time", "offloaded")
+
+    def __init__(self, threshold: int = 256 * 1024, executor: str = "thread", workers: Optional[int] = None) -> None:
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor {executor!r}, expected `thread` or `process`!")
+
+        self.threshold = threshold
+        self.executor: Executor = (
+            ThreadPoolExecutor(workers, thread_name_prefix="better-cluster") if executor == "thread" else ProcessPoolExecutor(workers)
+        )
+        self.sizes: Dict[Hashable, int] = {}
+        self.inline_time: Dict[str, float] = {"encode": 0.0, "decode": 0.0}
+        self.offloaded: Dict[str, int] = {"encode": 0, "decode": 0}
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} threshold={self.threshold} executor={self.executor.__class__.__name__}>"
+
+    async def encode(self, codec: Codec, data: Any, key: Optional[Hashable] = None) -> Union[str, bytes]:
+        """|coro|
+
+        Encodes the data, in the executor if the last message with the key was large
+
+        Parameters
+        ----------
+        codec: :class:`Codec`
+            The codec of the connection
+        data: `Any`
+            The message
+        key: `Hashable`
+            Groups the messages of similar size. Messages without a key are always encoded inline
+        """
+
+        if key is not None and self.sizes.get(key, 0) >= self.threshold:
+            self.offloaded["encode"] += 1
+            size, encoded = await asyncio.get_running_loop().run_in_executor(self.executor, encode_message, codec, data)
+        else:
+            started = time.perf_counter()
+            size, encoded = encode_message(codec, data)
+            self.inline_time["encode"] += time.perf_counter() - started
+
+        if key is not None:
+            self.sizes[key] = size
+        return encoded
+
+    async def decode(self, codec: Codec, data: Union[str, bytes]) -> Any:
+        """|coro|
+
+        Decodes the message, in the executor if it's larger than the threshold
+
+        Parameters
+        ----------
+        codec: :class:`Codec`
+            The codec of the connection
+        data: `str | bytes`
+            The message
+        """
+
+        started = time.perf_counter()
+        if len(data) < self.threshold and isinstance(codec, CompressedCodec):
+            # a small compressed message can still be large once it's decompressed
+            data, codec = codec.unpack(data), codec.codec
+
+        if len(data) >= self.threshold:
+            self.inline_time["decode"] += time.perf_counter() - started
+            self.offloaded["decode"] += 1
+            return await asyncio.get_running_loop().run_in_executor(self.executor, codec.decode, data)
+
+        try:
+            return codec.decode(data)
+        finally:
+            self.inline_time["decode"] += time.perf_counter() - started
+
+    async def read_segment(self, descriptor: Dict[str, Any]) -> Dict[str, Any]:
+        """|coro|
+
+        Reads a response from shared memory, in the executor if it's larger than the threshold
+
+        Parameters
+        ----------
+        descriptor: :class:`Dict`
+            The `name`, `size` and `codec` of the segment
+        """
+
+        if descriptor.get("size", 0) >= self.threshold:
+            self.offloaded["decode"] += 1
+            return await asyncio.get_running_loop().run_in_executor(self.executor, read_segment, descriptor)
+
+        started = time.perf_counter()
+        try:
+            return read_segment(descriptor)
+        finally:
+            self.inline_time["decode"] += time.perf_counter() - started
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def describe(self, metrics: Metrics, prefix: str) -> None:
+        """|method|
+
+        Registers the offload metrics under the prefix
+
+        Parameters
+        ----------
+        metrics: :class:`Metrics`
+            The registry of the cluster or the shard
+        prefix: :class:`str`
+            `cluster` or `shard`
+        """
+
+        metrics.describe(f"{prefix}_codec_inline_seconds_total", "counter", "Time spent encoding and decoding on the event loop")
+        metrics.describe(f"{prefix}_codec_offloaded_total", "counter", "Messages encoded and decoded in the executor")
+
+        metrics.collector(f"{prefix}_codec_inline_seconds_total", lambda: [({"op": x}, y) for x, y in self.inline_time.items()])
+        metrics.collector(f"{prefix}_codec_offloaded_total", lambda: [({"op": x}, y) for x, y in self.offloaded.items()])
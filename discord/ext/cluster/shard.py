@@ -1,16 +1,30 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import contextlib
 import logging
+import time
+
+from types import FunctionType, MethodType
 
-from websockets.client import connect
 from discord.ext.commands import Bot, Cog
-from discord.ext.cluster.errors import NotConnected
-from discord.ext.cluster.objects import ClientPayload
+from discord.ext.cluster.cache import CachePolicy
+from discord.ext.cluster.codec import CODECS, Codec, get_codec
+from discord.ext.cluster.compression import CompressedCodec, Compression, accepted, advertise
+from discord.ext.cluster.envelope import is_frame, pack_frame, unpack_frame
+from discord.ext.cluster.errors import InvalidPayload, MessageTooLarge, NotConnected, UnknownCompression
+from discord.ext.cluster.metrics import Metrics, watch_event_loop
+from discord.ext.cluster.offload import Offload
+from discord.ext.cluster.objects import ClientPayload, Limiter, Route, payload_class
+from discord.ext.cluster.sharedmemory import SharedMemoryPolicy, SharedMemoryReply
+from discord.ext.cluster.store import ReadThroughCache, StoreView
+from discord.ext.cluster.transport import MAX_SIZE, backoff, exceeds, is_unix, open_websocket, send_request, split_address, too_large
 from websockets.server import WebSocketServerProtocol
 from websockets.exceptions import InvalidHandshake, ConnectionClosed
-from typing import TYPE_CHECKING, Any, Tuple, Optional, Callable, TypeVar, Dict, Union, Type
+from typing import TYPE_CHECKING, Any, List, Tuple, Optional, Callable, Set, TypeVar, Dict, Union, Type
+
+# failed reconnects to a node before the next known node is tried
+FAILOVER_ATTEMPTS = 3
 
 if TYPE_CHECKING:
     from typing_extensions import ParamSpec, TypeAlias
@@ -20,6 +34,15 @@ if TYPE_CHECKING:
     
     RouteFunc: TypeAlias = Callable[P, T]
 
+def cog_methods() -> Set[FunctionType]:
+    # every cog class that is imported, loaded or not, is a subclass of Cog
+    classes, methods = [Cog], set()
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        methods.update(x for x in vars(cls).values() if isinstance(x, FunctionType))
+    return methods
+
 class Shard:
     """|class|
     
@@ -33,16 +56,86 @@ class Shard:
     shard_id: `str | int`
         This is how the bot will be identified in the cluster
     host: `str`
-        The host of the cluster
+        The host of the cluster, or `unix://` followed by the socket path
+        if the cluster listens on a Unix domain socket
     port: `int`
         The port of the cluster
     secret_key: `str`
         Used for authentication when handling requests.
+    codec: `str`
+        The wire format, can be `json`, `orjson` or `msgpack`.
+        Falls back to `json` if the cluster doesn't support it
+    max_in_flight: `int`
+        How many requests can be handled at the same time across all endpoints.
+        Requests above the limit are rejected with a retryable error
+    replica: `bool`
+        Allows other processes to register under the same shard ID.
+        The cluster balances the requests between the replicas,
+        so they should serve the same read-only endpoints
+    shard_ids: `List[int]`
+        The Discord shards handled by the process. Defaults to the shards of the bot
+    shard_count: `int`
+        The total number of Discord shards. Defaults to the shard count of the bot.
+        The cluster routes requests made with a `guild_id` by these
+    compression: `Compression`
+        Compresses the responses above its threshold instead of using per-message deflate for all of them
+    shared_memory: `SharedMemoryPolicy`
+        Sends the large responses through shared memory to the clients that run on the same host
+        and ask for it with `Client(shared_memory=True)`
+    reconnect: `bool`
+        Keeps retrying with jittered exponential backoff when connecting fails or the connection
+        to the cluster is lost, until :meth:`disconnect` is called. The shard remembers the node it
+        was started with and the nodes it was redirected to, after a few failed attempts the next one is tried
+    store_cache: `int`
+        Keeps copies of up to this many keys read from the key-value store of the cluster.
+        The cluster tells the shard when they change, if not provided every read reaches the cluster
+    offload: `Offload`
+        Encodes and decodes the large messages in an executor, so they don't block the gateway of the bot
+    max_size: `int`
+        The largest message in bytes, must match the cluster. Responses above it are replaced
+        with a 413 error instead of closing the connection. `None` disables the limit
+
+    Attributes:
+    ----------
+    metrics: `Metrics`
+        The request counts and handler timings of the shard
+    store: `StoreView`
+        The key-value store of the cluster
     """
 
-    __slots__: Tuple[str] = ("bot", "shard_id", "host", "port", "secret_key", "logger", "websocket", "task")
+    __slots__: Tuple[str] = (
+        "bot",
+        "shard_id",
+        "host",
+        "port",
+        "secret_key",
+        "codec",
+        "max_in_flight",
+        "replica",
+        "shard_ids",
+        "shard_count",
+        "compression",
+        "shared_memory",
+        "reconnect",
+        "closing",
+        "reconnecting",
+        "nodes",
+        "in_flight",
+        "limiters",
+        "routes",
+        "streams",
+        "waiters",
+        "store",
+        "offload",
+        "max_size",
+        "monitor",
+        "metrics",
+        "logger",
+        "websocket",
+        "task"
+    )
 
-    endpoints: Dict[str, Tuple[Union[int, str], RouteFunc]] = {}
+    endpoints: Dict[str, Route] = {}
 
     def __init__(
         self,
@@ -50,64 +143,284 @@ class Shard:
         shard_id: Union[str, int],
         host: str = "127.0.0.1",
         port: int = 20000,
-        secret_key: str = None 
+        secret_key: str = None,
+        codec: str = "json",
+        max_in_flight: Optional[int] = None,
+        replica: bool = False,
+        shard_ids: Optional[List[int]] = None,
+        shard_count: Optional[int] = None,
+        compression: Optional[Compression] = None,
+        shared_memory: Optional[SharedMemoryPolicy] = None,
+        reconnect: bool = True,
+        store_cache: Optional[int] = None,
+        offload: Optional[Offload] = None,
+        max_size: Optional[int] = MAX_SIZE
     ) -> None:
         self.bot = bot
         self.shard_id = shard_id
         self.host = host
         self.port = port
         self.secret_key = secret_key
+        self.codec: Codec = get_codec(codec)
+        self.max_in_flight = max_in_flight
+        self.replica = replica
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.compression = compression
+        self.shared_memory = shared_memory
+        self.reconnect = reconnect
+        self.closing: bool = False
+        self.reconnecting: Optional[asyncio.Task] = None
+        self.nodes: List[str] = [self.address]
+        self.in_flight: int = 0
+        self.limiters: Dict[str, Limiter] = {}
+        self.routes: Dict[str, Tuple[Route, Callable[[ClientPayload], Any]]] = {}
+        self.streams: Dict[str, Tuple[asyncio.Semaphore, asyncio.Task]] = {}
+        self.waiters: Dict[str, asyncio.Future] = {}
+        self.store = StoreView(self.send_request, ReadThroughCache(store_cache) if store_cache else None)
+        self.offload = offload
+        self.max_size = max_size
+        self.monitor: Optional[asyncio.Task] = None
+
+        self.metrics = Metrics()
+        self.metrics.describe("shard_requests_total", "counter", "Requests handled by the shard")
+        self.metrics.describe("shard_errors_total", "counter", "Handled requests that didn't return code 200")
+        self.metrics.describe("shard_rejected_total", "counter", "Requests rejected because the shard or the route was full")
+        self.metrics.describe("shard_in_flight", "gauge", "Requests admitted and not finished yet")
+        self.metrics.describe("shard_handler_duration_seconds", "histogram", "Time spent in the route handler")
+        self.metrics.collector("shard_in_flight", lambda: [({}, self.in_flight)])
+        if compression is not None:
+            compression.describe(self.metrics, "shard")
+        if shared_memory is not None:
+            shared_memory.describe(self.metrics, "shard")
+        if offload is not None:
+            offload.describe(self.metrics, "shard")
         self.logger = logging.getLogger("discord.ext.cluster")
         self.websocket: WebSocketServerProtocol = None
         self.task: asyncio.Task = None
+        self.watch_cogs()
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} connected={self.connected}>"
 
-    def __find_cls__(self, func: RouteFunc) -> Union[Bot, Cog]:
+    def watch_cogs(self) -> None:
+        # discord.py doesn't dispatch an event when a cog is added or removed and `cog_load` belongs
+        # to the cog, so the methods are wrapped to keep the route table up to date. This is the only
+        # place where the routes of a cog are bound after the shard has connected
+        if not hasattr(self.bot, "add_cog") or not hasattr(self.bot, "remove_cog"):
+            return
+
+        add_cog, remove_cog = self.bot.add_cog, self.bot.remove_cog
+
+        async def add(cog: Cog, *args: Any, **kwargs: Any) -> None:
+            await add_cog(cog, *args, **kwargs)
+            if self.bind_routes(cog):
+                await self.advertise()
+
+        async def remove(name: str, *args: Any, **kwargs: Any) -> Optional[Cog]:
+            if (cog := await remove_cog(name, *args, **kwargs)) is not None and self.unbind_routes(cog):
+                await self.advertise()
+            return cog
+
+        self.bot.add_cog, self.bot.remove_cog = add, remove
+
+    def bind_routes(self, owner: Union[Bot, Cog]) -> bool:
+        served = {x.func: x for x in self.endpoints.values() if x.shard_id is None or x.shard_id == self.shard_id}
+        changed = False
+
+        for cls in type(owner).__mro__:
+            for value in vars(cls).values():
+                if isinstance(value, FunctionType) and (route := served.get(value)) is not None:
+                    self.add_route(route, MethodType(value, owner))
+                    changed = True
+        return changed
+
+    def unbind_routes(self, owner: Union[Bot, Cog]) -> bool:
+        names = [x for x, (_, func) in self.routes.items() if func.__self__ is owner]
+        for name in names:
+            del self.routes[name]
+            # the requests still running release the limiter of a removed route when they finish
+            if (limiter := self.limiters.get(name)) and not limiter.pending:
+                del self.limiters[name]
+        return bool(names)
+
+    def add_route(self, route: Route, func: Callable[[ClientPayload], Any]) -> None:
+        if route.payload is None:
+            # built once, so the requests are only checked against the fields
+            try:
+                route.payload = payload_class(route.func)
+            except Exception as exception:
+                self.logger.warning(f"Failed to resolve the payload type of {route.name!r}, its requests won't be validated: {exception}")
+                route.payload = ClientPayload
+
+        self.routes[route.name] = route, func
+        if route.limited and route.name not in self.limiters:
+            self.limiters[route.name] = Limiter(route.max_concurrency, route.queue_size)
+
+    def build_routes(self) -> None:
+        """|method|
+
+        Binds the endpoints of the loaded cogs to them and the endpoints outside of cogs to the bot.
+        The endpoints of a cog that isn't loaded are left out until it is added.
+
+        """
+
+        # the routes of a cog are only bound once the cog is added, before that they don't exist
+        in_cogs = cog_methods()
+
+        self.routes = {}
+        for route in self.endpoints.values():
+            if (route.shard_id is None or route.shard_id == self.shard_id) and route.func not in in_cogs:
+                self.add_route(route, MethodType(route.func, self.bot))
+
         for cog in self.bot.cogs.values():
-            if func.__name__ in dir(cog):
-                return cog
-        return self.bot
+            self.bind_routes(cog)
 
     @classmethod
-    def route(cls, shard_id: Union[int, str], name: Optional[str] = None) -> Callable[[RouteFunc], RouteFunc]:
+    def route(
+        cls,
+        shard_id: Optional[Union[int, str]] = None,
+        name: Optional[str] = None,
+        cache: Optional[CachePolicy] = None,
+        max_concurrency: Optional[int] = None,
+        queue_size: Optional[int] = None
+    ) -> Callable[[RouteFunc], RouteFunc]:
         """|method|
 
         Used to register a coroutine as an endpoint
 
         Parameters
         ----------
+        shard_id: :class:`str | int`
+            The shard that serves the endpoint. If not provided every shard will serve it,
+            which makes the endpoint available for broadcasts.
         name: :class:`str`
             The endpoint name. If not provided the method name will be used.
         multicast :class:`bool`
             Should the enpoint be avaiable for multicast or not. If this is set to False only standard connection can access it.
+        cache: :class:`CachePolicy`
+            Allows the cluster to cache the responses of the endpoint.
+            Use :meth:`invalidate` when the cached data changes.
+        max_concurrency: :class:`int`
+            How many requests of the endpoint can be handled at the same time.
+        queue_size: :class:`int`
+            How many requests can wait for a free slot. When the queue is full
+            new requests are rejected with a retryable error.
         """
         def decorator(func: RouteFunc) -> RouteFunc:
-            cls.endpoints[name or func.__name__] = (shard_id, func)
+            cls.endpoints[name or func.__name__] = Route(name or func.__name__, shard_id, func, cache, max_concurrency, queue_size)
             return func
         return decorator
 
     @property
     def connected(self) -> bool:
-        return self.websocket is not None
+        return self.websocket is not None and not self.websocket.closed
+
+    @property
+    def negotiated_codec(self) -> Codec:
+        return CompressedCodec(get_codec(self.websocket.subprotocol), self.compression, self.max_size, accepted(self.websocket.response_headers))
 
     @property
     def base_url(self) -> str:
-        return f"ws://{self.host}:{self.port}"
+        return self.host if is_unix(self.host) else f"ws://{self.host}:{self.port}"
 
-    async def handle_request(self, request: Dict) -> None:
+    @property
+    def address(self) -> str:
+        return self.host if is_unix(self.host) else f"{self.host}:{self.port}"
+
+    def body_codec(self, name: Optional[str]) -> Codec:
+        # the bodies of framed messages use the codec of the client, which can differ from the one of the shard.
+        # They are compressed for the cluster, which decodes them if the client can't decompress them
+        return CompressedCodec(get_codec(name), self.compression, self.max_size, accepted(self.websocket.response_headers))
+
+    async def encode(self, data: Dict[str, Any], key: Optional[str] = None, codec: Optional[Codec] = None) -> Union[str, bytes]:
+        if self.offload is None:
+            return (codec or self.negotiated_codec).encode(data)
+        return await self.offload.encode(codec or self.negotiated_codec, data, key)
+
+    async def decode(self, data: Union[str, bytes], codec: Optional[Codec] = None) -> Dict[str, Any]:
+        if self.offload is None:
+            return (codec or self.negotiated_codec).decode(data)
+        return await self.offload.decode(codec or self.negotiated_codec, data)
+
+    def admit(self, endpoint: str) -> Optional[Dict]:
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            self.metrics.inc("shard_rejected_total", endpoint=endpoint)
+            return {
+                "error": "The shard is overloaded, try again later!",
+                "code": 429,
+                "retryable": True
+            }
+
+        if (limiter := self.limiters.get(endpoint)) and limiter.full:
+            self.metrics.inc("shard_rejected_total", endpoint=endpoint)
+            return {
+                "error": f"Too many pending requests for {endpoint!r}, try again later!",
+                "code": 429,
+                "retryable": True
+            }
+
+        self.in_flight += 1
+        if limiter:
+            limiter.pending += 1
+        return None
+
+    def release(self, endpoint: str) -> None:
+        self.in_flight -= 1
+        if (limiter := self.limiters.get(endpoint)):
+            limiter.pending -= 1
+            if not limiter.pending and endpoint not in self.routes:
+                del self.limiters[endpoint]
+
+    async def invoke(self, endpoint: str, func: Callable[[ClientPayload], Any], payload: ClientPayload) -> Any:
+        if (limiter := self.limiters.get(endpoint)) and limiter.semaphore:
+            async with limiter.semaphore:
+                return await func(payload)
+        return await func(payload)
+
+    async def call_route(self, request: Dict, timeout: Optional[float] = None) -> Tuple[Dict, float]:
         self.logger.debug(f"Received request: {request!r}")
 
         endpoint: str = request.get("endpoint")
+        started = time.perf_counter()
 
-        shard_id, func = self.endpoints.get(endpoint)
-        cls = self.__find_cls__(endpoint)
-        
-        arguments = (cls, ClientPayload(request))
+        if (route := self.routes.get(endpoint)) is None:
+            # the cog was removed after the cluster forwarded the request
+            self.release(endpoint)
+            return {
+                "error": "Unknown endpoint!",
+                "code": 404
+            }, 0.0
+
+        if route[0].streaming:
+            self.release(endpoint)
+            return {
+                "error": f"Endpoint {endpoint!r} streams its response, use `Client.stream`!",
+                "code": 400
+            }, 0.0
+
+        try:
+            payload = route[0].payload(request)
+        except InvalidPayload as error:
+            # rejected before the route runs, it can rely on the fields of its payload
+            self.release(endpoint)
+            self.metrics.inc("shard_errors_total", endpoint=endpoint)
+            return {
+                "error": str(error),
+                "code": 400
+            }, 0.0
 
         try:
-            response: Optional[Union[Dict, Any]] = await func(*arguments)
+            # nobody waits for the response after the deadline, so the route is cancelled
+            response: Optional[Union[Dict, Any]] = await asyncio.wait_for(
+                self.invoke(endpoint, route[1], payload), timeout
+            )
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Cancelled {endpoint!r} because the deadline of the request has passed")
+            response = {
+                "error": "The deadline of the request has passed!",
+                "code": 504,
+            }
         except Exception as exception:
             self.bot.dispatch("ipc_error", endpoint, exception)
             self.logger.error(f"Received error while executing {endpoint!r}", exc_info=exception)
@@ -115,6 +428,9 @@ class Shard:
                 "error": "Something went wrong while calling the route!",
                 "code": 500,
             }
+        finally:
+            self.release(endpoint)
+            duration = time.perf_counter() - started
 
         response = response or {} 
         if not isinstance(response, Dict):
@@ -125,54 +441,453 @@ class Shard:
         
         if not response.get("code"):
             response["code"] = 200
-        
-        async with connect(
-            self.base_url + "/return_response",
-            extra_headers={
-                "Secret-Key": str(self.secret_key),
-                "UUID": request["uuid"]
-            }
-        ) as ws:
-            await ws.send(json.dumps(response, separators=(", ", ": ")))
+
+        self.metrics.inc("shard_requests_total", endpoint=endpoint)
+        self.metrics.observe("shard_handler_duration_seconds", duration, endpoint=endpoint)
+        if response["code"] != 200:
+            self.metrics.inc("shard_errors_total", endpoint=endpoint)
+        return response, duration
+
+    async def send_response(
+        self,
+        uuid: str,
+        response: Union[Dict, List[Dict]],
+        duration: Optional[Union[float, List[Optional[float]]]] = None,
+        endpoint: Optional[str] = None,
+        codec: Optional[str] = None
+    ) -> None:
+        async def build(response: Union[Dict, List[Dict]]) -> Union[str, bytes]:
+            # the handler time is reported, so the cluster can tell it apart from the time on the wire
+            if codec is None:
+                return await self.encode({
+                    "uuid": uuid,
+                    "response": response,
+                    "duration": duration,
+                    **({"shared_memory": True} if isinstance(response, SharedMemoryReply) else {})
+                }, endpoint)
+
+            # the reply to a framed request, the cluster relays the body to the client without decoding it
+            return pack_frame(get_codec(self.websocket.subprotocol), {
+                "uuid": uuid,
+                "code": response["code"],
+                "duration": duration,
+                **({"shared_memory": True} if isinstance(response, SharedMemoryReply) else {})
+            }, await self.encode(response, endpoint, self.body_codec(codec)))
+
+        try:
+            if exceeds(message := await build(response), self.max_size):
+                # a larger message would close the connection and fail every request in flight on it,
+                # the error is sent without checking it again, so a tiny limit can't make it loop
+                self.logger.warning(f"The response of {endpoint!r} is {len(message)} bytes, larger than the limit of {self.max_size} bytes")
+                message = await build(too_large(len(message), self.max_size))
+            await self.websocket.send(message)
+        except ConnectionClosed:
+            self.logger.warning(f"Failed to send response {uuid!r}, the connection to the cluster was closed")
+        else:
             self.logger.debug(f"Sending response: {response!r}")
 
+    async def export(self, response: Dict, endpoint: str) -> Dict:
+        # the response is encoded with the codec of the connection, so the client can decode it the same way
+        codec = get_codec(self.websocket.subprotocol)
+        data = codec.encode(response) if self.offload is None else await self.offload.encode(codec, response, endpoint)
+
+        if (descriptor := self.shared_memory.export(data.encode("UTF-8") if isinstance(data, str) else data, codec)) is None:
+            return response
+        return SharedMemoryReply({
+            "shared_memory": descriptor,
+            "code": response["code"]
+        })
+
+    async def handle_request(self, request: Dict) -> None:
+        response, duration = await self.call_route(request, request.get("timeout"))
+
+        if request.get("shared_memory") and self.shared_memory is not None and response["code"] == 200:
+            response = await self.export(response, request.get("endpoint"))
+        await self.send_response(request["uuid"], response, duration, request.get("endpoint"), request.get("codec"))
+
+    async def handle_batch(self, request: Dict) -> None:
+        async def call(item: Dict) -> Tuple[Dict, Optional[float]]:
+            if (rejection := self.admit(item.get("endpoint"))) is not None:
+                return rejection, None
+            return await self.call_route(item, request.get("timeout"))
+
+        results = await asyncio.gather(*(call(x) for x in request["batch"]))
+        await self.send_response(request["uuid"], [x[0] for x in results], [x[1] for x in results])
+
+    async def handle_stream(self, request: Dict, credits: asyncio.Semaphore) -> None:
+        endpoint: str = request.get("endpoint")
+        started = time.perf_counter()
+
+        if (route := self.routes.get(endpoint)) is None or not route[0].streaming:
+            self.release(endpoint)
+            self.streams.pop(request["uuid"], None)
+            return await self.send_response(request["uuid"], {
+                "error": "Unknown endpoint!" if route is None else f"Endpoint {endpoint!r} doesn't stream its response!",
+                "code": 404 if route is None else 400
+            })
+
+        try:
+            payload = route[0].payload(request)
+        except InvalidPayload as error:
+            self.release(endpoint)
+            self.streams.pop(request["uuid"], None)
+            self.metrics.inc("shard_errors_total", endpoint=endpoint)
+            return await self.send_response(request["uuid"], {
+                "error": str(error),
+                "code": 400
+            })
+
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if (limiter := self.limiters.get(endpoint)) and limiter.semaphore:
+                    await stack.enter_async_context(limiter.semaphore)
+
+                # closed on every way out, so the `finally` blocks of the route run when the stream stops early
+                generator = route[1](payload)
+                stack.push_async_callback(generator.aclose)
+
+                async for chunk in generator:
+                    # every chunk needs a credit from the client, so a slow reader pauses the generator
+                    await credits.acquire()
+                    if exceeds(message := await self.encode({"uuid": request["uuid"], "chunk": chunk}, endpoint), self.max_size):
+                        response = too_large(len(message), self.max_size)
+                        break
+                    await self.websocket.send(message)
+                else:
+                    response = {"code": 200}
+        except ConnectionClosed:
+            return
+        except Exception as exception:
+            self.bot.dispatch("ipc_error", endpoint, exception)
+            self.logger.error(f"Received error while streaming {endpoint!r}", exc_info=exception)
+            response = {
+                "error": "Something went wrong while calling the route!",
+                "code": 500,
+            }
+        finally:
+            self.release(endpoint)
+            self.streams.pop(request["uuid"], None)
+            duration = time.perf_counter() - started
+
+        self.metrics.inc("shard_requests_total", endpoint=endpoint)
+        self.metrics.observe("shard_handler_duration_seconds", duration, endpoint=endpoint)
+        if response["code"] != 200:
+            self.metrics.inc("shard_errors_total", endpoint=endpoint)
+        await self.send_response(request["uuid"], response, duration)
+
     async def wait_for_requests(self) -> None:
         while True:
             try:
                 raw = await self.websocket.recv()
             except (ConnectionClosed):
+                if self.websocket.close_code == 4001 and self.websocket.close_reason:
+                    # the cluster group has rebalanced and another node owns the shard now
+                    asyncio.create_task(self.redirect(self.websocket.close_reason))
+                elif self.reconnect and not self.closing:
+                    self.logger.warning("Lost the connection to the cluster, reconnecting")
+                    self.schedule_reconnect()
+
+                for waiter in self.waiters.values():
+                    if not waiter.done():
+                        waiter.set_exception(NotConnected("The connection to the cluster was closed!"))
+                self.waiters.clear()
+
+                # the changes made while disconnected won't be pushed
+                if self.store.cache is not None:
+                    self.store.cache.invalidate()
                 break
             else:
-                data: Dict = json.loads(raw)
-                asyncio.create_task(self.handle_request(data))
+                try:
+                    if is_frame(raw):
+                        header, body = unpack_frame(get_codec(self.websocket.subprotocol), raw)
+                        data: Dict = {**header, "data": await self.decode(body, self.body_codec(header.get("codec")))}
+                    else:
+                        data: Dict = await self.decode(raw)
+                except (MessageTooLarge, UnknownCompression) as error:
+                    # the next receive raises and the shard reconnects
+                    self.logger.warning(f"Closing the connection to the cluster: {error}")
+                    await self.websocket.close(error.close_code, str(error))
+                    continue
+
+                if "response" in data:
+                    # the reply to a request of this shard
+                    if (waiter := self.waiters.pop(data.get("nonce"), None)) and not waiter.done():
+                        waiter.set_result(data["response"])
+                elif "invalidate_key" in data:
+                    if self.store.cache is not None:
+                        self.store.cache.invalidate(data["invalidate_key"])
+                elif "credit" in data or "cancel" in data:
+                    if (stream := self.streams.get(data.get("uuid"))):
+                        for _ in range(data.get("credit", 0)):
+                            stream[0].release()
+                        if data.get("cancel"):
+                            stream[1].cancel()
+                elif "batch" in data:
+                    asyncio.create_task(self.handle_batch(data))
+                elif (rejection := self.admit(data.get("endpoint"))) is not None:
+                    # rejected before a task is created, so a burst can't pile up on the event loop
+                    await self.send_response(data["uuid"], rejection, codec=data.get("codec"))
+                elif data.get("stream"):
+                    credits = asyncio.Semaphore(data.get("window") or 1)
+                    self.streams[data["uuid"]] = credits, asyncio.create_task(self.handle_stream(data, credits))
+                else:
+                    asyncio.create_task(self.handle_request(data))
 
     async def connect(self) -> None:
         """|coro|
         
-        Connects to the cluster with given shard id and registers all endpoints that belong to the mentioned shard id
+        Connects to the cluster with given shard id and registers all endpoints that belong to the mentioned shard id.
+        If it fails and `reconnect` is enabled, the shard keeps retrying in the background
         
         """
+
+        self.closing = False
+        if self.monitor is None:
+            self.monitor = asyncio.create_task(watch_event_loop(self.metrics, "shard"))
+
+        if self.reconnecting is not None and not self.reconnecting.done():
+            return
+
+        if not await self.handshake() and self.reconnect:
+            self.schedule_reconnect()
+
+    def schedule_reconnect(self) -> None:
+        if self.reconnecting is None or self.reconnecting.done():
+            self.reconnecting = asyncio.create_task(self.keep_connected())
+
+    async def keep_connected(self) -> None:
+        attempt = 0
+        while not self.connected and not self.closing:
+            await asyncio.sleep(backoff(attempt))
+            attempt += 1
+
+            if attempt % FAILOVER_ATTEMPTS == 0 and len(self.nodes) > 1:
+                # the node may be gone for good, the others reassign its shards once their ring drops it
+                self.move_to(self.nodes[(self.nodes.index(self.address) + 1) % len(self.nodes)])
+
+            self.logger.info(f"Reconnecting to the cluster at {self.address}, attempt {attempt}")
+            await self.handshake()
+
+    def move_to(self, address: str) -> None:
+        if address not in self.nodes:
+            self.nodes.append(address)
+
+        self.host, port = split_address(address)
+        self.port = port or self.port
+
+    async def handshake(self) -> bool:
         try:
-            self.websocket = await connect(
-                self.base_url + "/initialize_shard", 
+            self.websocket = await open_websocket(
+                self.host,
+                self.port,
+                "/initialize_shard",
                 extra_headers={
                     "Secret-Key": str(self.secret_key),
                     "Shard-ID": self.shard_id,
-                }
+                    **advertise(self.compression)
+                },
+                subprotocols=[self.codec.name],
+                compression=None if self.compression else "deflate",
+                max_size=self.max_size
             )
-        except (ConnectionRefusedError, InvalidHandshake):
-            return self.logger.critical("Failed to connect to the cluster!")
-        else:
+        except (OSError, InvalidHandshake):
+            self.logger.critical("Failed to connect to the cluster!")
+            return False
+
+        self.build_routes()
+        if self.shared_memory is not None:
+            self.shared_memory.sweep()
+
+        try:
             await self.websocket.send(
-                json.dumps({
-                    "endpoints": [x[0] for x in self.endpoints.items() if x[1][0] == self.shard_id],
-                    "client_id": self.bot.user.id
+                self.negotiated_codec.encode({
+                    **self.advertisement(),
+                    "client_id": self.bot.user.id,
+                    "replica": self.replica,
+                    "discord_shards": self.discord_shards(),
+                    "codecs": list(CODECS)
                 })
             )
-            message: Dict[str, Any] = json.loads(await self.websocket.recv())
-            if message["code"] == 200:
-                self.task = asyncio.Task(self.wait_for_requests())
-                self.logger.info("Successfully connected to the cluster!")
+            message: Dict[str, Any] = self.negotiated_codec.decode(await self.websocket.recv())
+        except ConnectionClosed:
+            self.websocket = None
+            self.logger.critical("The cluster closed the connection while connecting!")
+            return False
+
+        if message["code"] == 200:
+            self.task = asyncio.Task(self.wait_for_requests())
+            self.logger.info("Successfully connected to the cluster!")
+            return True
+
+        await self.websocket.close()
+        self.websocket = None
+
+        if message["code"] == 307:
+            await self.redirect(message["owner"])
+            return self.connected
+
+        self.logger.critical(f"The cluster refused the shard: {message.get('error')}")
+        return False
+
+    async def redirect(self, owner: str) -> None:
+        """|coro|
+
+        Reconnects to the cluster node that owns the shard ID
+
+        Parameters:
+        ----------
+        owner: `str`
+            The `host:port` or `unix://<path>` of the node
+        """
+
+        if owner == self.address:
+            return self.logger.critical(f"Redirected to the same node {owner}, the nodes disagree about the owner")
+
+        self.logger.info(f"The shard is owned by {owner}, reconnecting")
+        self.move_to(owner)
+
+        # while the reconnect loop runs this is a no-op, the loop retries the new node
+        if not await self.handshake() and self.reconnect and not self.closing:
+            self.schedule_reconnect()
+
+    def discord_shards(self) -> Optional[Dict[str, Any]]:
+        # read at every connect, the bot knows its shards only once it has logged in
+        if (count := self.shard_count or getattr(self.bot, "shard_count", None)) is None:
+            return None
+
+        if (ids := self.shard_ids or getattr(self.bot, "shard_ids", None)) is None:
+            shard_id = getattr(self.bot, "shard_id", None)
+            ids = list(range(count)) if shard_id is None else [shard_id]
+
+        return {
+            "ids": list(ids),
+            "count": count
+        }
+
+    def advertisement(self) -> Dict[str, Any]:
+        return {
+            "endpoints": list(self.routes),
+            "cache": {x: y.cache.to_dict() for x, (y, _) in self.routes.items() if y.cache is not None}
+        }
+
+    async def advertise(self) -> None:
+        """|coro|
+
+        Sends the current endpoints to the cluster without reconnecting.
+        Called automatically when a cog with endpoints is added or removed.
+
+        """
+
+        if not self.websocket:
+            return
+
+        try:
+            await self.websocket.send(self.negotiated_codec.encode({"op": "update_endpoints", **self.advertisement()}))
+        except ConnectionClosed:
+            self.logger.warning("Failed to advertise the endpoints, the connection to the cluster was closed")
+
+    async def request(
+        self,
+        shard_id: Union[str, int],
+        endpoint: str,
+        *,
+        deadline: float = 30.0,
+        **kwargs: Any
+    ) -> Dict:
+        """|coro|
+
+        Make a request to a route of another shard through the cluster.
+        If the shard ID is the ID of this shard the route is called directly
+
+        Parameters
+        ----------
+        shard_id: :class:`str | int`
+            The shard that should handle the request
+        endpoint: :class:`str`
+            The endpoint to be requested
+        deadline: :class:`float`
+            The deadline of the request in seconds
+        **kwargs: `Any`
+            The data for the endpoint
+        """
+
+        if str(shard_id) == str(self.shard_id):
+            # nothing to encode or send, the route gets the kwargs as they are
+            if (rejection := self.admit(endpoint)) is not None:
+                return rejection
+            return (await self.call_route({"endpoint": endpoint, "data": kwargs}, deadline))[0]
+
+        return await self.send_request({
+            "shard_id": str(shard_id),
+            "endpoint": endpoint,
+            "kwargs": kwargs
+        }, deadline)
+
+    async def send_request(self, payload: Dict[str, Any], timeout: float = 30.0) -> Dict:
+        if not self.connected:
+            raise NotConnected
+
+        def encode(nonce: str) -> bytes:
+            return self.negotiated_codec.encode({"op": "request", "nonce": nonce, "timeout": timeout, **payload})
+
+        return await send_request(self.waiters, encode, self.websocket.send, self.cancel_request, timeout, self.max_size)
+
+    async def cancel_request(self, nonce: str) -> None:
+        # lets the cluster drop the request instead of waiting for the other shard
+        with contextlib.suppress(ConnectionClosed):
+            await self.websocket.send(self.negotiated_codec.encode({"op": "request", "nonce": nonce, "cancel": True}))
+
+    async def publish(self, topic: str, data: Any = None) -> None:
+        """|coro|
+
+        Sends an event to every client subscribed to the topic with :meth:`Client.subscribe`.
+        The events are delivered at most once, a subscriber that falls behind loses the oldest ones.
+        Raises `ValueError` if the encoded event is larger than `max_size`
+
+        Parameters
+        ----------
+        topic: :class:`str`
+            The topic of the event
+        data: `Any`
+            The data of the event
+        """
+
+        if not self.connected:
+            raise NotConnected
+
+        message = self.negotiated_codec.encode({
+            "op": "publish",
+            "topic": topic,
+            "data": data
+        })
+
+        if exceeds(message, self.max_size):
+            raise ValueError(too_large(len(message), self.max_size)["error"])
+        await self.websocket.send(message)
+
+    async def invalidate(self, endpoint: str, **kwargs: Any) -> None:
+        """|coro|
+
+        Removes cached responses of an endpoint from the cluster
+
+        Parameters
+        ----------
+        endpoint: :class:`str`
+            The endpoint whose responses should be removed
+        **kwargs: `Any`
+            The kwargs of the cached response. If not provided every response of the endpoint is removed
+        """
+
+        if not self.websocket:
+            raise NotConnected
+
+        await self.websocket.send(
+            self.negotiated_codec.encode({
+                "op": "invalidate",
+                "endpoint": endpoint,
+                "kwargs": kwargs
+            })
+        )
 
     async def disconnect(self) -> None:
         """|coro|
@@ -181,15 +896,21 @@ class Shard:
 
         """
 
+        self.closing = True
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+
+        if self.monitor is not None:
+            self.monitor.cancel()
+            self.monitor = None
+
         if self.websocket:
-            async with connect(
-                self.base_url + "/disconnect_shard",
-                extra_headers={
-                    "Secret-Key": str(self.secret_key).encode("UTF-8"),
-                    "Shard-ID": self.shard_id
-                }
-            ):
-                pass
+            with contextlib.suppress(ConnectionClosed):
+                # the cluster removes the replica right away instead of waiting for it to reconnect
+                await self.websocket.send(self.negotiated_codec.encode({"op": "disconnect"}))
             await self.websocket.close()
+
+            if self.shared_memory is not None:
+                self.shared_memory.close()
         else:
             raise NotConnected
\ No newline at end of file
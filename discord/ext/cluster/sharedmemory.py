@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import os
+import sys
+
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+from discord.ext.cluster.codec import Codec, get_codec
+
+if TYPE_CHECKING:
+    from discord.ext.cluster.metrics import Metrics
+
+if os.name == "posix":
+    import _posixshmem
+    from multiprocessing import resource_tracker, shared_memory
+else:
+    _posixshmem = resource_tracker = shared_memory = None
+
+# where Linux keeps the segments, the leftovers of crashed processes are looked up there
+SEGMENT_DIRECTORY = "/dev/shm"
+
+def open_segment(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create, size, track=False)
+
+    # before 3.13 every process that opens a segment registers it with the resource tracker,
+    # which unlinks it when the process exits, so the lifetime is managed here instead
+    segment = shared_memory.SharedMemory(name, create, size)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+def unlink_segment(name: str) -> None:
+    # `SharedMemory.unlink` would unregister the segment from the resource tracker a second time
+    _posixshmem.shm_unlink(f"/{name}")
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def read_segment(descriptor: Dict[str, Any]) -> Dict[str, Any]:
+    """|method|
+
+    Decodes a response that the shard has written into shared memory.
+    The name of the segment is unlinked as soon as it is attached, so the memory is freed
+    once the mapping is closed and nobody else can claim the same response
+
+    Parameters
+    ----------
+    descriptor: :class:`Dict`
+        The `name`, `size` and `codec` of the segment
+    """
+
+    try:
+        segment = open_segment(descriptor["name"])
+    except FileNotFoundError:
+        return {
+            "error": "The shared memory of the response has expired!",
+            "code": 410
+        }
+
+    try:
+        unlink_segment(descriptor["name"])
+        codec: Codec = get_codec(descriptor.get("codec"))
+
+        with segment.buf[:descriptor["size"]] as view:
+            # orjson and msgpack read the mapping directly, stdlib JSON needs a copy
+            return codec.decode(view if codec.name != "json" else bytes(view))
+    finally:
+        segment.close()
+
+class SharedMemoryReply(dict):
+    """|class|
+
+    A response that points to shared memory. Every hop marks it with the `shared_memory` flag
+    next to the response instead of in it, so the data of a route is never mistaken for a descriptor
+    """
+
+    __slots__: Tuple[str] = ()
+
+class SharedMemoryPolicy:
+    """|class|
+
+    Sends the responses that are larger than the threshold through shared memory. The shard writes the encoded
+    response into a segment and only its name travels through the cluster, the client reads it from the segment.
+    Only works when the shard and the client run on the same host and it requires a POSIX system.
+
+    The name of a segment is its only reference until the client attaches it. The client unlinks the name
+    right away and the memory is freed when its mapping is closed. Names that weren't claimed are unlinked
+    by the shard after the `ttl`, and the names left behind by crashed processes are unlinked by the next
+    shard that starts.
+
+    Parameters:
+    ----------
+    threshold: `int`
+        Responses of at least this many bytes are sent through shared memory
+    ttl: `float`
+        How many seconds an unclaimed segment is kept
+    prefix: `str`
+        The prefix of the segment names
+
+    Attributes:
+    ----------
+    segments: `Dict[str, asyncio.TimerHandle]`
+        The unclaimed segments by name
+    written: `int`
+        Bytes written into segments
+    claimed: `int`
+        Segments that were read by a client, counted when their `ttl` runs out
+    expired: `int`
+        Segments that were unlinked by the shard
+    """
+
+    __slots__: Tuple[str] = ("threshold", "ttl", "prefix", "counter", "segments", "written", "claimed", "expired")
+
+    def __init__(self, threshold: int = 1024 * 1024, ttl: float = 30.0, prefix: str = "better_cluster") -> None:
+        if shared_memory is None:
+            raise RuntimeError("Shared memory responses are only supported on POSIX systems!")
+
+        self.threshold = threshold
+        self.ttl = ttl
+        self.prefix = prefix
+        self.counter = itertools.count()
+        self.segments: Dict[str, asyncio.TimerHandle] = {}
+
+        self.written: int = 0
+        self.claimed: int = 0
+        self.expired: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} threshold={self.threshold} segments={len(self.segments)}>"
+
+    def export(self, data: bytes, codec: Codec) -> Optional[Dict[str, Any]]:
+        """|method|
+
+        Writes the encoded response into a new segment and returns its descriptor.
+        Returns `None` if the response is below the threshold
+
+        Parameters
+        ----------
+        data: :class:`bytes`
+            The encoded response
+        codec: :class:`Codec`
+            The codec that encoded it
+        """
+
+        if len(data) < self.threshold:
+            return None
+
+        # the PID in the name tells the sweep whose segment it is
+        name = f"{self.prefix}_{os.getpid()}_{next(self.counter)}"
+        segment = open_segment(name, create=True, size=len(data))
+        try:
+            segment.buf[:len(data)] = data
+        finally:
+            segment.close()
+
+        self.written += len(data)
+        self.segments[name] = asyncio.get_running_loop().call_later(self.ttl, self.release, name)
+        return {
+            "name": name,
+            "size": len(data),
+            "codec": codec.name
+        }
+
+    def release(self, name: str) -> None:
+        if (handle := self.segments.pop(name, None)) is not None:
+            handle.cancel()
+
+        try:
+            unlink_segment(name)
+        except FileNotFoundError:
+            self.claimed += 1
+        else:
+            self.expired += 1
+
+    def close(self) -> None:
+        """|method|
+
+        Unlinks every segment that wasn't claimed yet
+
+        """
+
+        for name in list(self.segments):
+            self.release(name)
+
+    def sweep(self) -> int:
+        """|method|
+
+        Unlinks the segments of processes that are no longer running
+        and returns how many were removed. Only works on Linux
+
+        """
+
+        if not os.path.isdir(SEGMENT_DIRECTORY):
+            return 0
+
+        removed = 0
+        for name in os.listdir(SEGMENT_DIRECTORY):
+            prefix, _, rest = name.rpartition("_")[0].rpartition("_")
+            if prefix != self.prefix or not rest.isdigit() or is_alive(int(rest)):
+                continue
+
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(SEGMENT_DIRECTORY, name))
+                removed += 1
+        return removed
+
+    def describe(self, metrics: Metrics, prefix: str) -> None:
+        """|method|
+
+        Registers the shared memory metrics under the prefix
+
+        Parameters
+        ----------
+        metrics: :class:`Metrics`
+            The registry of the shard
+        prefix: :class:`str`
+            `shard`
+        """
+
+        metrics.describe(f"{prefix}_shared_memory_bytes_total", "counter", "Bytes of the responses sent through shared memory")
+        metrics.describe(f"{prefix}_shared_memory_segments", "gauge", "Segments by state, unclaimed ones are waiting for the client")
+
+        metrics.collector(f"{prefix}_shared_memory_bytes_total", lambda: [({}, self.written)])
+        metrics.collector(f"{prefix}_shared_memory_segments", lambda: [
+            ({"state": "unclaimed"}, len(self.segments)),
+            ({"state": "claimed"}, self.claimed),
+            ({"state": "expired"}, self.expired)
+        ])
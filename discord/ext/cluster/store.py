@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import json
+import time
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Optional, Set, Tuple, Union
+from discord.ext.cluster.errors import StoreError
+
+if TYPE_CHECKING:
+    from websockets.server import WebSocketServerProtocol
+
+MISSING: Any = object()
+
+class Store:
+    """|class|
+
+    An in-memory key-value store hosted by the cluster. Keys can expire and when the values
+    take more than the memory cap, the least recently used keys are evicted first.
+
+    Parameters:
+    ----------
+    max_bytes: `int`
+        How many bytes the keys and the JSON encoded values can take
+
+    Attributes:
+    ----------
+    size: `int`
+        Bytes taken by the keys and values
+    evictions: `int`
+        Keys evicted because of the memory cap
+    """
+
+    __slots__: Tuple[str] = ("max_bytes", "entries", "watchers", "removed", "size", "evictions")
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, Tuple[Optional[float], Any, int]] = OrderedDict()
+        self.watchers: Dict[str, Set[WebSocketServerProtocol]] = {}
+        # the watchers of the keys that were changed, deleted, evicted or expired since the last `changes()`
+        self.removed: Dict[str, Set[WebSocketServerProtocol]] = {}
+        self.size: int = 0
+        self.evictions: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} keys={len(self.entries)} size={self.size} max_bytes={self.max_bytes}>"
+
+    def lookup(self, key: str) -> Optional[Tuple[Optional[float], Any, int]]:
+        if (entry := self.entries.get(key)) is None:
+            return None
+
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            self.remove(key)
+            return None
+
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key: str) -> Tuple[Any, Optional[float]]:
+        """|method|
+
+        Returns the value and the seconds left until it expires,
+        the value is `MISSING` if the key doesn't exist
+
+        """
+
+        if (entry := self.lookup(key)) is None:
+            return MISSING, None
+        return entry[1], None if entry[0] is None else entry[0] - time.monotonic()
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        size = len(key) + len(json.dumps(value, separators=(",", ":"), default=str))
+        if size > self.max_bytes:
+            raise ValueError(f"The value of {key!r} is larger than the store!")
+
+        self.remove(key)
+        self.entries[key] = (None if ttl is None else time.monotonic() + ttl, value, size)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def incr(self, key: str, amount: Union[int, float] = 1, ttl: Optional[float] = None) -> Union[int, float]:
+        if (entry := self.lookup(key)) is None:
+            self.set(key, amount, ttl)
+            return amount
+
+        if isinstance(entry[1], bool) or not isinstance(entry[1], (int, float)):
+            raise TypeError(f"The value of {key!r} is not a number!")
+
+        # the key keeps its expiry unless a new ttl is given
+        expires = entry[0] if ttl is None else time.monotonic() + ttl
+        self.set(key, value := entry[1] + amount, None if expires is None else expires - time.monotonic())
+        return value
+
+    def delete(self, key: str) -> bool:
+        return self.remove(key)
+
+    def remove(self, key: str) -> bool:
+        if (entry := self.entries.pop(key, None)) is None:
+            return False
+
+        self.size -= entry[2]
+        # every change goes through here, so the watchers are notified once
+        # and watch the key again when they read it
+        if (watchers := self.watchers.pop(key, None)) is not None:
+            self.removed.setdefault(key, set()).update(watchers)
+        return True
+
+    def watch(self, key: str, websocket: WebSocketServerProtocol) -> None:
+        self.watchers.setdefault(key, set()).add(websocket)
+
+    def unwatch(self, websocket: WebSocketServerProtocol) -> None:
+        for key in [key for key, watchers in self.watchers.items() if websocket in watchers]:
+            self.watchers[key].discard(websocket)
+            if not self.watchers[key]:
+                del self.watchers[key]
+
+    def changes(self) -> Dict[str, Set[WebSocketServerProtocol]]:
+        """|method|
+
+        Returns the watchers of the keys that were removed since the last call, by key
+
+        """
+
+        removed, self.removed = self.removed, {}
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self.entries),
+            "size": self.size,
+            "evictions": self.evictions
+        }
+
+class ReadThroughCache:
+    """|class|
+
+    The copies of store values kept by a shard. The cluster tells the shard
+    when a copied key changes, so reads of unchanged keys don't leave the process.
+
+    Parameters:
+    ----------
+    max_entries: `int`
+        How many keys can be cached, the least recently used are evicted first
+    """
+
+    __slots__: Tuple[str] = ("max_entries", "entries", "epoch", "hits", "misses")
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, Tuple[Optional[float], Any]] = OrderedDict()
+        # bumped by every invalidation, a read that overlaps one isn't cached
+        self.epoch: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} size={len(self.entries)} hits={self.hits} misses={self.misses}>"
+
+    def get(self, key: str) -> Any:
+        if (entry := self.entries.get(key)) is not None:
+            if entry[0] is None or entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        self.entries[key] = (None if ttl is None else time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        self.epoch += 1
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+class StoreView:
+    """|class|
+
+    Access to the key-value store of the cluster,
+    available as `Client.store` and `Shard.store`
+
+    Parameters:
+    ----------
+    send: `Callable[[Dict], Awaitable[Dict]]`
+        Sends an operation to the cluster and returns the reply
+    cache: `ReadThroughCache`
+        Keeps copies of the values that were read
+    """
+
+    __slots__: Tuple[str] = ("send", "cache")
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]], cache: Optional[ReadThroughCache] = None) -> None:
+        self.send = send
+        self.cache = cache
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} cache={self.cache!r}>"
+
+    async def call(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if (response := await self.send(payload)).get("code") != 200:
+            raise StoreError(response.get("error"), response.get("code"))
+        return response
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        """|coro|
+
+        Returns the value of the key, or the default if it doesn't exist or has expired
+
+        Parameters
+        ----------
+        key: :class:`str`
+            The key
+        default: `Any`
+            Returned if the key doesn't exist
+        """
+
+        if self.cache is None:
+            response = await self.call({"store": "get", "key": key})
+            return response["value"] if response.get("found") else default
+
+        if (value := self.cache.get(key)) is not MISSING:
+            return value
+
+        epoch = self.cache.epoch
+        response = await self.call({"store": "get", "key": key, "watch": True})
+
+        if not response.get("found"):
+            return default
+
+        # only cached when the cluster will say that it has changed
+        if response.get("watched") and self.cache.epoch == epoch:
+            self.cache.set(key, response["value"], response.get("ttl"))
+        return response["value"]
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """|coro|
+
+        Sets the value of the key
+
+        Parameters
+        ----------
+        key: :class:`str`
+            The key
+        value: `Any`
+            Anything the codecs can encode
+        ttl: :class:`float`
+            After how many seconds the key expires. If not provided it doesn't expire
+        """
+
+        if self.cache is not None:
+            self.cache.invalidate(key)
+        await self.call({"store": "set", "key": key, "value": value, "ttl": ttl})
+
+    async def incr(self, key: str, amount: Union[int, float] = 1, ttl: Optional[float] = None) -> Union[int, float]:
+        """|coro|
+
+        Adds the amount to the value of the key and returns the result.
+        Keys that don't exist start from zero
+
+        Parameters
+        ----------
+        key: :class:`str`
+            The key
+        amount: :class:`int | float`
+            Added to the value, can be negative
+        ttl: :class:`float`
+            Sets a new expiry. If not provided the key keeps its expiry
+        """
+
+        if self.cache is not None:
+            self.cache.invalidate(key)
+        return (await self.call({"store": "incr", "key": key, "amount": amount, "ttl": ttl}))["value"]
+
+    async def delete(self, key: str) -> bool:
+        """|coro|
+
+        Deletes the key and returns whether it existed
+
+        Parameters
+        ----------
+        key: :class:`str`
+            The key
+        """
+
+        if self.cache is not None:
+            self.cache.invalidate(key)
+        return (await self.call({"store": "delete", "key": key}))["deleted"]
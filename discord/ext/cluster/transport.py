@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import random
+
+from uuid import uuid4
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from websockets.exceptions import ConnectionClosed
+from websockets.legacy.client import Connect, connect, unix_connect
+from discord.ext.cluster.errors import NotConnected
+
+UNIX_SCHEME = "unix://"
+
+# the default of websockets, a larger message closes the whole connection with code 1009
+MAX_SIZE = 2 ** 20
+
+def exceeds(message: Any, max_size: Optional[int]) -> bool:
+    return max_size is not None and len(message) > max_size
+
+def too_large(size: int, max_size: Optional[int]) -> Dict[str, Any]:
+    return {
+        "error": f"The message is {size} bytes, larger than the limit of {max_size} bytes!",
+        "code": 413
+    }
+
+async def send_request(
+    waiters: Dict[str, asyncio.Future],
+    encode: Callable[[str], Any],
+    send: Callable[[Any], Awaitable[None]],
+    cancel: Callable[[str], Awaitable[None]],
+    timeout: float,
+    max_size: Optional[int]
+) -> Dict:
+    """|coro|
+
+    Sends a request tagged with a new nonce and waits for the reply that the reader
+    of the connection resolves in `waiters`. The waiter is always removed again.
+
+    Parameters
+    ----------
+    waiters: :class:`Dict[str, asyncio.Future]`
+        The pending requests of the connection by their nonce
+    encode: :class:`Callable[[str], bytes | str]`
+        Encodes the request with the given nonce
+    send: :class:`Callable[[bytes | str], Awaitable[None]]`
+        Sends the encoded request
+    cancel: :class:`Callable[[str], Awaitable[None]]`
+        Tells the cluster to drop the request with the given nonce
+    timeout: :class:`float`
+        The deadline of the request in seconds, it is enforced by the cluster and the shard as well
+    max_size: :class:`int`
+        The message size limit of the cluster, larger requests are rejected before they are sent
+    """
+
+    nonce = uuid4().hex
+    waiter = asyncio.get_running_loop().create_future()
+    waiters[nonce] = waiter
+
+    try:
+        message = encode(nonce)
+        if exceeds(message, max_size):
+            # the cluster would close the connection and fail the other requests on it
+            return too_large(len(message), max_size)
+
+        try:
+            await send(message)
+        except ConnectionClosed:
+            raise NotConnected("The connection to the cluster was closed!") from None
+
+        # the cluster enforces the deadline, the extra second leaves room for its reply
+        return await asyncio.wait_for(waiter, timeout + 1)
+    except asyncio.TimeoutError:
+        await cancel(nonce)
+        return {
+            "error": "The request timed out!",
+            "code": 504
+        }
+    except asyncio.CancelledError:
+        asyncio.create_task(cancel(nonce))
+        raise
+    finally:
+        waiters.pop(nonce, None)
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    # full jitter, so the processes that lost the same cluster don't reconnect at the same moment
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def is_unix(host: str) -> bool:
+    return host.startswith(UNIX_SCHEME)
+
+def split_address(address: str) -> Tuple[str, Optional[int]]:
+    """|method|
+
+    Splits `host:port` or returns `unix://<path>` as the host without a port
+
+    Parameters
+    ----------
+    address: :class:`str`
+        The address of a cluster node
+    """
+
+    if is_unix(address):
+        return address, None
+
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+def open_websocket(host: str, port: Optional[int], path: str, **kwargs: Any) -> Connect:
+    """|method|
+
+    Opens a websocket to the cluster over TCP, or over a Unix domain socket if the host is `unix://<path>`.
+    The result can be awaited or used as an async context manager.
+
+    Parameters
+    ----------
+    host: :class:`str`
+        The host of the cluster or `unix://` followed by the path of the socket
+    port: :class:`int`
+        The port of the cluster, ignored for Unix sockets
+    path: :class:`str`
+        The path of the request, like `/create_request`
+    """
+
+    if is_unix(host):
+        # the host of the URI is only sent in the handshake, the socket path decides where it connects
+        return unix_connect(host[len(UNIX_SCHEME):], f"ws://localhost{path}", **kwargs)
+    return connect(f"ws://{host}:{port}{path}", **kwargs)
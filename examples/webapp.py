@@ -4,6 +4,14 @@ from discord.ext import cluster
 app = Quart(__name__)
 ipc = cluster.Client()
 
+@app.before_serving
+async def connect():
+    await ipc.connect()
+
+@app.after_serving
+async def close():
+    await ipc.close()
+
 @app.route('/')
 async def main():
     return await ipc.request("get_user_data", 1, user_id=383946213629624322)
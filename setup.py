@@ -52,6 +52,9 @@ setuptools.setup(
     ],
     long_description_content_type="text/markdown",
     install_requires=requirements,
+    extras_require={
+        "speed": ["orjson", "msgpack", "zstandard"]
+    },
     python_requires=">=3.8.0",
     project_urls={
         "Source": "https://github.com/MiroslavRosenov/better-cluster",
@@ -0,0 +1,80 @@
+import asyncio
+import contextlib
+import socket
+
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from discord.ext.cluster import Client, Cluster, Shard
+
+class StubBot:
+    """|class|
+
+    Stands in for `discord.ext.commands.Bot`, it has only what `Shard` needs
+    and keeps the events dispatched by the shard
+
+    Parameters:
+    ----------
+    client_id: `int`
+        The ID reported to the cluster as `client_id`
+    """
+
+    __slots__: Tuple[str] = ("user", "cogs", "events")
+
+    def __init__(self, client_id: int = 1) -> None:
+        self.user = SimpleNamespace(id=client_id)
+        self.cogs: Dict[str, Any] = {}
+        self.events: List[Tuple[str, Tuple[Any, ...]]] = []
+
+    def dispatch(self, event: str, *args: Any) -> None:
+        self.events.append((event, args))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_for(check: Any, timeout: float = 5.0) -> None:
+    # polls the condition, the state of the cluster changes in its own tasks
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not check():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("The condition wasn't met in time")
+        await asyncio.sleep(0.01)
+
+@contextlib.asynccontextmanager
+async def running_cluster(**kwargs: Any) -> AsyncIterator[Cluster]:
+    cluster = Cluster(port=kwargs.pop("port", None) or free_port(), **kwargs)
+    task = asyncio.create_task(cluster.start())
+
+    async def listening() -> bool:
+        with contextlib.suppress(OSError):
+            _, writer = await asyncio.open_connection(cluster.host, cluster.port)
+            writer.close()
+            return True
+        return False
+
+    while not await listening():
+        await asyncio.sleep(0.01)
+
+    try:
+        yield cluster
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+@contextlib.asynccontextmanager
+async def running_shard(cluster: Cluster, shard_id: int = 1, **kwargs: Any) -> AsyncIterator[Shard]:
+    kwargs.setdefault("shard_count", 1)
+    kwargs.setdefault("shard_ids", [0])
+    shard = Shard(kwargs.pop("bot", None) or StubBot(shard_id), shard_id=shard_id, port=cluster.port, **kwargs)
+    await shard.connect()
+    await wait_for(lambda: str(shard_id) in cluster.shards)
+
+    try:
+        yield shard
+    finally:
+        await shard.disconnect()
+
+def client(cluster: Cluster, **kwargs: Any) -> Client:
+    return Client(port=cluster.port, **kwargs)
@@ -0,0 +1,52 @@
+import asyncio
+
+from discord.ext.cluster import Shard
+from helpers import client, running_cluster, running_shard
+
+@Shard.route()
+async def shard_square(self, data):
+    await asyncio.sleep(data.delay)
+    return {"shard": self.user.id, "square": data.n ** 2}
+
+def test_batched_requests_keep_their_order_across_shards():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, 1), running_shard(cluster, 2, shard_ids=[1]):
+                async with client(cluster) as connection:
+                    requests = [("shard_square", x % 2 + 1, {"n": x, "delay": (10 - x) / 1000}) for x in range(10)]
+                    responses = await connection.request_many(requests)
+                    assert responses == [{"shard": x % 2 + 1, "square": x ** 2, "code": 200} for x in range(10)]
+
+    asyncio.run(main())
+
+def test_every_request_of_a_batch_carries_its_own_error():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    responses = await connection.request_many([
+                        ("shard_square", 1, {"n": 2, "delay": 0}),
+                        ("missing_endpoint", 1, {}),
+                        ("shard_square", 9, {"n": 3, "delay": 0})
+                    ])
+
+                    assert responses[0] == {"shard": 1, "square": 4, "code": 200}
+                    assert responses[1]["code"] == 404
+                    assert responses[2]["code"] != 200
+
+    asyncio.run(main())
+
+def test_the_deadline_applies_to_the_whole_batch():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    responses = await connection.request_many([
+                        ("shard_square", 1, {"n": 1, "delay": 0}),
+                        ("shard_square", 1, {"n": 2, "delay": 5})
+                    ], deadline=0.2)
+
+                    assert [x["code"] for x in responses] == [504, 504]
+                    assert not cluster.waiters
+
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+import pytest
+
+from discord.ext.cluster.cluster import REDUCERS
+
+def test_sum_skips_missing_values():
+    assert REDUCERS["sum"]([1, None, 2.5]) == 3.5
+
+def test_concat_flattens_the_lists():
+    assert REDUCERS["concat"]([[1, 2], None, [], [3]]) == [1, 2, 3]
+
+def test_first_non_null():
+    assert REDUCERS["first_non_null"]([None, 0, 1]) == 0
+    assert REDUCERS["first_non_null"]([None]) is None
+
+def test_reducers_accept_generators():
+    assert REDUCERS["sum"](x for x in [1, 2]) == 3
+
+def test_sum_fails_on_values_that_are_not_numbers():
+    with pytest.raises(TypeError):
+        REDUCERS["sum"]([1, "2"])
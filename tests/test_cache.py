@@ -0,0 +1,67 @@
+import asyncio
+
+from discord.ext.cluster import CachePolicy, Shard
+from helpers import client, running_cluster, running_shard, wait_for
+
+calls = []
+
+@Shard.route(cache=CachePolicy(ttl=0.3, max_entries=2, keys=["user_id"]))
+async def cached_profile(self, data):
+    calls.append(data.user_id)
+    if data.user_id < 0:
+        return {"error": "Unknown user!", "code": 404}
+    return {"user_id": data.user_id, "calls": len(calls)}
+
+def test_cached_responses_skip_the_shard():
+    async def main() -> None:
+        calls.clear()
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    first = await connection.request("cached_profile", 1, user_id=1, unused=1)
+                    # only `user_id` is part of the key
+                    assert await connection.request("cached_profile", 1, user_id=1, unused=2) == first
+                    assert calls == [1]
+                    assert cluster.cache_stats()["1"]["cached_profile"]["hits"] == 1
+
+                    # expired after the ttl
+                    await asyncio.sleep(0.35)
+                    await connection.request("cached_profile", 1, user_id=1)
+                    assert calls == [1, 1]
+
+    asyncio.run(main())
+
+def test_errors_are_not_cached_and_entries_are_evicted():
+    async def main() -> None:
+        calls.clear()
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    for _ in range(2):
+                        assert (await connection.request("cached_profile", 1, user_id=-1))["code"] == 404
+                    assert calls == [-1, -1]
+
+                    for user_id in (1, 2, 3, 1):
+                        await connection.request("cached_profile", 1, user_id=user_id)
+                    # only two entries fit, so the first user was evicted by the third
+                    assert calls == [-1, -1, 1, 2, 3, 1]
+
+    asyncio.run(main())
+
+def test_shards_invalidate_the_cached_responses():
+    async def main() -> None:
+        calls.clear()
+        async with running_cluster() as cluster:
+            async with running_shard(cluster) as shard:
+                async with client(cluster) as connection:
+                    await connection.request("cached_profile", 1, user_id=1)
+                    await connection.request("cached_profile", 1, user_id=2)
+
+                    await shard.invalidate("cached_profile", user_id=1)
+                    await wait_for(lambda: cluster.cache_stats()["1"]["cached_profile"]["size"] == 1)
+
+                    await connection.request("cached_profile", 1, user_id=1)
+                    await connection.request("cached_profile", 1, user_id=2)
+                    assert calls == [1, 2, 1]
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import asyncio
+import contextlib
+import json
+
+import websockets
+
+from discord.ext.cluster import Compression, Shard
+from helpers import client, running_cluster, running_shard, wait_for
+
+@Shard.route()
+async def delayed_echo(self, data):
+    await asyncio.sleep(data.delay)
+    return {"n": data.n}
+
+def test_replies_are_matched_to_requests_by_nonce():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, pool_size=1) as connection:
+                    # the later requests finish first, so the replies arrive out of order on one connection
+                    responses = await asyncio.gather(*(
+                        connection.request("delayed_echo", 1, n=x, delay=(50 - x) / 1000) for x in range(50)
+                    ))
+                    assert [x["n"] for x in responses] == list(range(50))
+                    assert len(connection.connections) == 1
+                    assert not connection.connections[0].waiters
+
+    asyncio.run(main())
+
+def test_invalid_secret_key_fails_the_requests():
+    async def main() -> None:
+        async with running_cluster(secret_key="secret") as cluster:
+            async with running_shard(cluster, secret_key="secret"):
+                async with client(cluster, secret_key="wrong") as connection:
+                    response = await asyncio.wait_for(connection.request("delayed_echo", 1, n=1, delay=0), 2)
+                    assert response == {"error": "Invalid secret key!", "code": 401}
+
+                async with client(cluster, secret_key="secret") as connection:
+                    assert await connection.request("delayed_echo", 1, n=1, delay=0) == {"n": 1, "code": 200}
+
+    asyncio.run(main())
+
+def test_messages_of_unauthenticated_clients_are_not_decoded():
+    async def main() -> None:
+        compression = Compression()
+        async with running_cluster(secret_key="secret", compression=compression) as cluster:
+            bomb = compression.compress(json.dumps({"blob": "x" * 8 * 1024 * 1024}).encode())
+            compression.compress_time = 0.0
+
+            async with websockets.connect(f"ws://{cluster.host}:{cluster.port}/create_request", extra_headers={"Compression": "zlib"}) as websocket:
+                await websocket.send(bomb)
+                assert json.loads(await websocket.recv()) == {"error": "Invalid secret key!", "code": 401}
+
+            assert compression.decompress_time == 0.0
+
+    asyncio.run(main())
+
+def test_closed_connections_are_replaced_in_the_background(monkeypatch):
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, pool_size=3) as connection:
+                    opened = []
+
+                    async def refused(*args, **kwargs):
+                        opened.append(args)
+                        raise OSError("refused")
+
+                    monkeypatch.setattr("discord.ext.cluster.client.open_websocket", refused)
+                    await connection.connections[0].close()
+
+                    # served by the open connections while the pool is refilled
+                    for x in range(20):
+                        assert await connection.request("delayed_echo", 1, n=x, delay=0) == {"n": x, "code": 200}
+                    await asyncio.sleep(0.2)
+                    # the failed attempts back off instead of running before every request
+                    assert 1 <= len(opened) <= 3
+
+                    monkeypatch.undo()
+                    connection.refill.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await connection.refill
+                    await connection.request("delayed_echo", 1, n=0, delay=0)
+                    await wait_for(lambda: len([x for x in connection.connections if not x.closed]) == 3)
+
+    asyncio.run(main())
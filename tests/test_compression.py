@@ -0,0 +1,122 @@
+import asyncio
+import zlib
+
+import pytest
+
+from discord.ext.cluster import Shard
+from discord.ext.cluster.codec import CODECS
+from discord.ext.cluster.compression import ALGORITHMS, MARKER, CompressedCodec, Compression, accepted, advertise
+from discord.ext.cluster.errors import MessageTooLarge, NotConnected, UnknownCompression
+from helpers import client, running_cluster, running_shard
+
+@Shard.route()
+async def echo_compressed(self, data):
+    return {"echo": data.blob}
+
+PAYLOAD = {"guilds": [{"id": x, "name": f"guild {x}", "members": x * 10} for x in range(200)]}
+
+@pytest.mark.parametrize("codec", list(CODECS))
+@pytest.mark.parametrize("algorithm", list(ALGORITHMS))
+def test_round_trip(codec, algorithm):
+    compressed = CompressedCodec(CODECS[codec], Compression(algorithm))
+    encoded = compressed.encode(PAYLOAD)
+    assert encoded[:1] == MARKER
+    assert len(encoded) < len(CODECS[codec].encode(PAYLOAD))
+    assert compressed.decode(encoded) == PAYLOAD
+
+@pytest.mark.parametrize("algorithm", list(ALGORITHMS))
+def test_round_trip_with_dictionary(algorithm):
+    dictionary = CODECS["json"].encode(PAYLOAD).encode("UTF-8")
+    compression = Compression(algorithm, dictionaries=[dictionary])
+    assert compression.decompress(compression.compress(dictionary)) == dictionary
+
+def test_small_messages_are_not_compressed():
+    compressed = CompressedCodec(CODECS["json"], Compression(threshold=1024))
+    assert compressed.encode({"a": 1}) == '{"a":1}'
+    assert compressed.decode('{"a":1}') == {"a": 1}
+
+def test_compressed_messages_are_rejected_without_the_settings():
+    encoded = CompressedCodec(CODECS["json"], Compression()).encode(PAYLOAD)
+    with pytest.raises(UnknownCompression):
+        CompressedCodec(CODECS["json"]).decode(encoded)
+
+def test_disabled_compression_still_decompresses():
+    encoded = CompressedCodec(CODECS["json"], Compression()).encode(PAYLOAD)
+    assert CompressedCodec(CODECS["json"], Compression(threshold=None)).decode(encoded) == PAYLOAD
+
+def test_messages_are_only_compressed_for_sides_that_accept_them():
+    compressed = CompressedCodec(CODECS["json"], Compression(), accepted=())
+    assert compressed.encode(PAYLOAD) == CODECS["json"].encode(PAYLOAD)
+    assert CompressedCodec(CODECS["json"], Compression(), accepted=("zlib",)).encode(PAYLOAD)[:1] == MARKER
+
+def test_accepted_algorithms_are_read_from_the_handshake():
+    assert accepted(advertise(Compression())) == tuple(ALGORITHMS)
+    assert accepted(advertise(None)) == ()
+
+@pytest.mark.parametrize("algorithm", list(ALGORITHMS))
+def test_decompressed_size_is_capped(algorithm):
+    # sixteen megabytes of zeros take less than a hundred kilobytes
+    compression = Compression(algorithm, level=9)
+    bomb = compression.compress(bytes(16 * 1024 * 1024))
+    assert len(bomb) < 100 * 1024
+
+    with pytest.raises(MessageTooLarge):
+        compression.decompress(bomb, max_size=1024 * 1024)
+    with pytest.raises(MessageTooLarge):
+        CompressedCodec(CODECS["json"], compression, max_size=1024 * 1024).decode(bomb)
+    assert len(compression.decompress(bomb, max_size=16 * 1024 * 1024)) == 16 * 1024 * 1024
+
+@pytest.mark.parametrize("algorithm", list(ALGORITHMS))
+def test_cap_with_dictionary(algorithm):
+    dictionary = bytes(range(256)) * 4
+    compression = Compression(algorithm, dictionaries=[dictionary])
+    with pytest.raises(MessageTooLarge):
+        compression.decompress(compression.compress(dictionary * 100), max_size=len(dictionary))
+
+def test_truncated_message_is_rejected():
+    with pytest.raises(zlib.error):
+        Compression().decompress(Compression().compress(bytes(range(256)) * 100)[:-10], max_size=1024 * 1024)
+
+def test_oversized_compressed_request_closes_the_connection():
+    async def main() -> None:
+        compression = Compression()
+        async with running_cluster(compression=compression, max_size=64 * 1024) as cluster:
+            async with running_shard(cluster, compression=compression, max_size=64 * 1024):
+                async with client(cluster, compression=compression, max_size=64 * 1024) as connection:
+                    # small on the wire, but four megabytes once decompressed, so the cluster closes the connection
+                    with pytest.raises(NotConnected):
+                        await connection.request("echo_compressed", 1, blob="x" * 4 * 1024 * 1024, deadline=5)
+
+                async with client(cluster, compression=compression, max_size=64 * 1024) as connection:
+                    response = await connection.request("echo_compressed", 1, blob="x" * 32 * 1024)
+                    assert response == {"echo": "x" * 32 * 1024, "code": 200}
+
+    asyncio.run(main())
+
+def test_sides_without_compression_get_plain_messages():
+    async def main() -> None:
+        async with running_cluster(compression=Compression(threshold=64)) as cluster:
+            async with running_shard(cluster):
+                for framed, compression in [(False, None), (True, None), (True, Compression(threshold=64))]:
+                    async with client(cluster, framed=framed, compression=compression) as connection:
+                        response = await connection.request("echo_compressed", 1, blob="x" * 10000)
+                        assert response == {"echo": "x" * 10000, "code": 200}
+
+            async with running_shard(cluster, compression=Compression(threshold=64)):
+                for framed in (False, True):
+                    async with client(cluster, framed=framed) as connection:
+                        response = await connection.request("echo_compressed", 1, blob="x" * 10000)
+                        assert response == {"echo": "x" * 10000, "code": 200}
+
+    asyncio.run(main())
+
+def test_unknown_dictionary_is_rejected():
+    encoded = Compression(dictionaries=[b"sample"]).compress(b"x" * 100)
+    with pytest.raises(UnknownCompression):
+        Compression().decompress(encoded)
+
+def test_stats_count_both_sides():
+    compression = Compression()
+    compression.compress(b"x" * 10000)
+    assert compression.original == 10000
+    assert compression.ratio > 1
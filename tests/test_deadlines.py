@@ -0,0 +1,35 @@
+import asyncio
+
+from discord.ext.cluster import Shard
+from helpers import client, running_cluster, running_shard
+
+@Shard.route()
+async def sleep_for(self, data):
+    await asyncio.sleep(data.timeout)
+    return {"slept": data.timeout}
+
+def test_routes_can_take_a_timeout_argument():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    response = await connection.request("sleep_for", 1, timeout=0.01, deadline=5)
+                    assert response == {"slept": 0.01, "code": 200}
+
+    asyncio.run(main())
+
+def test_missed_deadline_returns_504_and_clears_the_waiters():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, pool_size=1) as connection:
+                    response = await connection.request("sleep_for", 1, timeout=5, deadline=0.2)
+                    assert response["code"] == 504
+
+                    assert not cluster.waiters
+                    assert not connection.connections[0].waiters
+
+                    # the connection is still usable after the deadline was missed
+                    assert await connection.request("sleep_for", 1, timeout=0) == {"slept": 0, "code": 200}
+
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+import asyncio
+
+from helpers import client, running_cluster, running_shard, wait_for
+
+def test_subscribers_receive_the_events_of_their_topics():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster) as shard:
+                async with client(cluster) as connection:
+                    events = connection.subscribe("member_join", "member_leave")
+                    received = asyncio.create_task(events.__anext__())
+                    await wait_for(lambda: "member_join" in cluster.topics)
+
+                    await shard.publish("member_join", {"member_id": 1})
+                    await shard.publish("guild_update", {"guild_id": 1})
+                    await shard.publish("member_leave", {"member_id": 2})
+
+                    assert await received == {"topic": "member_join", "data": {"member_id": 1}, "shard": "1"}
+                    assert await events.__anext__() == {"topic": "member_leave", "data": {"member_id": 2}, "shard": "1"}
+
+                    # the cluster forgets the subscriber once the iterator is closed
+                    await events.aclose()
+                    await wait_for(lambda: not cluster.topics)
+
+    asyncio.run(main())
+
+def test_slow_subscribers_lose_the_oldest_events():
+    async def main() -> None:
+        async with running_cluster(event_buffer=2) as cluster:
+            async with running_shard(cluster) as shard:
+                async with client(cluster) as connection:
+                    events = connection.subscribe("tick", buffer=2)
+                    received = asyncio.create_task(events.__anext__())
+                    await wait_for(lambda: "tick" in cluster.topics)
+
+                    await shard.publish("tick", 0)
+                    assert (await received)["data"] == 0
+
+                    # nobody reads, the shard isn't held up and the newest events are kept
+                    for x in range(1, 50):
+                        await shard.publish("tick", x)
+                    await asyncio.sleep(0.1)
+
+                    assert [(await events.__anext__())["data"] for _ in range(2)] == [48, 49]
+                    await events.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+from discord.ext.cluster.federation import HashRing
+
+NODES = ["10.0.0.1:20000", "10.0.0.2:20000", "10.0.0.3:20000"]
+KEYS = [str(x) for x in range(1000)]
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().owner("1") is None
+
+def test_every_key_has_an_owner():
+    ring = HashRing(NODES)
+    assert {ring.owner(x) for x in KEYS} == set(NODES)
+
+def test_owner_does_not_depend_on_the_order_of_the_nodes():
+    first, second = HashRing(NODES), HashRing(reversed(NODES))
+    assert all(first.owner(x) == second.owner(x) for x in KEYS)
+
+def test_removing_a_node_only_moves_its_keys():
+    before, after = HashRing(NODES), HashRing(NODES[:2])
+    for key in KEYS:
+        if before.owner(key) != NODES[2]:
+            assert after.owner(key) == before.owner(key)
+        else:
+            assert after.owner(key) in NODES[:2]
+
+def test_keys_are_spread_between_the_nodes():
+    ring = HashRing(NODES)
+    owners = [ring.owner(x) for x in KEYS]
+    assert all(owners.count(x) > len(KEYS) / len(NODES) / 2 for x in NODES)
@@ -0,0 +1,60 @@
+import asyncio
+
+from discord.ext.cluster import CachePolicy, Cluster, Shard
+from helpers import client, running_cluster, running_shard
+
+@Shard.route()
+async def framed_echo(self, data):
+    return {"blob": data.blob, "shard": self.user.id}
+
+@Shard.route(cache=CachePolicy(ttl=60))
+async def framed_cached(self, data):
+    return {"n": data.n}
+
+def count_decodes(monkeypatch) -> list:
+    sizes = []
+    decode = Cluster.decode
+
+    async def counted(self, websocket, message):
+        sizes.append(len(message))
+        return await decode(self, websocket, message)
+
+    monkeypatch.setattr(Cluster, "decode", counted)
+    return sizes
+
+def test_framed_requests_are_relayed_without_decoding(monkeypatch):
+    async def main() -> None:
+        sizes = count_decodes(monkeypatch)
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, framed=True) as connection:
+                    response = await connection.request("framed_echo", 1, blob="x" * 64 * 1024)
+                    assert response == {"blob": "x" * 64 * 1024, "shard": 1, "code": 200}
+                    assert sizes == []
+
+    asyncio.run(main())
+
+def test_framed_and_plain_requests_get_the_same_response():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, framed=True) as framed, client(cluster) as plain:
+                    assert await framed.request("framed_echo", 1, blob="a") == await plain.request("framed_echo", 1, blob="a")
+                    assert (await framed.request("missing_endpoint", 1))["code"] == 404
+                    assert (await framed.request("framed_echo", 7, blob="a"))["code"] == 404
+
+    asyncio.run(main())
+
+def test_framed_requests_for_cached_endpoints_are_decoded(monkeypatch):
+    async def main() -> None:
+        sizes = count_decodes(monkeypatch)
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, framed=True) as connection:
+                    assert await connection.request("framed_cached", 1, n=1) == {"n": 1, "code": 200}
+                    assert await connection.request("framed_cached", 1, n=1) == {"n": 1, "code": 200}
+                    # the kwargs of both requests and the reply that is cached
+                    assert len(sizes) == 3
+                    assert cluster.cache_stats()["1"]["framed_cached"]["hits"] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+import asyncio
+
+from discord.ext.commands import Cog
+from discord.ext.cluster import Shard
+from discord.ext.cluster.objects import Limiter
+from helpers import StubBot
+
+def test_limiter_is_full_when_the_queue_is():
+    limiter = Limiter(max_concurrency=2, queue_size=1)
+    limiter.pending = 2
+    assert not limiter.full
+    limiter.pending = 3
+    assert limiter.full
+    assert not Limiter(max_concurrency=1, queue_size=None).full
+
+def test_limiter_bounds_concurrency():
+    async def main() -> int:
+        limiter = Limiter(max_concurrency=2, queue_size=None)
+        running = peak = 0
+
+        async def work() -> None:
+            nonlocal running, peak
+            async with limiter.semaphore:
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(work() for _ in range(6)))
+        return peak
+
+    assert asyncio.run(main()) == 2
+
+class LimitedCog(Cog):
+    @Shard.route(max_concurrency=1, queue_size=1)
+    async def limited_cog_route(self, data):
+        return {}
+
+def test_removed_cogs_drop_the_limiter_state():
+    shard = Shard(StubBot(), shard_id=1)
+    cog = LimitedCog()
+
+    assert shard.bind_routes(cog)
+    assert shard.admit("limited_cog_route") is None
+    shard.release("limited_cog_route")
+    assert shard.unbind_routes(cog)
+    assert "limited_cog_route" not in shard.limiters
+
+def test_limiter_of_a_removed_cog_outlives_its_running_requests():
+    shard = Shard(StubBot(), shard_id=1)
+    cog = LimitedCog()
+
+    shard.bind_routes(cog)
+    assert shard.admit("limited_cog_route") is None
+    shard.unbind_routes(cog)
+
+    # added back while a request still runs, so the slot it holds is kept
+    shard.bind_routes(cog)
+    assert shard.admit("limited_cog_route") is None
+    assert shard.admit("limited_cog_route")["code"] == 429
+
+    shard.unbind_routes(cog)
+    shard.release("limited_cog_route")
+    assert "limited_cog_route" in shard.limiters
+    shard.release("limited_cog_route")
+    assert "limited_cog_route" not in shard.limiters
@@ -0,0 +1,45 @@
+import asyncio
+
+from discord.ext.cluster import Shard
+from helpers import client, running_cluster, running_shard
+
+@Shard.route()
+async def blob_of(self, data):
+    return {"blob": "x" * data.size}
+
+def test_oversized_responses_are_rejected_with_413():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, max_size=64 * 1024):
+                async with client(cluster, pool_size=1) as connection:
+                    response = await connection.request("blob_of", 1, size=128 * 1024)
+                    assert response["code"] == 413
+
+                    # the connection and the other requests on it are not affected
+                    assert await connection.request("blob_of", 1, size=3) == {"blob": "xxx", "code": 200}
+
+    asyncio.run(main())
+
+def test_413_is_sent_even_if_it_exceeds_a_tiny_limit():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster) as shard:
+                # set after connecting, so it only limits the replies and not what the shard receives
+                shard.max_size = 16
+                async with client(cluster) as connection:
+                    response = await asyncio.wait_for(connection.request("blob_of", 1, size=64), 2)
+                    assert response["code"] == 413
+
+    asyncio.run(main())
+
+def test_oversized_requests_are_rejected_before_they_are_sent():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster, pool_size=1, max_size=1024) as connection:
+                    response = await connection.request("blob_of", 1, size=0, padding="x" * 2048)
+                    assert response["code"] == 413
+                    assert not connection.connections[0].waiters
+                    assert "cluster_requests_total" not in cluster.metrics.counters
+
+    asyncio.run(main())
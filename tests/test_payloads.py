@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import functools
+
+from typing import TYPE_CHECKING, Dict, List, Literal, Optional
+
+import pytest
+
+from discord.ext.cluster.errors import InvalidPayload
+from discord.ext.cluster.objects import ClientPayload, payload_class
+
+if TYPE_CHECKING:
+    from discord import Member
+
+class MemberPayload(ClientPayload):
+    member_id: int
+    nick: Optional[str] = None
+    roles: List[int] = []
+    kind: Literal["user", "bot"] = "user"
+    weight: float = 1.0
+
+async def get_member(self, data: MemberPayload) -> Member:
+    return {}
+
+async def get_later(self, data: LaterPayload) -> Dict:
+    return {}
+
+async def untyped(self, data) -> Dict:
+    return {}
+
+class LaterPayload(ClientPayload):
+    count: int
+
+def request(**kwargs) -> Dict:
+    return {"endpoint": "get_member", "data": kwargs}
+
+def test_fields_are_read_from_the_request():
+    payload = payload_class(get_member)(request(member_id=1, nick="a", kind="bot", weight=2))
+    assert (payload.member_id, payload.nick, payload.roles, payload.kind, payload.weight) == (1, "a", [], "bot", 2)
+
+def test_defaults_are_not_shared():
+    cls = payload_class(get_member)
+    cls(request(member_id=1)).roles.append(1)
+    assert cls(request(member_id=1)).roles == []
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"member_id": "1"},
+    {"member_id": True},
+    {"member_id": 1, "nick": 1},
+    {"member_id": 1, "kind": "webhook"},
+    {"member_id": 1, "weight": False}
+])
+def test_invalid_requests_are_rejected(kwargs):
+    with pytest.raises(InvalidPayload):
+        payload_class(get_member)(request(**kwargs))
+
+def test_only_the_payload_annotation_is_resolved():
+    # the return type only exists for type checkers and the payload class is defined after the route
+    assert payload_class(get_member).__name__ == "MemberPayload"
+    with pytest.raises(InvalidPayload):
+        payload_class(get_later)(request(count="1"))
+
+def test_untyped_payload():
+    assert payload_class(untyped) is ClientPayload
+
+def test_unresolvable_payload_raises():
+    async def route(self, data: Missing) -> Dict:
+        return {}
+
+    with pytest.raises(NameError):
+        payload_class(route)
+
+def test_wrapped_routes_resolve_in_the_module_of_the_route():
+    @functools.wraps(get_member)
+    async def wrapper(*args, **kwargs):
+        return await get_member(*args, **kwargs)
+
+    assert payload_class(wrapper).__name__ == "MemberPayload"
@@ -0,0 +1,73 @@
+import asyncio
+
+from discord.ext.cluster import Shard
+from helpers import client, running_cluster, running_shard, wait_for
+
+@Shard.route()
+async def still_there(self, data):
+    return {"n": data.n}
+
+async def lose_connection(cluster, shard) -> None:
+    # an abnormal close, like a crashed process, unlike `disconnect` which ends the shard on purpose
+    await shard.websocket.close(1011)
+    await wait_for(lambda: "1" in cluster.outages)
+
+def test_requests_wait_for_a_restarted_shard():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, reconnect=False) as shard:
+                await lose_connection(cluster, shard)
+
+            async with client(cluster) as connection:
+                requests = [asyncio.create_task(connection.request("still_there", 1, n=x)) for x in range(5)]
+                await wait_for(lambda: cluster.outages["1"].waiting == 5)
+                assert not any(x.done() for x in requests)
+
+                async with running_shard(cluster):
+                    assert await asyncio.gather(*requests) == [{"n": x, "code": 200} for x in range(5)]
+                    assert "1" not in cluster.outages
+
+    asyncio.run(main())
+
+def test_requests_wait_for_a_shard_that_reconnects_by_itself():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, reconnect=True) as shard:
+                async with client(cluster) as connection:
+                    await lose_connection(cluster, shard)
+                    assert await connection.request("still_there", 1, n=1, deadline=5) == {"n": 1, "code": 200}
+
+    asyncio.run(main())
+
+def test_buffered_requests_fail_after_the_grace_period():
+    async def main() -> None:
+        async with running_cluster(grace_period=0.2) as cluster:
+            async with running_shard(cluster, reconnect=False) as shard:
+                await lose_connection(cluster, shard)
+
+            async with client(cluster) as connection:
+                # the shard is dropped once the grace period is over, so it's unknown like any other
+                response = await connection.request("still_there", 1, n=1)
+                assert response["code"] == 404
+                assert "1" not in cluster.outages
+
+    asyncio.run(main())
+
+def test_buffered_requests_are_bounded():
+    async def main() -> None:
+        async with running_cluster(max_buffered=2) as cluster:
+            async with running_shard(cluster, reconnect=False) as shard:
+                await lose_connection(cluster, shard)
+
+            async with client(cluster) as connection:
+                requests = [asyncio.create_task(connection.request("still_there", 1, n=x)) for x in range(2)]
+                await wait_for(lambda: cluster.outages["1"].waiting == 2)
+
+                response = await connection.request("still_there", 1, n=2)
+                assert response["code"] == 503
+                assert response["retryable"]
+
+                async with running_shard(cluster):
+                    assert await asyncio.gather(*requests) == [{"n": x, "code": 200} for x in range(2)]
+
+    asyncio.run(main())
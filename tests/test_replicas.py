@@ -0,0 +1,45 @@
+import asyncio
+import collections
+
+import pytest
+
+from discord.ext.cluster import Shard
+from helpers import StubBot, client, running_cluster, running_shard, wait_for
+
+@Shard.route()
+async def replica_of(self, data):
+    await asyncio.sleep(data.delay)
+    return {"replica": self.user.id}
+
+@pytest.mark.parametrize("balancer", ["least_in_flight", "power_of_two"])
+def test_requests_are_balanced_between_replicas(balancer):
+    async def main() -> None:
+        async with running_cluster(balancer=balancer) as cluster:
+            async with running_shard(cluster, bot=StubBot(10), replica=True):
+                async with running_shard(cluster, bot=StubBot(20), replica=True):
+                    await wait_for(lambda: len(cluster.shards["1"]) == 2)
+
+                    async with client(cluster) as connection:
+                        responses = await asyncio.gather(*(
+                            connection.request("replica_of", 1, delay=0.05) for _ in range(40)
+                        ))
+
+                    served = collections.Counter(x["replica"] for x in responses)
+                    assert set(served) == {10, 20}
+                    assert min(served.values()) >= 10
+
+    asyncio.run(main())
+
+def test_the_remaining_replica_takes_over():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, bot=StubBot(10), replica=True):
+                async with running_shard(cluster, bot=StubBot(20), replica=True):
+                    await wait_for(lambda: len(cluster.shards["1"]) == 2)
+
+                await wait_for(lambda: len(cluster.shards["1"]) == 1)
+                async with client(cluster) as connection:
+                    responses = [await connection.request("replica_of", 1, delay=0) for _ in range(5)]
+                    assert responses == [{"replica": 10, "code": 200}] * 5
+
+    asyncio.run(main())
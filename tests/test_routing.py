@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from discord.ext.cluster import Shard
+from discord.ext.cluster.cluster import parse_snowflake
+from helpers import client, running_cluster, running_shard
+
+@pytest.mark.parametrize("value, expected", [
+    (123, 123),
+    ("123456789012345678", 123456789012345678),
+    ("abc", None),
+    ("-1", None),
+    (-1, None),
+    (True, None),
+    (None, None),
+    ([1], None)
+])
+def test_parse_snowflake(value, expected):
+    assert parse_snowflake(value) == expected
+
+@Shard.route()
+async def guild_owner(self, data):
+    return {"shard": self.user.id, "guild_id": data.data.get("guild_id")}
+
+def guild_of(discord_shard: int) -> int:
+    # the Discord shard of a guild is (guild_id >> 22) % shard_count
+    return (1000 + discord_shard) << 22
+
+def test_requests_are_routed_by_guild():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, 1, shard_count=2, shard_ids=[0]), running_shard(cluster, 2, shard_count=2, shard_ids=[1]):
+                async with client(cluster) as connection:
+                    for discord_shard, owner in [(0, 1), (1, 2)]:
+                        guild_id = guild_of(discord_shard)
+                        assert await connection.request("guild_owner", guild_id=guild_id) == {"shard": owner, "guild_id": guild_id, "code": 200}
+                        assert await connection.request("guild_owner", guild_id=str(guild_id)) == {"shard": owner, "guild_id": str(guild_id), "code": 200}
+
+                    async with client(cluster, framed=True) as framed:
+                        assert (await framed.request("guild_owner", guild_id=guild_of(1)))["shard"] == 2
+
+    asyncio.run(main())
+
+def test_guild_id_is_passed_to_the_endpoint_with_a_shard_id():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, 1, shard_count=2, shard_ids=[0]):
+                async with client(cluster) as connection:
+                    assert await connection.request("guild_owner", 1, guild_id=guild_of(1)) == {"shard": 1, "guild_id": guild_of(1), "code": 200}
+
+    asyncio.run(main())
+
+def test_invalid_guild_id_is_rejected():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                for framed in (False, True):
+                    async with client(cluster, framed=framed) as connection:
+                        assert (await connection.request("guild_owner", guild_id="abc"))["code"] == 400
+
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import asyncio
+
+from discord.ext.cluster import Shard
+from helpers import running_cluster, running_shard
+
+@Shard.route()
+async def whoami(self, data):
+    await asyncio.sleep(data.delay)
+    return {"shard": self.user.id, "n": data.n}
+
+def test_shards_request_each_other_through_the_cluster():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, 1) as first, running_shard(cluster, 2, shard_ids=[1]) as second:
+                responses = await asyncio.gather(*(
+                    first.request(2, "whoami", n=x, delay=(20 - x) / 1000) for x in range(20)
+                ))
+                assert responses == [{"shard": 2, "n": x, "code": 200} for x in range(20)]
+                assert await second.request(1, "whoami", n=0, delay=0) == {"shard": 1, "n": 0, "code": 200}
+                assert not first.waiters
+
+    asyncio.run(main())
+
+def test_requests_to_the_own_shard_call_the_route_directly():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster) as shard:
+                assert await shard.request(1, "whoami", n=3, delay=0) == {"shard": 1, "n": 3, "code": 200}
+                assert "cluster_requests_total" not in cluster.metrics.counters
+
+    asyncio.run(main())
+
+def test_shard_requests_time_out_and_clear_the_waiters():
+    async def main() -> None:
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, 1) as first, running_shard(cluster, 2, shard_ids=[1]):
+                response = await first.request(2, "whoami", n=0, delay=5, deadline=0.2)
+                assert response["code"] == 504
+                assert not first.waiters
+                assert not cluster.waiters
+
+                assert await first.request(2, "whoami", n=1, delay=0) == {"shard": 2, "n": 1, "code": 200}
+
+    asyncio.run(main())
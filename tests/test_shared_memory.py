@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+import pytest
+
+from discord.ext.cluster import Offload, Shard, SharedMemoryPolicy
+from helpers import client, running_cluster, running_shard
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="shared memory responses need POSIX shared memory")
+
+@Shard.route()
+async def large_blob(self, data):
+    return {"blob": "x" * data.size}
+
+def segments(prefix: str) -> list:
+    return [x for x in os.listdir("/dev/shm") if x.startswith(prefix)]
+
+def test_large_responses_are_read_from_shared_memory():
+    async def main() -> None:
+        policy = SharedMemoryPolicy(threshold=1024, prefix="better_cluster_test")
+        offload = Offload(threshold=64 * 1024)
+
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, shared_memory=policy):
+                async with client(cluster, shared_memory=True, offload=offload) as connection:
+                    # above the limit of the websockets, so it can only arrive through shared memory
+                    response = await connection.request("large_blob", 1, size=2 * 1024 * 1024)
+                    assert response == {"blob": "x" * 2 * 1024 * 1024, "code": 200}
+                    assert offload.offloaded["decode"] == 1
+
+                    # below the threshold of the offload, so it's read inline
+                    assert await connection.request("large_blob", 1, size=4096) == {"blob": "x" * 4096, "code": 200}
+                    assert offload.offloaded["decode"] == 1
+
+                    # the segments are unlinked once they are read
+                    assert not segments("better_cluster_test")
+
+    asyncio.run(main())
+
+def test_clients_without_shared_memory_get_the_response_inline():
+    async def main() -> None:
+        policy = SharedMemoryPolicy(threshold=1024, prefix="better_cluster_test")
+
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, shared_memory=policy):
+                async with client(cluster) as connection:
+                    assert await connection.request("large_blob", 1, size=4096) == {"blob": "x" * 4096, "code": 200}
+                    assert not segments("better_cluster_test")
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import pytest
+
+from discord.ext.cluster import store
+from discord.ext.cluster.store import MISSING, ReadThroughCache, Store
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(store.time, "monotonic", clock)
+    return clock
+
+def test_get_set_and_delete():
+    cache = Store()
+    cache.set("key", {"a": 1})
+    assert cache.get("key") == ({"a": 1}, None)
+    assert cache.delete("key")
+    assert not cache.delete("key")
+    assert cache.get("key") == (MISSING, None)
+    assert cache.size == 0
+
+def test_key_expires_after_ttl(clock):
+    cache = Store()
+    cache.set("key", 1, ttl=10)
+    clock.now += 4
+    assert cache.get("key") == (1, 6)
+    clock.now += 6
+    assert cache.get("key") == (MISSING, None)
+    assert "key" not in cache.entries and cache.size == 0
+
+def test_incr_keeps_the_expiry(clock):
+    cache = Store()
+    assert cache.incr("key", 2, ttl=10) == 2
+    clock.now += 5
+    assert cache.incr("key", 3) == 5
+    clock.now += 5
+    assert cache.get("key") == (MISSING, None)
+
+def test_incr_rejects_values_that_are_not_numbers():
+    cache = Store()
+    cache.set("key", True)
+    with pytest.raises(TypeError):
+        cache.incr("key")
+
+def test_least_recently_used_key_is_evicted():
+    cache = Store(max_bytes=20)
+    cache.set("a", "x" * 5)
+    cache.set("b", "x" * 5)
+    cache.get("a")
+    cache.set("c", "x" * 5)
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.evictions == 1
+    assert cache.size <= cache.max_bytes
+
+def test_value_larger_than_the_store_is_rejected():
+    with pytest.raises(ValueError):
+        Store(max_bytes=10).set("key", "x" * 100)
+
+def test_watchers_are_told_about_changes_once():
+    cache = Store()
+    cache.set("key", 1)
+    cache.watch("key", websocket := object())
+    cache.set("key", 2)
+    assert cache.changes() == {"key": {websocket}}
+    cache.set("key", 3)
+    assert cache.changes() == {}
+
+def test_watchers_are_told_about_evictions_and_expiry(clock):
+    cache = Store(max_bytes=30)
+    cache.set("evicted", "x" * 5)
+    cache.set("expired", "x" * 5, ttl=1)
+    cache.watch("evicted", first := object())
+    cache.watch("expired", second := object())
+
+    cache.get("expired")
+    cache.set("new", "x" * 5)
+    clock.now += 1
+    cache.get("expired")
+
+    assert cache.changes() == {"evicted": {first}, "expired": {second}}
+    assert cache.watchers == {}
+
+def test_closed_websocket_stops_watching():
+    cache = Store()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.watch("a", websocket := object())
+    cache.watch("b", websocket)
+    cache.watch("b", other := object())
+    cache.unwatch(websocket)
+    assert cache.watchers == {"b": {other}}
+
+def test_read_through_cache_expires_and_evicts(clock):
+    cache = ReadThroughCache(max_entries=2)
+    cache.set("a", 1, ttl=5)
+    cache.set("b", 2, None)
+    assert cache.get("a") == 1
+    cache.set("c", 3, None)
+    assert cache.get("b") is MISSING
+    clock.now += 5
+    assert cache.get("a") is MISSING
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from discord.ext.cluster import Shard
+from discord.ext.cluster.errors import StreamError
+from helpers import client, running_cluster, running_shard, wait_for
+
+produced = []
+closed = []
+
+@Shard.route()
+async def count_to(self, data):
+    try:
+        for x in range(data.n):
+            produced.append(x)
+            yield {"x": x, "blob": "x" * data.size if x == data.large else ""}
+    finally:
+        # cleanup that takes a while, it must be done before the end of the stream is sent
+        await asyncio.sleep(0.05)
+        closed.append(data.n)
+
+def reset() -> None:
+    produced.clear()
+    closed.clear()
+
+def test_chunks_arrive_in_order():
+    async def main() -> None:
+        reset()
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    chunks = [x["x"] async for x in connection.stream("count_to", 1, n=50, size=0, large=-1)]
+                    assert chunks == list(range(50))
+                    assert closed == [50]
+
+    asyncio.run(main())
+
+def test_a_slow_reader_pauses_the_generator():
+    async def main() -> None:
+        reset()
+        async with running_cluster() as cluster:
+            async with running_shard(cluster):
+                async with client(cluster) as connection:
+                    stream = connection.stream("count_to", 1, n=1000, size=0, large=-1, window=4)
+                    assert (await stream.__anext__())["x"] == 0
+
+                    # without credits from the client the shard stops after the window
+                    await asyncio.sleep(0.2)
+                    assert len(produced) <= 4 + 2
+
+                    await stream.aclose()
+                    await wait_for(lambda: closed == [1000])
+                    assert len(produced) < 1000
+
+    asyncio.run(main())
+
+def test_an_oversized_chunk_ends_the_stream_and_closes_the_generator():
+    async def main() -> None:
+        reset()
+        async with running_cluster() as cluster:
+            async with running_shard(cluster, max_size=64 * 1024):
+                async with client(cluster) as connection:
+                    chunks = []
+                    with pytest.raises(StreamError) as error:
+                        async for chunk in connection.stream("count_to", 1, n=10, size=128 * 1024, large=2):
+                            chunks.append(chunk["x"])
+
+                    assert error.value.code == 413
+                    assert chunks == [0, 1]
+                    assert closed == [10]
+
+    asyncio.run(main())